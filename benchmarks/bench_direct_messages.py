@@ -0,0 +1,80 @@
+"""Measures direct user-to-user PRIVMSG delivery with 50k registered
+users, using the nickname index versus a linear scan of connections.
+
+Usage:
+    python -m benchmarks.bench_direct_messages
+"""
+import logging
+import random
+import time
+
+from irc_core import logger
+from irc_core.connections import Connection
+from irc_server import server
+from irc_server.handlers import messaging, register
+from irc_server.nicknames import nickname_to_lowercase
+
+
+USERS = 50000
+MESSAGES = 20000
+TEXT = 'Hello are you receiving this message ?'
+
+
+class NullSocket:
+    """A stand-in for a socket which accepts everything written to it."""
+
+    def send(self, data):
+        return len(data)
+
+
+def linear_scan(connection, receiver, msg):
+    """Finds the receiver the way it would be found without an index."""
+    lowercase = nickname_to_lowercase(receiver)
+    for conn in server._connections:
+        if conn.nickname is not None and nickname_to_lowercase(conn.nickname) == lowercase:
+            server.send_to(conn, 'PRIVMSG', receiver, msg, prefix=connection.nickname)
+            return
+
+
+def nickname_index(connection, receiver, msg):
+    messaging.relay(connection, 'PRIVMSG', receiver, msg, reply_errors=True)
+
+
+def measure(deliver, pairs, count):
+    start = time.perf_counter()
+    for sender, receiver in pairs[:count]:
+        deliver(sender, receiver, TEXT)
+    elapsed = time.perf_counter() - start
+
+    for conn in server._connections:
+        conn.flush_messages()
+
+    return count / elapsed
+
+
+def main():
+    logger.setLevel(logging.WARNING)
+
+    for i in range(USERS):
+        conn = Connection(NullSocket(), ('127.0.0.1', i))
+        conn.nickname = f'user{i}'
+        conn.registered = True
+        register.nicknames.register(conn.nickname, conn)
+        server._connections.append(conn)
+
+    rng = random.Random(0)
+    pairs = [
+        (rng.choice(server._connections), f'USER{rng.randrange(USERS)}')
+        for _ in range(MESSAGES)
+    ]
+
+    scan = measure(linear_scan, pairs, MESSAGES // 100)
+    index = measure(nickname_index, pairs, MESSAGES)
+
+    print(f'{USERS:,} registered users')
+    print(f'linear scan      {scan:12,.0f} msgs/s')
+    print(f'nickname index   {index:12,.0f} msgs/s')
+
+
+if __name__ == '__main__':
+    main()
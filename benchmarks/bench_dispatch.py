@@ -0,0 +1,76 @@
+"""Compares MessageListener.handle_message against the previous
+asyncio.gather based dispatch, for bound and unknown commands.
+
+Usage:
+    python -m benchmarks.bench_dispatch
+"""
+import asyncio
+import logging
+import time
+
+from irc_core import logger
+from irc_core.message_listener import MessageListener
+from irc_core.parser import parse_message
+
+
+MESSAGES = 50000
+
+
+class LegacyMessageListener(MessageListener):
+    """Dispatches the way handle_message used to: two lookups, a list of
+    bound functions, and an asyncio.gather per message."""
+
+    async def handle_message(self, connection, message):
+        logger.debug("received message %s from %s", message, connection)
+        cmd, prefix, params = parse_message(message)
+
+        general_func = self.general_message_handlers.get(cmd)
+        specific_func = self.specific_message_handlers.get((cmd, connection))
+
+        bound_funcs = []
+        if general_func:
+            bound_funcs.extend(general_func)
+        if specific_func:
+            bound_funcs.extend(specific_func)
+
+        if not bound_funcs:
+            logger.warning("received unknown message type %s", cmd)
+            return
+
+        futures = [
+            f(connection, *params, prefix=prefix)
+            for f in bound_funcs
+        ]
+        await asyncio.gather(*futures)
+
+
+async def on_privmsg(connection, receivers, msg=None, prefix=None):
+    pass
+
+
+async def measure(name, listener, message):
+    listener.on('PRIVMSG')(on_privmsg)
+    connection = object()
+
+    start = time.perf_counter()
+    for _ in range(MESSAGES):
+        await listener.handle_message(connection, message)
+    elapsed = time.perf_counter() - start
+
+    print(f'{name:<32} {MESSAGES / elapsed:12,.0f} msgs/s')
+
+
+async def main():
+    logger.setLevel(logging.ERROR)
+
+    privmsg = b':Angel PRIVMSG #global :Hello are you receiving this message ?'
+    unknown = b':Angel FOO #global :Hello are you receiving this message ?'
+
+    await measure('legacy gather (bound)', LegacyMessageListener(), privmsg)
+    await measure('dispatch table (bound)', MessageListener(), privmsg)
+    await measure('legacy gather (unknown)', LegacyMessageListener(), unknown)
+    await measure('dispatch table (unknown)', MessageListener(), unknown)
+
+
+if __name__ == '__main__':
+    asyncio.run(main())
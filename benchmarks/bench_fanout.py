@@ -0,0 +1,65 @@
+"""Measures channel PRIVMSG relay throughput against channel size, for
+one send_to() per member versus a single send_to_many() fan-out.
+
+Usage:
+    python -m benchmarks.bench_fanout
+"""
+import time
+
+from irc_core.connections import Connection
+from irc_server.server import Server
+
+
+CHANNEL_SIZES = (10, 100, 1000, 5000)
+MESSAGES = 200
+TEXT = 'Hello are you receiving this message ?'
+
+
+class NullSocket:
+    """A stand-in for a socket which accepts everything written to it."""
+
+    def send(self, data):
+        return len(data)
+
+
+def per_member(server, sender, members):
+    for conn in members - {sender}:
+        server.send_to(conn, 'PRIVMSG', '#global', TEXT,
+                       prefix=sender.nickname)
+
+
+def fan_out(server, sender, members):
+    server.send_to_many(members, 'PRIVMSG', '#global', TEXT,
+                        prefix=sender.nickname, exclude=sender)
+
+
+def measure(relay, size):
+    server = Server()
+    members = set()
+    for i in range(size):
+        conn = Connection(NullSocket(), ('127.0.0.1', i))
+        conn.nickname = f'user{i}'
+        members.add(conn)
+    sender = next(iter(members))
+
+    start = time.perf_counter()
+    for _ in range(MESSAGES):
+        relay(server, sender, members)
+    elapsed = time.perf_counter() - start
+
+    for conn in members:
+        conn.flush_messages()
+
+    return MESSAGES / elapsed
+
+
+def main():
+    print(f'{"members":>8} {"send_to msgs/s":>16} {"send_to_many msgs/s":>20} {"speedup":>8}')
+    for size in CHANNEL_SIZES:
+        before = measure(per_member, size)
+        after = measure(fan_out, size)
+        print(f'{size:>8} {before:>16,.0f} {after:>20,.0f} {after / before:>7.1f}x')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,149 @@
+"""Compares flushing outgoing frames with Connection.flush_messages (which
+joins the queue and calls send()) against scatter-gather sendmsg() calls,
+reporting the syscalls made per message and the time per flush. Then
+measures how long a PING waits between being queued and being written,
+when it is written immediately versus at the end of a busy cycle.
+
+Usage:
+    python -m benchmarks.bench_flush
+"""
+import socket
+import time
+from itertools import islice
+
+from irc_core.connections import Connection
+from irc_core.parser import parse_message
+
+
+BURSTS = (1, 10, 100, 1000, 10000)
+MAX_BUFFERS = 512  # per sendmsg() call, below IOV_MAX
+FLUSHES = 100
+LINE = b':Angel PRIVMSG #global :Hello are you receiving this message ?'
+PING = b':irc.example.net PING'
+CYCLE_MESSAGES = 256  # messages handled in the cycle a PING is queued in
+TRIALS = 200
+
+
+class CountingSocket:
+    """Wraps a socket, counting the calls which write to it and when the
+    last one returned."""
+
+    def __init__(self, sock):
+        self._sock = sock
+        self.calls = 0
+        self.written_at = None
+
+    def send(self, data):
+        sent = self._sock.send(data)
+        self.calls += 1
+        self.written_at = time.perf_counter()
+        return sent
+
+    def sendmsg(self, buffers):
+        sent = self._sock.sendmsg(buffers)
+        self.calls += 1
+        self.written_at = time.perf_counter()
+        return sent
+
+
+def sendmsg_flush(conn):
+    """Writes the pending messages with sendmsg(), without joining them."""
+    queue = conn._outgoing_messages
+    while queue:
+        buffers = list(islice(queue, MAX_BUFFERS))
+        wanted = sum(map(len, buffers)) - conn._outgoing_offset
+        if conn._outgoing_offset:
+            buffers[0] = memoryview(buffers[0])[conn._outgoing_offset:]
+        try:
+            sent = conn._socket.sendmsg(buffers)
+        except BlockingIOError:
+            return False
+        conn._outgoing_bytes -= sent
+        offset = conn._outgoing_offset + sent
+        while queue and offset >= len(queue[0]):
+            offset -= len(queue.popleft())
+        conn._outgoing_offset = offset
+        if sent < wanted:
+            return False
+    return True
+
+
+def tcp_pair():
+    listener = socket.create_server(('127.0.0.1', 0))
+    client = socket.create_connection(listener.getsockname())
+    server, _ = listener.accept()
+    listener.close()
+    for sock in (client, server):
+        sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+    server.setblocking(False)
+    return server, client
+
+
+def drain(sock, size):
+    while size:
+        size -= len(sock.recv(min(size, 1 << 20)))
+
+
+def measure_bursts(flush, burst):
+    server, client = tcp_pair()
+    sock = CountingSocket(server)
+    conn = Connection(sock, ('127.0.0.1', 50000))
+
+    elapsed = 0.0
+    for _ in range(FLUSHES):
+        for _ in range(burst):
+            conn.send_message(LINE)
+        queued = conn.outgoing_bytes
+        start = time.perf_counter()
+        while not flush(conn):
+            drain(client, queued - conn.outgoing_bytes)
+            queued = conn.outgoing_bytes
+        elapsed += time.perf_counter() - start
+        drain(client, queued)
+
+    client.close()
+    server.close()
+    return sock.calls / (burst * FLUSHES), elapsed / FLUSHES * 1e6
+
+
+def measure_ping(immediate):
+    server, client = tcp_pair()
+    sock = CountingSocket(server)
+    conn = Connection(sock, ('127.0.0.1', 50000))
+
+    latencies = []
+    for _ in range(TRIALS):
+        queued_at = time.perf_counter()
+        conn.send_message(PING, immediate=immediate)
+        for _ in range(CYCLE_MESSAGES):  # the rest of the cycle
+            parse_message(LINE).params
+        conn.flush_messages()
+        latencies.append(sock.written_at - queued_at)
+        drain(client, len(PING) + 2)
+
+    client.close()
+    server.close()
+    latencies.sort()
+    return latencies[len(latencies) // 2] * 1e6, latencies[int(len(latencies) * 0.99)] * 1e6
+
+
+def main():
+    flushes = (('join+send', Connection.flush_messages), ('sendmsg', sendmsg_flush))
+    print(f'{"burst":>6}' + ''.join(f' {name + " syscalls/msg":>28} {"us/flush":>9}'
+                                    for name, _ in flushes))
+    for burst in BURSTS:
+        row = f'{burst:>6}'
+        for _, flush in flushes:
+            calls, us = measure_bursts(flush, burst)
+            row += f' {calls:>28.4f} {us:>9.1f}'
+        print(row)
+
+    print()
+    print(f'PING queued at the start of a cycle of {CYCLE_MESSAGES} messages:')
+    for name, immediate in (('flushed with the cycle', False), ('written immediately', True)):
+        p50, p99 = measure_ping(immediate)
+        print(f'{name:<24} p50 {p50:8.1f} us  p99 {p99:8.1f} us')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,88 @@
+"""Compares receiving and framing a 1 MB pipelined burst with the
+previous recv() + split() + list.pop(0) approach against Connection.
+
+Usage:
+    python -m benchmarks.bench_framing
+"""
+import time
+
+from irc_core.connections import Connection
+
+
+BURST_SIZE = 1024 * 1024
+LINE = b':Angel PRIVMSG #global :Hello are you receiving this message ?\r\n'
+
+
+class BurstSocket:
+    """A stand-in for a socket which replays a burst of bytes."""
+
+    def __init__(self, data):
+        self._data = memoryview(data)
+        self._offset = 0
+
+    def recv(self, size):
+        chunk = self._data[self._offset:self._offset + size]
+        self._offset += len(chunk)
+        return bytes(chunk)
+
+    def recv_into(self, buffer):
+        chunk = self._data[self._offset:self._offset + len(buffer)]
+        buffer[:len(chunk)] = chunk
+        self._offset += len(chunk)
+        return len(chunk)
+
+
+def legacy_framing(sock):
+    """The previous receive path: recv(512), bytes concatenation,
+    re-splitting the buffer and list.pop(0)."""
+    incoming_buffer = b''
+    incoming_messages = []
+    count = 0
+    while True:
+        new_bytes = sock.recv(512)
+        if not new_bytes:
+            break
+        incoming_buffer += new_bytes
+        *msgs, incoming_buffer = incoming_buffer.split(b'\r\n')
+        incoming_messages += msgs
+    while incoming_messages:
+        incoming_messages.pop(0)
+        count += 1
+    return count
+
+
+def connection_framing(sock, read_size):
+    conn = Connection(sock, ('127.0.0.1', 50000), read_size=read_size)
+    count = 0
+    while True:
+        try:
+            conn.read_messages()
+        except EOFError:
+            break
+    while conn.pending_messages:
+        conn.next_message()
+        count += 1
+    return count
+
+
+def measure(name, func, burst, repeat=5):
+    best = float('inf')
+    for _ in range(repeat):
+        start = time.perf_counter()
+        count = func(BurstSocket(burst))
+        best = min(best, time.perf_counter() - start)
+    print(f'{name:<28} {best * 1000:8.2f} ms  {count / best:12,.0f} msgs/s')
+
+
+def main():
+    burst = LINE * (BURST_SIZE // len(LINE))
+    print(f'framing {len(burst):,} bytes ({len(burst) // len(LINE):,} messages)')
+
+    measure('recv + split + pop(0)', legacy_framing, burst)
+    for read_size in (512, 4096, 65536):
+        measure(f'recv_into (read_size={read_size})',
+                lambda sock: connection_framing(sock, read_size), burst)
+
+
+if __name__ == '__main__':
+    main()
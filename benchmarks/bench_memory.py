@@ -0,0 +1,95 @@
+"""Measures the memory held per idle registered connection, at 10k and
+100k clients, and checks it against BUDGET.
+
+Each client is a Connection which receives its NICK and USER through the
+read path, is registered with the nickname index and joined to #global,
+and has the end of its NAMES reply flushed, as after a real registration.
+It is then left idle. The whole registration isn't run through the handlers,
+since every JOIN would be sent to every member of #global.
+
+Usage:
+    python -m benchmarks.bench_memory
+"""
+import gc
+import sys
+import tracemalloc
+
+from irc_core.connections import Connection
+from irc_core.parser import frame_cached
+from irc_core.replies import RPL_ENDOFNAMES
+from irc_server.channels import ChannelRegistry
+from irc_server.nicknames import NicknameRegistry
+
+
+CLIENTS = (10000, 100000)
+# Bytes per idle registered connection (including its nickname, addresses
+# and index entries) which the server should stay under
+BUDGET = 1024
+
+
+class IdleSocket:
+    """A stand-in for a socket, shared by every connection, which replays
+    a connection's registration and accepts everything written to it."""
+
+    def __init__(self):
+        self.chunk = b''
+
+    def recv_into(self, buffer):
+        n_bytes = len(self.chunk)
+        buffer[:n_bytes] = self.chunk
+        return n_bytes
+
+    def send(self, data):
+        return len(data)
+
+
+def register(sock, nicknames, channels, i):
+    nickname = f'user{i}'
+    connection = Connection(sock, ('10.0.%d.%d' % (i // 256 % 256, i % 256), 40000 + i % 20000))
+
+    sock.chunk = b'NICK %s\r\nUSER %s 0 * :Real Name\r\n' % (nickname.encode(), nickname.encode())
+    connection.read_messages()
+    nick, user = connection.next_message(), connection.next_message()
+
+    connection.nickname = nick.split()[1].decode()
+    connection.username = user.split()[1].decode()
+    connection.real_name = 'Real Name'
+    connection.registered = True
+    nicknames.register(connection.nickname, connection)
+    channels.join(connection, '#global')
+
+    connection.send_message(frame_cached(RPL_ENDOFNAMES, ('#global',), 'irc.example.net'))
+    connection.flush_messages()
+    return connection
+
+
+def measure(clients):
+    sock = IdleSocket()
+    nicknames = NicknameRegistry()
+    channels = ChannelRegistry()
+    connections = []
+
+    gc.collect()
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    for i in range(clients):
+        connections.append(register(sock, nicknames, channels, i))
+    gc.collect()
+    used = tracemalloc.get_traced_memory()[0] - before
+    tracemalloc.stop()
+
+    return used / clients, sys.getsizeof(connections[0])
+
+
+def main():
+    print(f'{"clients":>8} {"bytes/connection":>18} {"Connection object":>18} {"budget":>8}')
+    over = False
+    for clients in CLIENTS:
+        per_connection, object_size = measure(clients)
+        over = over or per_connection > BUDGET
+        print(f'{clients:>8} {per_connection:>18,.0f} {object_size:>18,} {BUDGET:>8,}')
+    return 1 if over else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,88 @@
+"""Compares parse_message against the previous str-based parser on a
+realistic mix of traffic.
+
+Usage:
+    python -m benchmarks.bench_parser
+"""
+import random
+import time
+
+from irc_core.parser import parse_message
+
+
+MESSAGES = 100000
+
+# (weight, message) pairs, roughly what a busy server receives
+TRAFFIC = [
+    (60, b':Angel PRIVMSG #global :Hello are you receiving this message ?'),
+    (10, b'PRIVMSG Wiz :a quick direct message'),
+    (10, b'PONG irc.example.net'),
+    (5, b'PING :irc.example.net'),
+    (5, b'NICK Kilroy'),
+    (5, b'USER guest 0 * :Real Name'),
+    (3, b':irc.example.net 353 Wiz = #global :Angel Wiz Kilroy anon0 anon1'),
+    (2, b'QUIT :Gone to have lunch'),
+]
+
+
+def legacy_parse_message(message):
+    """The previous parser, which decodes the whole message to str."""
+    message = message.decode()
+
+    message = message.replace("\r\n", "")
+
+    prefix = None
+    if message.startswith(':'):
+        first_space = message.index(' ')
+        prefix = message[1:first_space]
+        message = message[first_space+1:].lstrip(' ')
+
+    trailing_start = message.find(':')
+    trailing = []
+    if trailing_start != -1:
+        trailing.append(message[trailing_start+1:])
+        message = message[:trailing_start]
+
+    cmd, *params = message.split(' ')
+    params = list(p for p in params if p)
+
+    params += trailing
+
+    return cmd, prefix, params
+
+
+# Commands whose handlers are bound with raw=True, and so never decode
+RAW_COMMANDS = {'PRIVMSG', 'NOTICE'}
+
+
+def parse_as_dispatched(message):
+    """Parses a message the way MessageListener.handle_message does, only
+    decoding the parameters of commands which aren't handled raw."""
+    message = parse_message(message)
+    return message.raw_params if message.command in RAW_COMMANDS else message.params
+
+
+def measure(name, func, corpus, repeat=5):
+    best = float('inf')
+    for _ in range(repeat):
+        start = time.perf_counter()
+        for message in corpus:
+            func(message)
+        best = min(best, time.perf_counter() - start)
+    print(f'{name:<32} {len(corpus) / best:12,.0f} msgs/s')
+
+
+def main():
+    rng = random.Random(0)
+    weights, messages = zip(*TRAFFIC)
+    corpus = rng.choices(messages, weights=weights, k=MESSAGES)
+
+    measure('legacy str parser', legacy_parse_message, corpus)
+    measure('parse_message (command only)', parse_message, corpus)
+    measure('parse_message (decoded params)',
+            lambda message: parse_message(message).params, corpus)
+    measure('parse_message (as dispatched)', parse_as_dispatched, corpus)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,82 @@
+"""Compares frame_message and the cached numeric reply frames against
+the previous str-concatenating serializer.
+
+Usage:
+    python -m benchmarks.bench_serializer
+"""
+import time
+
+from irc_core.parser import frame_message, frame_cached
+from irc_core.replies import RPL_ENDOFNAMES, ERR_NICKNAMEINUSE
+
+
+MESSAGES = 100000
+SERVER = '127.0.0.1:6667'
+
+CORPUS = [
+    ('PRIVMSG', ('#global', 'Hello are you receiving this message ?'), 'Angel'),
+    ('PRIVMSG', ('Wiz', 'a quick direct message'), 'Kilroy'),
+    ('JOIN', ('#global',), 'Wiz'),
+    ('PING', (), SERVER),
+    (RPL_ENDOFNAMES, ('#global',), SERVER),
+    (ERR_NICKNAMEINUSE, ('Wiz', 'Nickname is already in use'), SERVER),
+]
+
+
+def legacy_serialize_message(msg, *params, prefix=None):
+    """The previous serializer, built with str concatenation."""
+    serialized = ''
+    if prefix is not None:
+        serialized += ':%s ' % prefix
+
+    serialized += msg
+    for i, param in enumerate(params):
+        if '\r' in param or '\n' in param:
+            raise ValueError('parameters may not contain \\r or \\n')
+        if ' ' in param:
+            if i != len(params) - 1:
+                raise ValueError('only the final parameter may contain spaces')
+            serialized += ' :%s' % param
+        else:
+            serialized += ' %s' % param
+
+    serialized = serialized.encode('ascii')
+
+    return serialized
+
+
+def legacy_frame(msg, params, prefix):
+    return legacy_serialize_message(msg, *params, prefix=prefix) + b'\r\n'
+
+
+def new_frame(msg, params, prefix):
+    if msg[0].isdigit():
+        return frame_cached(msg, params, prefix)
+    return frame_message(msg, *params, prefix=prefix)
+
+
+def measure(name, func, corpus, repeat=5):
+    best = float('inf')
+    for _ in range(repeat):
+        start = time.perf_counter()
+        for msg, params, prefix in corpus:
+            func(msg, params, prefix)
+        best = min(best, time.perf_counter() - start)
+    print(f'{name:<36} {len(corpus) / best:12,.0f} msgs/s')
+
+
+def main():
+    for msg, params, prefix in CORPUS:
+        assert new_frame(msg, params, prefix) == legacy_frame(msg, params, prefix)
+
+    corpus = CORPUS * (MESSAGES // len(CORPUS))
+    numerics = [m for m in CORPUS if m[0][0].isdigit()] * (MESSAGES // 2)
+
+    measure('legacy serializer (mixed)', legacy_frame, corpus)
+    measure('frame_message / frame_cached (mixed)', new_frame, corpus)
+    measure('legacy serializer (numerics)', legacy_frame, numerics)
+    measure('frame_cached (numerics)', new_frame, numerics)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,125 @@
+"""Measures end-to-end PRIVMSG throughput of `server.py --workers N`, with
+client processes sending direct messages to users who may be connected to
+any of the workers.
+
+Scaling is bounded by the number of cores: on a single core box, more
+workers only add the cost of the links between them.
+
+Usage:
+    python -m benchmarks.bench_workers [--workers 1 2 4] [--clients 4]
+"""
+import argparse
+import multiprocessing
+import os
+import socket
+import subprocess
+import sys
+import time
+
+
+USERS_PER_CLIENT = 25
+MESSAGES_PER_USER = 400
+TEXT = 'Hello are you receiving this message ?'
+
+
+def connect(port, nickname):
+    for _ in range(50):
+        try:
+            sock = socket.create_connection(('127.0.0.1', port))
+            break
+        except ConnectionRefusedError:
+            time.sleep(0.1)
+    sock.sendall(f'NICK {nickname}\r\nUSER {nickname} bench bench :{nickname}\r\n'.encode())
+    return sock
+
+
+def run_client(port, index, clients, ready, start, results):
+    """Connects USERS_PER_CLIENT users, and has each of them message users
+    of the other clients, counting the messages received."""
+    nicknames = [f'c{index}u{i}' for i in range(USERS_PER_CLIENT)]
+    socks = [connect(port, nickname) for nickname in nicknames]
+    ready.wait()
+    start.wait()
+
+    target = (index + 1) % clients
+    lines = b''.join(
+        f'PRIVMSG c{target}u{i} :{TEXT}\r\n'.encode()
+        for i in range(USERS_PER_CLIENT)) * MESSAGES_PER_USER
+
+    begin = time.perf_counter()
+    for sock in socks:
+        sock.sendall(lines[:len(lines) // USERS_PER_CLIENT])
+
+    expected = USERS_PER_CLIENT * MESSAGES_PER_USER
+    received = 0
+    for sock in socks:
+        sock.settimeout(10)
+    pending = list(socks)
+    buffers = {sock: b'' for sock in socks}
+    while pending and received < expected:
+        for sock in list(pending):
+            try:
+                data = sock.recv(65536)
+            except socket.timeout:
+                pending.remove(sock)
+                continue
+            received += data.count(b' PRIVMSG c')
+            if not data:
+                pending.remove(sock)
+    results.put((received, time.perf_counter() - begin))
+
+    for sock in socks:
+        sock.close()
+
+
+def measure(workers, clients, port):
+    server = subprocess.Popen(
+        [sys.executable, 'server.py', '--port', str(port), '--workers', str(workers),
+         '--flood-rate', '0'],
+        stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+        env={**os.environ, 'USER': os.environ.get('USER', 'bench')})
+    try:
+        ready = multiprocessing.Barrier(clients + 1)
+        start = multiprocessing.Barrier(clients + 1)
+        results = multiprocessing.Queue()
+        processes = [
+            multiprocessing.Process(target=run_client,
+                                    args=(port, index, clients, ready, start, results))
+            for index in range(clients)
+        ]
+        for process in processes:
+            process.start()
+
+        ready.wait()
+        time.sleep(1)  # Let the users be introduced to every worker
+        start.wait()
+
+        outcomes = [results.get() for _ in processes]
+        for process in processes:
+            process.join()
+    finally:
+        server.terminate()
+        server.wait()
+
+    received = sum(count for count, _ in outcomes)
+    elapsed = max(elapsed for _, elapsed in outcomes)
+    return received, received / elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--workers', type=int, nargs='+', default=[1, 2, 4])
+    parser.add_argument('--clients', type=int, default=4)
+    parser.add_argument('--port', type=int, default=16667)
+    args = parser.parse_args()
+
+    print(f'{os.cpu_count()} cores, {args.clients} client processes, '
+          f'{args.clients * USERS_PER_CLIENT} users')
+    for workers in args.workers:
+        received, rate = measure(workers, args.clients, args.port)
+        print(f'{workers} workers  {rate:12,.0f} msgs/s  ({received:,} delivered)')
+        args.port += 1
+
+
+if __name__ == '__main__':
+    main()
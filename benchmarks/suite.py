@@ -0,0 +1,332 @@
+"""Microbenchmarks of the hot paths every message goes through: parsing,
+serializing, dispatching and framing, over realistic corpora of short
+PRIVMSGs, long trailing parameters, prefixed numerics and malformed lines.
+
+Each benchmark reports operations per second (best of --repeat runs), the
+peak bytes allocated while performing one operation, and the memory blocks
+still held by its result. Everything runs in process, so no server or
+network is needed.
+
+Results can be saved, and later runs compared against them, i.e before and
+after a change on the same machine:
+
+Usage:
+    python -m benchmarks.suite --save baseline.json
+    python -m benchmarks.suite --compare baseline.json
+    python -m benchmarks.suite --filter parse --repeat 10
+"""
+import argparse
+import gc
+import json
+import logging
+import platform
+import sys
+import time
+import tracemalloc
+
+from irc_core import logger
+from irc_core.connections import Connection
+from irc_core.message_listener import MessageListener
+from irc_core.parser import parse_message, serialize_message, frame_cached
+from irc_core.replies import RPL_ENDOFNAMES, ERR_NICKNAMEINUSE
+
+
+OPERATIONS = 50000  # per timed run
+ALLOCATION_SAMPLE = 1000  # operations traced to measure allocations
+
+LONG_TEXT = 'x' * 200 + ' ' + 'Lorem ipsum dolor sit amet, consectetur adipiscing elit ' * 4
+
+CORPORA = {
+    'short_privmsg': [
+        b':Angel PRIVMSG #global :Hello are you receiving this message ?',
+        b'PRIVMSG Wiz :hi',
+        b':Kilroy PRIVMSG #global :brb',
+        b'PRIVMSG #global :ok',
+    ],
+    'long_trailing': [
+        b':Angel PRIVMSG #global :' + LONG_TEXT.encode(),
+        b'USER guest 0 * :' + LONG_TEXT.encode(),
+        b':Wiz QUIT :' + LONG_TEXT.encode(),
+    ],
+    'prefixed_numeric': [
+        b':irc.example.net 001 Wiz :Welcome to the Internet Relay Network Wiz',
+        b':irc.example.net 353 Wiz = #global :Angel Wiz Kilroy anon0 anon1',
+        b':irc.example.net 366 Wiz #global :End of NAMES list',
+        b':irc.example.net 433 * Wiz :Nickname is already in use',
+    ],
+    'malformed': [
+        b'',
+        b'   ',
+        b':',
+        b':irc.example.net',
+        b':Angel   PRIVMSG   #global   :  spaced out',
+        b'PRIVMSG #global :\xff\xfe not utf-8 \xc3',
+        b'\x00\x01\x02 garbage',
+        b'PRIVMSG :',
+    ],
+}
+
+# (command, params, prefix) for the serializer
+OUTGOING = {
+    'short_privmsg': [
+        ('PRIVMSG', ('#global', 'Hello are you receiving this message ?'), 'Angel'),
+        ('PRIVMSG', ('Wiz', 'hi'), 'Kilroy'),
+    ],
+    'long_trailing': [
+        ('PRIVMSG', ('#global', LONG_TEXT), 'Angel'),
+        ('QUIT', (LONG_TEXT,), 'Wiz'),
+    ],
+    'prefixed_numeric': [
+        (RPL_ENDOFNAMES, ('Wiz', '#global'), 'irc.example.net'),
+        (ERR_NICKNAMEINUSE, ('*', 'Wiz', 'Nickname is already in use'), 'irc.example.net'),
+    ],
+    'relayed_bytes': [
+        ('PRIVMSG', (b'#global', b'Hello are you receiving this message ?'), 'Angel'),
+    ],
+}
+
+
+class Benchmark:
+    """An operation and the corpus of inputs it is run over.
+
+    Args:
+        name (str): Shown in the results, and used as the key of baselines
+        func (Callable): Performs one operation on an item of the corpus
+        corpus (list): The inputs, cycled to make up OPERATIONS
+        ops_per_item (Callable): The number of operations an item accounts
+            for, when an item is more than one (i.e a chunk of messages)
+    """
+
+    def __init__(self, name, func, corpus, ops_per_item=None):
+        self.name = name
+        self.func = func
+        self.corpus = corpus
+        self.ops_per_item = ops_per_item
+
+    def _items(self, count):
+        corpus = self.corpus
+        return [corpus[i % len(corpus)] for i in range(count)]
+
+    def _count(self, items):
+        if self.ops_per_item is None:
+            return len(items)
+        return sum(self.ops_per_item(item) for item in items)
+
+    def time(self, repeat):
+        """Returns the best operations per second over `repeat` runs."""
+        func = self.func
+        items = self._items(OPERATIONS if self.ops_per_item is None else len(self.corpus))
+        ops = self._count(items)
+
+        best = float('inf')
+        for _ in range(repeat):
+            start = time.perf_counter()
+            for item in items:
+                func(item)
+            best = min(best, time.perf_counter() - start)
+        return ops / best
+
+    def allocations(self):
+        """Returns the mean peak bytes allocated per operation, and the mean
+        number of memory blocks still held once each operation returned."""
+        func = self.func
+        items = self._items(min(ALLOCATION_SAMPLE, len(self.corpus) * 10))
+        ops = self._count(items)
+
+        for item in items:
+            func(item)  # warm up any caches, so they aren't counted
+
+        gc.disable()
+        try:
+            tracemalloc.start()
+            peak = 0
+            for item in items:
+                tracemalloc.reset_peak()
+                current, _ = tracemalloc.get_traced_memory()
+                func(item)
+                peak += tracemalloc.get_traced_memory()[1] - current
+            tracemalloc.stop()
+
+            results = [None] * len(items)
+            before = sys.getallocatedblocks()
+            for i, item in enumerate(items):
+                results[i] = func(item)
+            blocks = sys.getallocatedblocks() - before
+            del results
+        finally:
+            gc.enable()
+
+        return peak / ops, max(blocks, 0) / ops
+
+    def run(self, repeat):
+        bytes_per_op, blocks_per_op = self.allocations()
+        return {
+            'ops_per_sec': self.time(repeat),
+            'bytes_per_op': bytes_per_op,
+            'blocks_per_op': blocks_per_op,
+        }
+
+
+def _run_coroutine(coro):
+    """Runs a coroutine which never suspends, without an event loop, so
+    that the loop's overhead isn't measured along with dispatching."""
+    try:
+        coro.send(None)
+    except StopIteration as e:
+        return e.value
+    raise RuntimeError('benchmarked coroutine suspended')
+
+
+class FeedSocket:
+    """A stand-in for a socket which returns one queued chunk per recv."""
+
+    def __init__(self):
+        self.chunk = b''
+
+    def recv_into(self, buffer):
+        n_bytes = len(self.chunk)
+        buffer[:n_bytes] = self.chunk
+        return n_bytes
+
+
+def _chunks(lines, size):
+    """Splits pipelined traffic into chunks of `size` bytes, the way it
+    arrives from the socket (i.e with messages split across reads)."""
+    stream = b''.join(line + b'\r\n' for line in lines) * (OPERATIONS // len(lines))
+    return [stream[i:i + size] for i in range(0, len(stream), size)]
+
+
+def _framing_benchmark(name, lines, read_size):
+    sock = FeedSocket()
+    conn = Connection(sock, ('127.0.0.1', 50000), read_size=read_size)
+
+    def frame(chunk):
+        sock.chunk = chunk
+        conn.read_messages()
+        messages = []
+        while conn.pending_messages:
+            messages.append(conn.next_message())
+        return messages
+
+    return Benchmark(name, frame, _chunks(lines, read_size),
+                     ops_per_item=lambda chunk: chunk.count(b'\r\n'))
+
+
+def benchmarks():
+    """Builds every benchmark of the suite."""
+    suite = []
+
+    for corpus, lines in CORPORA.items():
+        suite.append(Benchmark(f'parse/{corpus}', parse_message, lines))
+    for corpus, lines in CORPORA.items():
+        suite.append(Benchmark(f'parse+decode/{corpus}',
+                               lambda line: parse_message(line).params, lines))
+
+    for corpus, messages in OUTGOING.items():
+        suite.append(Benchmark(f'serialize/{corpus}',
+                               lambda m: serialize_message(m[0], *m[1], prefix=m[2]),
+                               messages))
+    suite.append(Benchmark('frame_cached/prefixed_numeric',
+                           lambda m: frame_cached(*m),
+                           OUTGOING['prefixed_numeric']))
+
+    listener = MessageListener()
+    connection = object()
+
+    @listener.on('PRIVMSG')
+    async def on_privmsg(connection, receivers=None, msg=None, prefix=None):
+        pass
+
+    @listener.on('001')
+    @listener.on('353')
+    @listener.on('366')
+    @listener.on('433')
+    async def on_numeric(connection, *params, prefix=None):
+        pass
+
+    def dispatch(line):
+        return _run_coroutine(listener.handle_message(connection, line))
+
+    for corpus in ('short_privmsg', 'prefixed_numeric', 'malformed'):
+        suite.append(Benchmark(f'dispatch/{corpus}', dispatch, CORPORA[corpus]))
+    suite.append(Benchmark('dispatch/unknown', dispatch,
+                           [b':Angel FOO #global :Hello are you receiving this message ?']))
+
+    mixed = [line for lines in CORPORA.values() for line in lines if line]
+    for read_size in (512, Connection.READ_SIZE):
+        suite.append(_framing_benchmark(f'framing/mixed/{read_size}', mixed, read_size))
+    suite.append(_framing_benchmark('framing/short_privmsg/4096',
+                                    CORPORA['short_privmsg'], 4096))
+
+    return suite
+
+
+def compare(results, baseline, threshold):
+    """Prints how the results changed from a baseline.
+
+    Returns:
+        List[str]: The benchmarks which are slower than the baseline by
+            more than `threshold` (a fraction), or allocate more per op
+    """
+    regressions = []
+    print(f'{"benchmark":<36} {"ops/s":>12} {"change":>8} {"B/op":>8} {"change":>8}')
+    for name, result in results.items():
+        before = baseline.get(name)
+        if before is None:
+            print(f'{name:<36} {result["ops_per_sec"]:12,.0f} {"new":>8}')
+            continue
+        speed = result['ops_per_sec'] / before['ops_per_sec'] - 1
+        growth = result['bytes_per_op'] - before['bytes_per_op']
+        flag = ''
+        if speed < -threshold or growth > max(before['bytes_per_op'] * threshold, 8):
+            regressions.append(name)
+            flag = '  REGRESSED'
+        print(f'{name:<36} {result["ops_per_sec"]:12,.0f} {speed:+8.1%} '
+              f'{result["bytes_per_op"]:8.0f} {growth:+8.0f}{flag}')
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Benchmarks the message hot paths.')
+    parser.add_argument('--filter', default=None,
+                        help='Only run benchmarks whose name contains this.')
+    parser.add_argument('--repeat', type=int, default=5,
+                        help='Timed runs per benchmark (the best is kept).')
+    parser.add_argument('--save', default=None, metavar='FILE',
+                        help='Save the results as a baseline.')
+    parser.add_argument('--compare', default=None, metavar='FILE',
+                        help='Compare the results against a saved baseline.')
+    parser.add_argument('--threshold', type=float, default=0.15,
+                        help='The slowdown (as a fraction) reported as a regression.')
+    args = parser.parse_args(argv)
+
+    logger.setLevel(logging.ERROR)
+
+    results = {}
+    for benchmark in benchmarks():
+        if args.filter and args.filter not in benchmark.name:
+            continue
+        result = results[benchmark.name] = benchmark.run(args.repeat)
+        if args.compare is None:
+            print(f'{benchmark.name:<36} {result["ops_per_sec"]:12,.0f} ops/s '
+                  f'{result["bytes_per_op"]:8.0f} B/op {result["blocks_per_op"]:6.1f} blocks/op')
+
+    regressions = []
+    if args.compare is not None:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        regressions = compare(results, baseline['results'], args.threshold)
+
+    if args.save is not None:
+        with open(args.save, 'w') as f:
+            json.dump({
+                'python': platform.python_version(),
+                'machine': platform.machine(),
+                'results': results,
+            }, f, indent=2)
+
+    return 1 if regressions else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,495 @@
+"""Generates load against an IRC server with many concurrent clients, and
+reports throughput, delivery latency, and the CPU and memory used by the
+server.
+
+Workloads:
+    register  Every client connects and registers at once (a registration
+              storm), then quits.
+    chatter   Clients send PRIVMSGs at a fixed rate, either to #global
+              (which every client is joined to when it registers), or to
+              other clients directly. Delivery latency is measured by the
+              clients who receive each message.
+    idle      Clients register and stay idle, answering the server's PINGs.
+    churn     Clients repeatedly quit, then reconnect and register (which
+              joins them to #global again).
+
+Usage:
+    irc-loadgen --clients 1000 --workload chatter --target direct --output run.json
+    irc-loadgen --spawn --server-args="--flood-rate 0" --workload churn
+"""
+import argparse
+import asyncio
+import json
+import os
+import resource
+import shlex
+import subprocess
+import sys
+import time
+
+
+WORKLOADS = ('register', 'chatter', 'idle', 'churn')
+
+
+def percentile(samples, fraction):
+    """Returns the value below which `fraction` of the sorted samples fall
+    (nearest rank)."""
+    if not samples:
+        return None
+    index = min(len(samples) - 1, max(0, int(round(fraction * len(samples))) - 1))
+    return samples[index]
+
+
+def summarize(samples):
+    """Summarizes latencies (in seconds) as milliseconds."""
+    samples = sorted(samples)
+    if not samples:
+        return None
+    to_ms = 1000.0
+    return {
+        'count': len(samples),
+        'mean_ms': sum(samples) / len(samples) * to_ms,
+        'p50_ms': percentile(samples, 0.5) * to_ms,
+        'p99_ms': percentile(samples, 0.99) * to_ms,
+        'p999_ms': percentile(samples, 0.999) * to_ms,
+        'max_ms': samples[-1] * to_ms,
+    }
+
+
+class Stats:
+    """Counts what the clients of a run sent and received."""
+
+    def __init__(self):
+        self.connected = 0
+        self.registered = 0
+        self.sent = 0
+        self.received = 0
+        self.pongs = 0
+        self.cycles = 0
+        self.disconnects = 0
+        self.errors = 0
+        self.ping_timeouts = set()  # nicknames the server dropped for not answering PINGs
+        self.latencies = []  # seconds from sending a PRIVMSG to its delivery
+        self.registration_latencies = []  # seconds from connecting to the end of NAMES
+
+
+class LoadClient:
+    """A minimal IRC client, which only understands what it needs to
+    measure the server."""
+
+    def __init__(self, host, port, nickname, stats):
+        self.host = host
+        self.port = port
+        self.nickname = nickname
+        self.stats = stats
+        self.registered = asyncio.Event()
+        self.closed = False
+        self._reader = None
+        self._writer = None
+        self._read_task = None
+
+    async def connect(self):
+        self._reader, self._writer = await asyncio.open_connection(self.host, self.port)
+        self.stats.connected += 1
+        self._read_task = asyncio.create_task(self._read_loop())
+
+    async def register(self, timeout=30):
+        """Registers, and waits for the server to send the members of
+        #global, which it joins the client to."""
+        start = time.monotonic()
+        self.send(f'NICK {self.nickname}', f'USER {self.nickname} loadgen loadgen :{self.nickname}')
+        await asyncio.wait_for(self.registered.wait(), timeout)
+        self.stats.registration_latencies.append(time.monotonic() - start)
+        self.stats.registered += 1
+
+    def send(self, *lines):
+        if self.closed:
+            return
+        self._writer.write(''.join(f'{line}\r\n' for line in lines).encode())
+
+    def say(self, target, size):
+        """Sends a PRIVMSG stamped with the time it was sent."""
+        self.send(f'PRIVMSG {target} :{time.monotonic_ns()} {"x" * size}')
+        self.stats.sent += 1
+
+    async def drain(self):
+        if not self.closed:
+            await self._writer.drain()
+
+    async def quit(self):
+        self.send('QUIT :done')
+        await self.close()
+
+    async def close(self):
+        if self.closed:
+            return
+        self.closed = True
+        try:
+            await self._writer.drain()
+        except ConnectionError:
+            pass
+        self._writer.close()
+        if self._read_task is not None:
+            self._read_task.cancel()
+
+    async def _read_loop(self):
+        try:
+            while True:
+                line = await self._reader.readline()
+                if not line:
+                    break
+                self._handle(line)
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        except asyncio.CancelledError:
+            return
+
+        if not self.closed:
+            self.stats.disconnects += 1
+            self.closed = True
+
+    def _handle(self, line):
+        line = line.rstrip(b'\r\n')
+        prefix, _, rest = line.partition(b' ') if line[:1] == b':' else (b'', b'', line)
+        command, _, params = rest.partition(b' ')
+
+        if command == b'PRIVMSG':
+            self.stats.received += 1
+            _, _, text = params.partition(b' ')
+            stamp = text.lstrip(b':').split(b' ', 1)[0]
+            if stamp.isdigit():
+                self.stats.latencies.append((time.monotonic_ns() - int(stamp)) / 1e9)
+        elif command == b'QUIT':
+            if params.lstrip(b':') == b'Ping timeout':
+                self.stats.ping_timeouts.add(prefix[1:])
+        elif command == b'PING':
+            self.send('PONG')
+            self.stats.pongs += 1
+        elif command == b'366':
+            self.registered.set()
+
+
+class ProcessSampler:
+    """Samples the CPU time and resident memory of a process from /proc
+    (Linux only; the results are None elsewhere)."""
+
+    def __init__(self, pid, interval=0.25):
+        self.pid = pid
+        self.interval = interval
+        self.rss_max = None
+        self._cpu_start = None
+        self._time_start = None
+        self._task = None
+
+    def _cpu_seconds(self):
+        try:
+            with open(f'/proc/{self.pid}/stat') as f:
+                fields = f.read().rsplit(')', 1)[1].split()
+        except OSError:
+            return None
+        # utime and stime are fields 14 and 15 of stat, in clock ticks
+        return (int(fields[11]) + int(fields[12])) / os.sysconf('SC_CLK_TCK')
+
+    def _rss_bytes(self):
+        try:
+            with open(f'/proc/{self.pid}/status') as f:
+                for line in f:
+                    if line.startswith('VmRSS:'):
+                        return int(line.split()[1]) * 1024
+        except OSError:
+            pass
+        return None
+
+    async def _sample(self):
+        while True:
+            rss = self._rss_bytes()
+            if rss is not None:
+                self.rss_max = max(self.rss_max or 0, rss)
+            await asyncio.sleep(self.interval)
+
+    def start(self):
+        self._cpu_start = self._cpu_seconds()
+        self._time_start = time.monotonic()
+        self._task = asyncio.create_task(self._sample())
+
+    def stop(self):
+        self._task.cancel()
+        cpu_end = self._cpu_seconds()
+        elapsed = time.monotonic() - self._time_start
+        if self._cpu_start is None or cpu_end is None:
+            return {'pid': self.pid, 'cpu_seconds': None, 'cpu_percent': None,
+                    'rss_max_bytes': self.rss_max}
+
+        cpu = cpu_end - self._cpu_start
+        return {'pid': self.pid, 'cpu_seconds': cpu, 'cpu_percent': 100 * cpu / elapsed,
+                'rss_max_bytes': self.rss_max}
+
+
+class LoadGenerator:
+    """Runs a workload with `clients` concurrent clients."""
+
+    def __init__(self, host='127.0.0.1', port=6667, clients=100, workload='chatter',
+                 duration=10.0, rate=1.0, target='channel', size=32, connect_rate=0,
+                 lurkers=0):
+        """
+        Args:
+            clients (int): The number of concurrent clients
+            workload (str): One of WORKLOADS
+            duration (float): Seconds to run the workload for (not counting
+                connecting and registering)
+            rate (float): PRIVMSGs per second sent by each client (chatter)
+            target (str): 'channel' to chat in #global, so every message is
+                delivered to every client, or 'direct' to message the
+                next client
+            size (int): Bytes of padding in each PRIVMSG
+            connect_rate (float): Clients connected per second (0 for all at once)
+            lurkers (int): Clients which only answer PINGs while the others
+                chat, so the server has nothing but their PONGs to keep
+                them connected
+        """
+        if workload not in WORKLOADS:
+            raise ValueError(f'unknown workload {workload}')
+
+        self.host = host
+        self.port = port
+        self.clients = clients
+        self.workload = workload
+        self.duration = duration
+        self.rate = rate
+        self.target = target
+        self.size = size
+        self.connect_rate = connect_rate
+        self.lurkers = lurkers
+        self.stats = Stats()
+
+    async def _connect(self, index, nickname=None):
+        client = LoadClient(self.host, self.port, nickname or f'lg{index}', self.stats)
+        try:
+            await client.connect()
+            await client.register()
+        except (OSError, asyncio.TimeoutError):
+            self.stats.errors += 1
+            await client.close()
+            return None
+        return client
+
+    async def _connect_all(self):
+        tasks = []
+        for index in range(self.clients):
+            tasks.append(asyncio.create_task(self._connect(index)))
+            if self.connect_rate:
+                await asyncio.sleep(1 / self.connect_rate)
+        return [client for client in await asyncio.gather(*tasks) if client is not None]
+
+    async def run(self):
+        """Runs the workload, and returns the results."""
+        start = time.monotonic()
+        clients = await self._connect_all()
+        connected = time.monotonic()
+
+        try:
+            await getattr(self, f'_{self.workload}')(clients)
+        finally:
+            await asyncio.gather(*(client.quit() for client in clients))
+        end = time.monotonic()
+
+        return self._results(start, connected, end)
+
+    async def _register(self, clients):
+        pass  # Connecting and registering is the workload
+
+    async def _chatter(self, clients):
+        # Let the JOINs to #global be delivered before measuring
+        await asyncio.sleep(0.5)
+        self.stats.received = 0
+        self.stats.latencies.clear()
+
+        async def chat(index, client):
+            if index >= len(clients) - self.lurkers:
+                return
+            interval = 1 / self.rate
+            # Spread the clients' messages out over the interval
+            await asyncio.sleep(interval * index / max(len(clients), 1))
+            deadline = time.monotonic() + self.duration
+            next_send = time.monotonic()
+            if self.target == 'channel':
+                target = '#global'
+            else:
+                target = clients[(index + 1) % len(clients)].nickname
+            while time.monotonic() < deadline and not client.closed:
+                client.say(target, self.size)
+                await client.drain()
+                next_send += interval
+                await asyncio.sleep(max(0, next_send - time.monotonic()))
+
+        await asyncio.gather(*(chat(index, client) for index, client in enumerate(clients)))
+        # Wait for the last messages to be delivered
+        await asyncio.sleep(1)
+
+    async def _idle(self, clients):
+        await asyncio.sleep(self.duration)
+
+    async def _churn(self, clients):
+        async def churn(index, client):
+            deadline = time.monotonic() + self.duration
+            generation = 0
+            while time.monotonic() < deadline:
+                await client.quit()
+                generation += 1
+                client = await self._connect(index, f'lg{index}x{generation}'[:9])
+                if client is None:
+                    return None
+                self.stats.cycles += 1
+            return client
+
+        replaced = await asyncio.gather(*(churn(index, client) for index, client in enumerate(clients)))
+        clients[:] = [client for client in replaced if client is not None]
+
+    def _results(self, start, connected, end):
+        stats = self.stats
+        workload_seconds = end - connected
+        results = {
+            'workload': self.workload,
+            'clients': self.clients,
+            'duration': self.duration,
+            'connect_seconds': connected - start,
+            'elapsed_seconds': end - start,
+            'connected': stats.connected,
+            'registered': stats.registered,
+            'errors': stats.errors,
+            'disconnects': stats.disconnects,
+            'sent': stats.sent,
+            'received': stats.received,
+            'pongs': stats.pongs,
+            'ping_timeouts': len(stats.ping_timeouts),
+            'cycles': stats.cycles,
+            'registration_latency': summarize(stats.registration_latencies),
+            'delivery_latency': summarize(stats.latencies),
+        }
+
+        if self.workload == 'register':
+            results['throughput_per_second'] = stats.registered / (connected - start)
+        elif self.workload == 'chatter':
+            results['throughput_per_second'] = stats.received / workload_seconds
+        elif self.workload == 'churn':
+            results['throughput_per_second'] = stats.cycles / workload_seconds
+        else:
+            results['throughput_per_second'] = stats.pongs / workload_seconds
+        return results
+
+
+def _raise_file_limit(clients):
+    """Raises the limit on open files, so the clients can all connect."""
+    soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+    wanted = clients + 64
+    if soft < wanted:
+        if hard != resource.RLIM_INFINITY:
+            wanted = min(wanted, hard)
+        resource.setrlimit(resource.RLIMIT_NOFILE, (wanted, hard))
+
+
+def _spawn_server(script, port, server_args):
+    command = [sys.executable, script, '--port', str(port), *shlex.split(server_args)]
+    return subprocess.Popen(command, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+
+
+async def _wait_for_server(host, port, timeout=10):
+    deadline = time.monotonic() + timeout
+    while True:
+        try:
+            _, writer = await asyncio.open_connection(host, port)
+        except OSError:
+            if time.monotonic() > deadline:
+                raise
+            await asyncio.sleep(0.1)
+            continue
+        writer.close()
+        return
+
+
+async def run(args):
+    """Runs a load test from command line arguments, and returns the
+    results."""
+    server = None
+    if args.spawn:
+        server = _spawn_server(args.spawn, args.port, args.server_args)
+    try:
+        await _wait_for_server(args.host, args.port)
+
+        generator = LoadGenerator(args.host, args.port, args.clients, args.workload,
+                                  args.duration, args.rate, args.target, args.size,
+                                  args.connect_rate, args.lurkers)
+        pid = server.pid if server is not None else args.server_pid
+        sampler = ProcessSampler(pid) if pid is not None else None
+        if sampler is not None:
+            sampler.start()
+
+        results = await generator.run()
+
+        results['server'] = sampler.stop() if sampler is not None else None
+        usage = resource.getrusage(resource.RUSAGE_SELF)
+        results['loadgen'] = {
+            'cpu_seconds': usage.ru_utime + usage.ru_stime,
+            'rss_max_bytes': usage.ru_maxrss * 1024,
+        }
+        return results
+    finally:
+        if server is not None:
+            server.terminate()
+            server.wait()
+
+
+def _print_results(results):
+    print(f"{results['workload']}: {results['clients']} clients, "
+          f"{results['registered']} registered, {results['errors']} errors, "
+          f"{results['disconnects']} disconnected, {results['ping_timeouts']} ping timeouts")
+    print(f"throughput       {results['throughput_per_second']:12,.1f} /s")
+    for name in ('registration_latency', 'delivery_latency'):
+        latency = results[name]
+        if latency is not None:
+            print(f"{name:<16} p50 {latency['p50_ms']:.2f} ms  p99 {latency['p99_ms']:.2f} ms  "
+                  f"p999 {latency['p999_ms']:.2f} ms  max {latency['max_ms']:.2f} ms")
+    server = results['server']
+    if server is not None and server['cpu_seconds'] is not None:
+        print(f"server           cpu {server['cpu_percent']:.1f}%  "
+              f"rss {server['rss_max_bytes'] / 2**20:.1f} MiB")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Generates load against an IRC server.')
+    parser.add_argument('--host', default='127.0.0.1', help='The IP of the server.')
+    parser.add_argument('--port', type=int, default=6667, help='The port of the server.')
+    parser.add_argument('--clients', type=int, default=100, help='The number of concurrent clients.')
+    parser.add_argument('--workload', choices=WORKLOADS, default='chatter')
+    parser.add_argument('--duration', type=float, default=10.0,
+                        help='Seconds to run the workload for.')
+    parser.add_argument('--rate', type=float, default=1.0,
+                        help='PRIVMSGs per second sent by each client (chatter).')
+    parser.add_argument('--target', choices=('channel', 'direct'), default='channel',
+                        help='Chat in #global, or send messages directly to other clients.')
+    parser.add_argument('--size', type=int, default=32, help='Bytes of padding per PRIVMSG.')
+    parser.add_argument('--connect-rate', type=float, default=0,
+                        help='Clients to connect per second (0 connects them all at once).')
+    parser.add_argument('--lurkers', type=int, default=0,
+                        help='Clients which stay silent while the others chat (chatter).')
+    parser.add_argument('--spawn', nargs='?', const='server.py', default=None, metavar='SCRIPT',
+                        help='Start the server (server.py by default) for the run.')
+    parser.add_argument('--server-args', default='',
+                        help='Extra arguments for the spawned server, i.e "--flood-rate 0".')
+    parser.add_argument('--server-pid', type=int, default=None,
+                        help='The PID of a server which is already running, to sample its CPU and memory.')
+    parser.add_argument('--output', default=None, help='Write the results as JSON to this file.')
+    args = parser.parse_args(argv)
+
+    _raise_file_limit(args.clients)
+    results = asyncio.run(run(args))
+
+    _print_results(results)
+    if args.output is not None:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2)
+    return results
+
+
+if __name__ == '__main__':
+    main()
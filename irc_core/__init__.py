@@ -1,4 +1,4 @@
 from .message_listener import MessageListener
 from .connections import Connection
-from .logger import logger
+from .logger import logger, trace
 from .replies import *
@@ -1,16 +1,84 @@
 import socket, select
 
 from .logger import logger
+from .metrics import registry
 
+from collections import deque
 import time
 
 
+_bytes_received = registry.counter('irc_received_bytes_total', 'Bytes read from sockets')
+_bytes_sent = registry.counter('irc_sent_bytes_total', 'Bytes written to sockets')
+
+
+class _EmptyQueue(tuple):
+    """Stands in for the message queue of a connection which has nothing
+    queued, so idle connections share one immutable object instead of
+    each holding an empty deque."""
+
+    __slots__ = ()
+
+    def popleft(self):
+        raise IndexError('pop from an empty deque')
+
+    def clear(self):
+        pass
+
+
+_EMPTY_QUEUE = _EmptyQueue()
+_EMPTY_BUFFER = b''
+_LF = ord('\n')
+
+# Receive buffers, by size. Bytes are copied out of the buffer as soon as
+# they are received, so every connection of a process can share one.
+_recv_buffers = {}
+
+
+def _recv_buffer(size):
+    buffer = _recv_buffers.get(size)
+    if buffer is None:
+        buffer = _recv_buffers[size] = bytearray(size)
+    return buffer
+
+
 class Connection:
     """A higher-level representation of a socket connection to 
     encompass logic for reading and writing to the socket in
-    a non-blocking way."""
+    a non-blocking way.
+
+    Connections are slotted, and only allocate buffers and queues while
+    they hold data, so that idle connections are as small as possible.
+
+    Outgoing messages sent with priority=True (i.e PING / PONG) jump ahead
+    of the other messages queued before them, but stay in order among
+    themselves."""
+
+    __slots__ = ('_socket', 'addr', 'nickname', 'username', 'real_name', 'registered',
+                 'host', '_read_size', '_incoming_buffer', '_scan_from',
+                 '_incoming_messages', '_outgoing_messages',
+                 '_outgoing_control', '_control_end', '_outgoing_bytes',
+                 '_outgoing_offset', 'sendq_exceeded', '_last_message_time',
+                 'output_listener')
 
-    def __init__(self, socket_conn, addr):
+    READ_SIZE = 4096  # bytes read from the socket at a time
+    # When more than SENDQ_HIGH_WATER bytes are waiting to be sent, producers
+    # should hold off, and once SENDQ_LIMIT would be exceeded the queue is
+    # dropped and the connection is considered dead.
+    SENDQ_HIGH_WATER = 64 * 1024  # bytes
+    SENDQ_LIMIT = 1024 * 1024  # bytes
+
+    # Clients of this server are not reachable through a link to another
+    # server (see irc_server.links.RemoteUser)
+    link = None
+    hopcount = 0
+
+    def __init__(self, socket_conn, addr, read_size=None):
+        """
+        Args:
+            socket_conn (socket.socket): A connected socket
+            addr (tuple): The address of the remote end of the socket
+            read_size (int): Optionally override READ_SIZE for this connection
+        """
         self._socket = socket_conn
         self.addr = addr
         self.nickname = None
@@ -18,21 +86,44 @@ class Connection:
         self.real_name = None
         self.registered = False
 
-        try:
-            self.host = socket.gethostbyaddr(addr[0])[0]
-        except:
-            self.host = 'unknown'
+        # The IP is used as the host until the hostname has been resolved
+        self.host = addr[0]
 
-        self._incoming_buffer = b''
-        self._incoming_messages = []
-        self._outgoing_messages = []
+        # Bytes are received into a shared buffer, and then appended to the
+        # buffer of not yet terminated messages (which is only allocated
+        # while a message is partially received).
+        self._read_size = read_size or self.READ_SIZE
+        self._incoming_buffer = _EMPTY_BUFFER
+        self._scan_from = 0  # Where to resume searching for a \r\n
+        self._incoming_messages = _EMPTY_QUEUE
+        self._outgoing_messages = _EMPTY_QUEUE
+        # Priority messages waiting to be moved ahead of the bulk messages
+        self._outgoing_control = _EMPTY_QUEUE
+        # Bytes at the front of _outgoing_messages which are priority messages
+        # (or the message being sent), which new ones are queued behind
+        self._control_end = 0
+        self._outgoing_bytes = 0
+        self._outgoing_offset = 0  # Bytes of the first message already sent
+        self.sendq_exceeded = False
         self._last_message_time = time.time()
 
-        self.ping_timeout = None
+        # Called with this connection whenever output is queued on an empty
+        # outgoing queue, so an event loop can schedule a flush.
+        self.output_listener = None
 
     def __str__(self) -> str:
         return f'Connection(addr={self.addr}, nickname={self.nickname}, host={self.host}, username={self.username}, real_name={self.real_name})'
 
+    def fileno(self):
+        """Returns the file descriptor of the underlying socket, allowing
+        a Connection to be registered directly with selectors / event loops."""
+        return self._socket.fileno()
+
+    @property
+    def last_message_time(self):
+        """The time.time() at which data was last received."""
+        return self._last_message_time
+
     @property
     def time_since_last_message(self):
         return time.time() - self._last_message_time
@@ -46,16 +137,50 @@ class Connection:
             pass
 
     def _read_bytes(self):
-        """Reads up to 512 bytes from the socket and adds them to
+        """Reads up to READ_SIZE bytes from the socket and adds them to
         the buffer.
         
         NOTE: Will raise a BlockingIOError if called directly
         """
-        new_bytes = self._socket.recv(512)
-        if not new_bytes:
+        recv_buffer = _recv_buffer(self._read_size)
+        n_bytes = self._socket.recv_into(recv_buffer)
+        if not n_bytes:
             raise EOFError() # TODO Should this be thrown once the _incoming_buffer is empty?
+        _bytes_received.inc(amount=n_bytes)
+
+        with memoryview(recv_buffer) as new_bytes:
+            if self._incoming_buffer:
+                self._incoming_buffer += new_bytes[:n_bytes]
+            else:
+                self._incoming_buffer = bytearray(new_bytes[:n_bytes])
+
+    def _frame_messages(self):
+        """Moves every \\r\\n terminated message out of the buffer and
+        into the queue of incoming messages.
+
+        Only the bytes which have not been searched yet are scanned, and
+        the consumed bytes are removed from the buffer in a single step.
+        """
+        buffer = self._incoming_buffer
+        start = 0
+        end = buffer.find(b'\r\n', self._scan_from)
+        if end != -1:
+            messages = self._incoming_messages
+            if messages is _EMPTY_QUEUE:
+                messages = self._incoming_messages = deque()
+            with memoryview(buffer) as view:
+                while end != -1:
+                    messages.append(bytes(view[start:end]))
+                    start = end + 2
+                    end = buffer.find(b'\r\n', start)
+            del buffer[:start]
 
-        self._incoming_buffer += new_bytes
+        if buffer:
+            # A \r at the very end may be the first half of a terminator
+            self._scan_from = len(buffer) - 1
+        else:
+            self._incoming_buffer = _EMPTY_BUFFER
+            self._scan_from = 0
 
     def _get_messages(self):
         """Checks if there is any data ready to be read from the
@@ -65,11 +190,22 @@ class Connection:
         """
         read_available, *_ = select.select({self._socket}, {}, {}, 0)
         if read_available:
-            self._read_bytes()
-            *msgs, self._incoming_buffer = self._incoming_buffer.split(b'\r\n')
-            self._incoming_messages += msgs
-            self._outgoing_messages = []
-            self._last_message_time = time.time()
+            self.read_messages()
+
+    def read_messages(self):
+        """Reads from a socket which is known to be readable, and updates
+        the list of incoming messages.
+
+        Intended to be called from a readiness notification (i.e a selector
+        or event loop reader callback), which avoids the select() call
+        made by has_messages().
+
+        NOTE: Will raise a BlockingIOError if the socket was not readable,
+        and an EOFError if the socket was closed.
+        """
+        self._read_bytes()
+        self._frame_messages()
+        self._last_message_time = time.time()
 
     def next_message(self):
         """Returns the next complete message that is ready for processing.
@@ -77,7 +213,24 @@ class Connection:
         NOTE: An IndexError may result. Use has_messages() to check if
         there are any messages ready.
         """
-        return self._incoming_messages.pop(0)
+        messages = self._incoming_messages
+        message = messages.popleft()
+        if not messages:
+            self._incoming_messages = _EMPTY_QUEUE
+        return message
+
+    def peek_message(self):
+        """Returns the next complete message, without removing it."""
+        return self._incoming_messages[0]
+
+    def clear_messages(self):
+        """Drops every message which has not been processed yet."""
+        self._incoming_messages = _EMPTY_QUEUE
+
+    @property
+    def pending_messages(self):
+        """The number of complete messages that are ready for processing."""
+        return len(self._incoming_messages)
 
     def has_messages(self):
         """Checks the socket for data, and returns True if there are messages
@@ -86,19 +239,28 @@ class Connection:
 
         return len(self._incoming_messages) > 0
 
-    def send_message(self, msg):
+    def send_message(self, msg, immediate=False, priority=False):
         """Adds a message to the queue of outgoing messages.
         
-        NOTE: Does not write to the socket. Use flush_messages() to 
-        write all pending messages to the socket.
+        NOTE: Does not write to the socket (unless `immediate` is set).
+        Use flush_messages() to write all pending messages to the socket.
 
         Args:
             msg (bytes): The message to be sent. Does NOT need to be terminated
                 with \\r\\n
+            immediate (bool): If nothing else is queued, write the message
+                right away instead of waiting for the next flush. Intended
+                for small, latency-sensitive messages (i.e PING / PONG).
+            priority (bool): Write the message ahead of any bulk messages
+                which have not started being written yet
         
         Raises:
             ValueError: A value error is raised if the length of the message if greater
                 than 512 bytes (including the \\r\\n terminator)
+
+        NOTE: If queueing the message would exceed SENDQ_LIMIT, the outgoing
+        queue is dropped, sendq_exceeded is set, and any further messages
+        are discarded.
         """
         if not msg.endswith(b'\r\n'):
             msg = msg + b'\r\n'
@@ -106,12 +268,122 @@ class Connection:
         if len(msg) > 512:
             raise ValueError(f'msg too long ({len(msg)})')
 
-        self._outgoing_messages.append(msg)
-    
+        if self.sendq_exceeded:
+            return
+
+        if self._outgoing_bytes + len(msg) > self.SENDQ_LIMIT:
+            logger.warning('sendq exceeded for %s', self)
+            self.sendq_exceeded = True
+            self._outgoing_messages = _EMPTY_QUEUE
+            self._outgoing_control = _EMPTY_QUEUE
+            self._control_end = 0
+            self._outgoing_bytes = 0
+            self._outgoing_offset = 0
+        else:
+            pending = self._outgoing_bytes
+            self._outgoing_bytes += len(msg)
+            if priority and pending:
+                if self._outgoing_control is _EMPTY_QUEUE:
+                    self._outgoing_control = deque()
+                self._outgoing_control.append(msg)
+                return
+
+            queue = self._outgoing_messages
+            if queue is _EMPTY_QUEUE:
+                queue = self._outgoing_messages = deque()
+            queue.append(msg)
+            if pending:
+                return
+            if priority:
+                self._control_end = len(msg)
+            if immediate:
+                try:
+                    if self.flush_messages():
+                        return
+                except OSError:
+                    pass  # Left for the next flush to report
+
+        if self.output_listener is not None:
+            self.output_listener(self)
+
+    @property
+    def outgoing_bytes(self):
+        """The number of bytes waiting to be written to the socket."""
+        return self._outgoing_bytes
+
+    @property
+    def priority_pending(self):
+        """Whether a priority message has not been completely written to the
+        socket yet."""
+        return bool(self._outgoing_control) or self._control_end > self._outgoing_offset
+
     def flush_messages(self):
-        """Writes all pending messages to the socket for delivery."""
-        if self._outgoing_messages:
-            msg = b''.join(self._outgoing_messages)
-            self._outgoing_messages = []
-            
-            self._socket.sendall(msg)
+        """Writes as much of the pending messages to the socket as it will
+        accept without blocking. Anything left over remains queued for the
+        next flush.
+
+        Returns:
+            bool: True if all pending messages were written
+        """
+        if self._outgoing_control:
+            self._merge_control()
+
+        queue = self._outgoing_messages
+        if not queue:
+            return True
+
+        if len(queue) > 1:
+            data = b''.join(queue)
+            queue.clear()
+            queue.append(data)
+        else:
+            data = queue[0]
+
+        try:
+            with memoryview(data) as view:
+                sent = self._socket.send(view[self._outgoing_offset:])
+        except BlockingIOError:
+            return False
+
+        _bytes_sent.inc(amount=sent)
+        self._outgoing_bytes -= sent
+        if self._outgoing_bytes:
+            self._outgoing_offset += sent
+            return False
+
+        self._outgoing_messages = _EMPTY_QUEUE
+        self._outgoing_offset = 0
+        self._control_end = 0
+        return True
+
+    def _merge_control(self):
+        """Moves the priority messages into the outgoing queue, behind the
+        message being written and any earlier priority messages, but ahead
+        of every other message."""
+        control = self._outgoing_control
+        self._outgoing_control = _EMPTY_QUEUE
+        queue = self._outgoing_messages
+        if not queue:
+            self._outgoing_messages = control
+            self._control_end = sum(map(len, control))
+            return
+
+        # Messages are queued whole, or joined, so a partly written message
+        # ends at the first \n after the offset
+        offset = self._outgoing_offset
+        if offset and queue[0][offset - 1] != _LF:
+            offset = queue[0].find(b'\n', offset) + 1
+        position = max(self._control_end, offset)
+        head = []
+        while position:
+            msg = queue.popleft()
+            if len(msg) > position:
+                head.append(msg[:position])
+                queue.appendleft(msg[position:])
+                break
+            head.append(msg)
+            position -= len(msg)
+
+        queue.extendleft(reversed(control))
+        queue.extendleft(reversed(head))
+        self._control_end = sum(map(len, head)) + sum(map(len, control))
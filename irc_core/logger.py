@@ -1,5 +1,9 @@
+import atexit
 import logging
+import logging.handlers
+import queue
 import sys
+import time
 
 
 logger = logging.getLogger("irc_core")
@@ -9,3 +13,115 @@ handler.flush = sys.stdout.flush
 
 logger.addHandler(handler)
 logger.setLevel(logging.DEBUG)
+
+
+LOG_QUEUE_SIZE = 10000  # records waiting to be written before they are dropped
+
+
+class DroppingQueueHandler(logging.handlers.QueueHandler):
+    """Hands records to a QueueListener thread, which writes them, so a slow
+    terminal or pipe never blocks the event loop.
+
+    As with any QueueHandler, the message is formatted before it is queued,
+    since its arguments (i.e a connection) may have changed by the time the
+    listener writes it. When the queue is full records are dropped and
+    counted rather than waited on.
+    """
+
+    def __init__(self, record_queue):
+        super().__init__(record_queue)
+        self.dropped = 0
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+
+_queue_handler = None
+_listener = None
+
+
+def configure(level=logging.DEBUG, asynchronous=False, stream=None):
+    """Sets the level of the irc_core logger, and how its records are written.
+
+    Args:
+        level (int | str): The lowest level which is logged (i.e 'INFO')
+        asynchronous (bool): Write records from a background thread, through
+            a queue of at most LOG_QUEUE_SIZE records
+        stream: Where records are written (stdout by default)
+    """
+    global handler, _queue_handler, _listener
+
+    stop()
+    for old in list(logger.handlers):
+        logger.removeHandler(old)
+
+    stream = stream if stream is not None else sys.stdout
+    handler = logging.StreamHandler(stream)
+    handler.flush = stream.flush
+
+    if asynchronous:
+        _queue_handler = DroppingQueueHandler(queue.Queue(LOG_QUEUE_SIZE))
+        _listener = logging.handlers.QueueListener(_queue_handler.queue, handler)
+        _listener.start()
+        logger.addHandler(_queue_handler)
+    else:
+        logger.addHandler(handler)
+
+    logger.setLevel(level)
+
+
+def stop():
+    """Writes any queued records, and stops the background thread."""
+    global _listener
+    if _listener is not None:
+        _listener.stop()
+        _listener = None
+
+
+atexit.register(stop)
+
+
+def dropped_records():
+    """The number of records dropped because the queue was full."""
+    return _queue_handler.dropped if _queue_handler is not None else 0
+
+
+class RateLimitedTrace:
+    """Logs DEBUG traces (i.e one for every received message) at no more
+    than `rate` records per second, so tracing can't flood the log.
+
+    The level is checked before anything else, so a trace costs one cached
+    lookup when DEBUG is disabled. Traces beyond the limit are counted, and
+    reported once the next second starts.
+    """
+
+    def __init__(self, logger, rate=100):
+        self.logger = logger
+        self.rate = rate
+        self.suppressed = 0
+        self._count = 0
+        self._window_end = 0.0
+
+    def __call__(self, msg, *args):
+        if not self.logger.isEnabledFor(logging.DEBUG):
+            return
+
+        now = time.monotonic()
+        if now >= self._window_end:
+            if self.suppressed:
+                self.logger.debug('suppressed %s traces', self.suppressed)
+            self._window_end = now + 1.0
+            self._count = 0
+            self.suppressed = 0
+
+        if self._count < self.rate:
+            self._count += 1
+            self.logger.debug(msg, *args)
+        else:
+            self.suppressed += 1
+
+
+trace = RateLimitedTrace(logger)
@@ -1,9 +1,60 @@
-import asyncio
 from asyncio.coroutines import iscoroutinefunction
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
 from .connections import Connection
-from .logger import logger
-from .parser import parse_message
+from .logger import logger, trace, dropped_records
+from .metrics import registry
+from .parser import parse_message, serialize_message
 from typing import Callable, List, Optional
+import asyncio
+import functools
+import time
+
+
+_messages_received = registry.counter(
+    'irc_received_messages_total', 'Messages received, by command', label='command')
+_handler_seconds = registry.histogram(
+    'irc_handler_seconds', 'Time spent handling messages, by command', label='command')
+registry.gauge('irc_log_records_dropped', 'Log records dropped because the log queue was full',
+               collect=dropped_records)
+
+# Jobs submitted to each executor which have not finished yet. Executors
+# are removed once they have none, so none are kept alive by being counted.
+_executor_jobs = {}
+registry.gauge('irc_executor_jobs', 'Handlers running (or waiting to run) in executors',
+               collect=lambda: sum(_executor_jobs.values()))
+_executor_saturated = registry.counter(
+    'irc_executor_saturated_total',
+    'Handlers which had to wait for a free executor worker, by command', label='command')
+
+
+# What a handler run in an executor is given in place of the connection, since
+# the connection itself may only be used from the event loop (and can't be
+# pickled for a process pool).
+ConnectionInfo = namedtuple('ConnectionInfo', 'addr host nickname username real_name registered')
+
+
+def _connection_info(connection):
+    return ConnectionInfo(connection.addr, connection.host, connection.nickname,
+                          connection.username, connection.real_name, connection.registered)
+
+
+async def _run_in_executor(executor, workers, msg, func, args, prefix):
+    """Runs a handler in an executor, counting it as saturated when all
+    `workers` of the executor are already busy (if the number is known)."""
+    jobs = _executor_jobs.get(executor, 0)
+    if workers is not None and jobs >= workers:
+        _executor_saturated.inc(msg)
+    _executor_jobs[executor] = jobs + 1
+    try:
+        return await asyncio.get_running_loop().run_in_executor(
+            executor, functools.partial(func, *args, prefix=prefix))
+    finally:
+        jobs = _executor_jobs[executor] - 1
+        if jobs:
+            _executor_jobs[executor] = jobs
+        else:
+            del _executor_jobs[executor]
 
 
 class MessageListener:
@@ -16,69 +67,167 @@ class MessageListener:
     and Javascript's on, off, and once Event functions.
     """
 
+    EXECUTOR_WORKERS = 4  # threads of the executor used by on(msg, executor=True)
+
     def __init__(self):
+        # Handlers are kept as tuples per command (in the order they were bound),
+        # so that dispatching a message needs no more than a dict lookup.
         self.general_message_handlers = {}  # Manages message handlers from any connection
         # Manages message handlers only for a specific connection
         self.specific_message_handlers = {}
+        # Handlers which are given the undecoded parameters (as bytes)
+        self.raw_handlers = set()
+        self.executor = None  # Created when first needed
+        self._executor_workers = None  # The size of self.executor
+
+    def _bind(self, msg, func, from_):
+        if from_ is None:
+            handlers, key = self.general_message_handlers, msg
+        else:
+            handlers, key = self.specific_message_handlers, (msg, from_)
+        handlers[key] = handlers.get(key, ()) + (func,)
+
+    def _default_executor(self):
+        if self.executor is None:
+            self._executor_workers = self.EXECUTOR_WORKERS
+            self.executor = ThreadPoolExecutor(self._executor_workers,
+                                               thread_name_prefix='irc-handler')
+        return self.executor
+
+    def _offload(self, msg, func, executor, workers):
+        """Wraps a plain function in a coroutine which runs it in an executor,
+        and then sends the replies it returned from the event loop."""
+        @functools.wraps(func)
+        async def run_in_executor(connection, *params, prefix=None):
+            if executor is True:
+                pool, size = self._default_executor(), self._executor_workers
+            else:
+                pool, size = executor, workers
+            replies = await _run_in_executor(pool, size, msg, func,
+                                             (_connection_info(connection), *params), prefix)
+            for reply in replies or ():
+                self.send_to(connection, *reply)
+        return run_in_executor
+
+    def send_to(self, connection, msg, *params, prefix=None):
+        """Queues a message on a connection."""
+        connection.send_message(serialize_message(msg, *params, prefix=prefix))
 
     # replaces `command`
-    def on(self, msg, from_=None) -> Callable[[Connection, List[bytes], Optional[bytes]], None]:
-        """Bind a callback to a specific message type."""
+    def on(self, msg, from_=None, executor=None, raw=False, workers=None) -> Callable[[Connection, List[bytes], Optional[bytes]], None]:
+        """Bind a callback to a specific message type.
+
+        Any number of callbacks may be bound to the same message type, and
+        they are called in the order they were bound.
+
+        Callbacks which block or are CPU-heavy can be run in an executor,
+        and must then be plain functions rather than coroutines. They are
+        called with a ConnectionInfo in place of the connection, and return
+        the replies to send to the connection as (command, *params) tuples.
+        The next message from the connection waits for them to finish, so
+        messages from a connection are still handled in order.
+
+        Args:
+            executor (concurrent.futures.Executor | bool): The thread or
+                process pool to run the callback in, or True for a shared
+                pool of EXECUTOR_WORKERS threads
+            raw (bool): Pass the parameters to the callback as the bytes they
+                were received as, rather than decoding them to strings
+            workers (int): The number of workers of `executor`, so that
+                callbacks waiting for a free one are counted as saturated
+                (not needed with executor=True, which has EXECUTOR_WORKERS)
+        """
         def _decorator(func):
+            if executor:
+                if iscoroutinefunction(func):
+                    logger.error(
+                        'attempted to run coroutine func %s for msg %s in an executor', func, msg)
+                    return func
+                logger.debug('binding msg %s to %s in executor %s', msg, func, executor)
+                offloaded = self._offload(msg, func, executor, workers)
+                if raw:
+                    self.raw_handlers.add(offloaded)
+                self._bind(msg, offloaded, from_)
+                return func
+
             if not iscoroutinefunction(func):
                 logger.error(
                     'attempted to bind non-coroutine func %s to msg %s', func, msg)
                 return func
 
             logger.debug('binding msg %s to %s', msg, func)
-            if from_ is None:
-                self.general_message_handlers[msg] = func
-            else:
-                self.specific_message_handlers[(msg, from_)] = func
+            if raw:
+                self.raw_handlers.add(func)
+            self._bind(msg, func, from_)
             return func
         return _decorator
 
     def off(self, msg, func, from_=None) -> None:
         """Unbind a callback for a specific message type."""
         if from_ is None:
-            self.general_message_handlers.pop(msg, None)
+            handlers, key = self.general_message_handlers, msg
+        else:
+            handlers, key = self.specific_message_handlers, (msg, from_)
+
+        remaining = []
+        for f in handlers.get(key, ()):
+            if f is func or getattr(f, '__wrapped__', None) is func:
+                self.raw_handlers.discard(f)
+            else:
+                remaining.append(f)
+        if remaining:
+            handlers[key] = tuple(remaining)
         else:
-            self.specific_message_handlers.pop((msg, from_), None)
+            handlers.pop(key, None)
 
-    def once(self, msg, from_=None) -> Callable[[Connection, List[bytes], Optional[bytes]], None]:
+    def once(self, msg, from_=None, executor=None, workers=None) -> Callable[[Connection, List[bytes], Optional[bytes]], None]:
         """Bind a callback for a specific message type, and then
-        unbind after one message has been processed."""
+        unbind after one message has been processed.
+
+        See on() for running the callback in an executor.
+        """
         def _decorator(func):
+            if executor:
+                func = self._offload(msg, func, executor, workers)
+
             def wrapper(*args, **kwargs):
                 self.off(msg, wrapper, from_)
                 return func(*args, **kwargs)
-            if from_ is None:
-                self.general_message_handlers[msg] = wrapper
-            else:
-                self.specific_message_handlers[(msg, from_)] = wrapper
+            self._bind(msg, wrapper, from_)
             return wrapper
         return _decorator
 
     async def handle_message(self, connection, message):
-        """Used to parse a received message and pass it to any bound callbacks."""
-        logger.debug("received message %s from %s", message, connection)
-        cmd, prefix, params = parse_message(message)
+        """Used to parse a received message and pass it to any bound callbacks.
 
-        general_func = self.general_message_handlers.get(cmd)
-        specific_func = self.specific_message_handlers.get((cmd, connection))
+        Callbacks are awaited one after the other, in the order they were bound.
+        Parameters are only decoded if a callback which isn't raw needs them.
+        """
+        trace("received message %s from %s", message, connection)
+        message = parse_message(message)
+        cmd = message.command
 
-        bound_funcs = []
-        if general_func:
-            bound_funcs.append(general_func)
-        if specific_func:
-            bound_funcs.append(specific_func)
+        handlers = self.general_message_handlers.get(cmd, ())
+        if self.specific_message_handlers:
+            specific = self.specific_message_handlers.get((cmd, connection))
+            if specific:
+                handlers += specific
 
-        if not bound_funcs:
+        if not handlers:
+            # Not labelled by command, so clients can't create any number of labels
+            _messages_received.inc('unknown')
             logger.warning("received unknown message type %s", cmd)
             return
 
-        futures = [
-            f(connection, *params, prefix=prefix)
-            for f in bound_funcs
-        ]
-        await asyncio.gather(*futures)
+        _messages_received.inc(cmd)
+        start = time.perf_counter()
+        raw_handlers = self.raw_handlers
+        if len(handlers) == 1:
+            handler = handlers[0]
+            params = message.raw_params if handler in raw_handlers else message.params
+            await handler(connection, *params, prefix=message.prefix)
+        else:
+            for handler in handlers:
+                params = message.raw_params if handler in raw_handlers else message.params
+                await handler(connection, *params, prefix=message.prefix)
+        _handler_seconds.observe(time.perf_counter() - start, cmd)
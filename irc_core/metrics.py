@@ -0,0 +1,253 @@
+"""Counters, gauges and histograms which are cheap enough to update for every
+message, and can be rendered in the Prometheus text exposition format.
+
+Metrics have at most one label. Values are kept in plain dicts keyed by
+the label value, so updating a metric is a dict lookup and an addition.
+Anything which can be computed on demand (i.e the number of connections)
+is a Gauge with a `collect` callback, which costs nothing until scraped.
+"""
+import asyncio
+import bisect
+
+from .logger import logger
+
+
+# Seconds, suited to handler latency and event loop lag
+DEFAULT_BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01,
+                   0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5)
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _format_value(value):
+    if value == float('inf'):
+        return '+Inf'
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return repr(value)
+
+
+class Metric:
+    type = None
+
+    def __init__(self, name, help, label=None):
+        """
+        Args:
+            name (str): The name of the metric
+            help (str): A description of the metric
+            label (str): The name of the metric's label, if it has one
+        """
+        self.name = name
+        self.help = help
+        self.label = label
+
+    def samples(self):
+        """Yields (name, label value, value) for each sample of the metric.
+        The label value is None for unlabelled samples."""
+        raise NotImplementedError
+
+    def _labels(self, label_value, extra=None):
+        labels = []
+        if self.label is not None and label_value is not None:
+            labels.append(f'{self.label}="{_escape(label_value)}"')
+        if extra is not None:
+            labels.append(extra)
+        return '{' + ','.join(labels) + '}' if labels else ''
+
+
+class Counter(Metric):
+    """A count which only goes up, i.e of messages received."""
+
+    type = 'counter'
+
+    def __init__(self, name, help, label=None):
+        super().__init__(name, help, label)
+        self._values = {}  # label value -> count
+
+    def inc(self, label_value=None, amount=1):
+        values = self._values
+        values[label_value] = values.get(label_value, 0) + amount
+
+    def value(self, label_value=None):
+        return self._values.get(label_value, 0)
+
+    def samples(self):
+        for label_value, value in list(self._values.items()):
+            yield self.name, label_value, value
+
+
+class Gauge(Metric):
+    """A value which goes up and down, either set directly, or computed by
+    a `collect` callback when the metric is read."""
+
+    type = 'gauge'
+
+    def __init__(self, name, help, label=None, collect=None):
+        """
+        Args:
+            collect (Callable): Returns the current value, or a dict of
+                label values to values if the gauge has a label
+        """
+        super().__init__(name, help, label)
+        self._collect = collect
+        self._values = {}
+
+    def set(self, value, label_value=None):
+        self._values[label_value] = value
+
+    def value(self, label_value=None):
+        if self._collect is not None:
+            collected = self._collect()
+            return collected.get(label_value, 0) if self.label else collected
+        return self._values.get(label_value, 0)
+
+    def samples(self):
+        if self._collect is None:
+            values = self._values
+        elif self.label is None:
+            values = {None: self._collect()}
+        else:
+            values = self._collect()
+
+        for label_value, value in list(values.items()):
+            yield self.name, label_value, value
+
+
+class Histogram(Metric):
+    """Counts observations (i.e latencies) in cumulative buckets."""
+
+    type = 'histogram'
+
+    def __init__(self, name, help, label=None, buckets=DEFAULT_BUCKETS):
+        super().__init__(name, help, label)
+        self.buckets = tuple(sorted(buckets))
+        self._values = {}  # label value -> [bucket counts..., +Inf count, sum, count]
+
+    def observe(self, value, label_value=None):
+        values = self._values.get(label_value)
+        if values is None:
+            values = self._values[label_value] = [0] * (len(self.buckets) + 3)
+        values[bisect.bisect_left(self.buckets, value)] += 1
+        values[-2] += value
+        values[-1] += 1
+
+    def count(self, label_value=None):
+        values = self._values.get(label_value)
+        return values[-1] if values else 0
+
+    def sum(self, label_value=None):
+        values = self._values.get(label_value)
+        return values[-2] if values else 0
+
+    def samples(self):
+        for label_value, values in list(self._values.items()):
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float('inf'),), values):
+                cumulative += count
+                yield self.name + '_bucket', (label_value, f'le="{_format_value(bound)}"'), cumulative
+            yield self.name + '_sum', label_value, values[-2]
+            yield self.name + '_count', label_value, values[-1]
+
+
+class MetricsRegistry:
+    """A collection of metrics, which are rendered together."""
+
+    def __init__(self):
+        self._metrics = {}  # name -> metric
+
+    def register(self, metric):
+        """Adds a metric, replacing any metric with the same name."""
+        self._metrics[metric.name] = metric
+        return metric
+
+    def counter(self, name, help, label=None):
+        return self.register(Counter(name, help, label))
+
+    def gauge(self, name, help, label=None, collect=None):
+        return self.register(Gauge(name, help, label, collect))
+
+    def histogram(self, name, help, label=None, buckets=DEFAULT_BUCKETS):
+        return self.register(Histogram(name, help, label, buckets))
+
+    def get(self, name):
+        return self._metrics.get(name)
+
+    def __iter__(self):
+        return iter(list(self._metrics.values()))
+
+    def samples(self):
+        """Yields a `name{labels} value` line for every sample of every
+        metric, as in the Prometheus text format."""
+        for metric in self:
+            yield from self._lines(metric)
+
+    def render(self):
+        """Renders every metric in the Prometheus text exposition format."""
+        lines = []
+        for metric in self:
+            lines.append(f'# HELP {metric.name} {metric.help}')
+            lines.append(f'# TYPE {metric.name} {metric.type}')
+            lines.extend(self._lines(metric))
+        lines.append('')
+        return '\n'.join(lines)
+
+    @staticmethod
+    def _lines(metric):
+        for name, label_value, value in metric.samples():
+            if isinstance(label_value, tuple):
+                labels = metric._labels(*label_value)
+            else:
+                labels = metric._labels(label_value)
+            yield f'{name}{labels} {_format_value(value)}'
+
+
+# The metrics of this process
+registry = MetricsRegistry()
+
+
+class MetricsExporter:
+    """Serves the metrics of a registry over HTTP, for Prometheus to scrape.
+
+    Any GET request is answered with the rendered metrics, so it is only
+    meant to be bound to a local or otherwise trusted interface.
+    """
+
+    CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+    def __init__(self, host='127.0.0.1', port=9100, registry=registry):
+        self.host = host
+        self.port = port
+        self.registry = registry
+        self._server = None
+
+    async def start(self):
+        self._server = await asyncio.start_server(self._handle, self.host, self.port)
+        logger.info('serving metrics at http://%s:%s/metrics', self.host, self.port)
+
+    def close(self):
+        if self._server is not None:
+            self._server.close()
+            self._server = None
+
+    async def _handle(self, reader, writer):
+        try:
+            request = await asyncio.wait_for(reader.readuntil(b'\r\n\r\n'), 5)
+            method = request.split(b' ', 1)[0]
+            if method != b'GET':
+                status, body = '405 Method Not Allowed', b''
+            else:
+                status, body = '200 OK', self.registry.render().encode()
+
+            writer.write(
+                f'HTTP/1.1 {status}\r\n'
+                f'Content-Type: {self.CONTENT_TYPE}\r\n'
+                f'Content-Length: {len(body)}\r\n'
+                'Connection: close\r\n\r\n'.encode() + body)
+            await writer.drain()
+        except (asyncio.TimeoutError, asyncio.IncompleteReadError, asyncio.LimitOverrunError,
+                ValueError, ConnectionError):
+            pass  # Gone, or not a request we could read (i.e a huge request line)
+        finally:
+            writer.close()
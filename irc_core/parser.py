@@ -1,53 +1,189 @@
+import functools
+import sys
+
+
+@functools.lru_cache(maxsize=4096)
+def _encode_head(msg, prefix):
+    """Encodes the prefix and command of a message, caching the result since
+    the same few are used for almost every message."""
+    if prefix is None:
+        return str(msg).encode()
+    return (':%s %s' % (prefix, msg)).encode()
+
+
+def _join_params(params, sep, space, cr, lf, colon):
+    """Validates the parameters and joins them with `sep`, prefixing the final
+    parameter with a colon if it contains spaces.
+
+    For bytes parameters, `space`, `cr` and `lf` are given as ints, since
+    checking bytes for an int is several times faster than for a substring.
+    """
+    *middle, last = params
+    for param in middle:
+        if cr in param or lf in param:
+            raise ValueError('parameters may not contain \\r or \\n')
+        if space in param:
+            raise ValueError('only the final parameter may contain spaces')
+    if cr in last or lf in last:
+        raise ValueError('parameters may not contain \\r or \\n')
+    if space in last:
+        last = colon + last
+    return sep.join((*middle, last))
+
+
+def _serialize(msg, params, prefix, terminator):
+    head = _encode_head(msg, prefix)
+    if not params:
+        return head + terminator
+
+    if params[-1].__class__ is bytes:
+        # Text relayed without being decoded, addressed with str parameters
+        params = [p.encode() if p.__class__ is str else p for p in params]
+        body = _join_params(params, b' ', 32, 13, 10, b':')
+    else:
+        body = _join_params(params, ' ', ' ', '\r', '\n', ':').encode()
+
+    return b''.join((head, b' ', body, terminator))
+
+
 def serialize_message(msg, *params, prefix=None):
     """Serializes a message from higher-level python
     to a IRC message packet.
+
+    Parameters are str, except that the final parameter may be bytes (i.e
+    text being relayed without having been decoded), and then any of the
+    others may be bytes too.
     
     NOTE: \\r\\n terminator is added by connection class
     """
-    serialized = ''
-    if prefix is not None:
-        serialized += ':%s ' % prefix
-    
-    serialized += msg
-    for i, param in enumerate(params):
-        if '\r' in param or '\n' in param:
-            raise ValueError('parameters may not contain \\r or \\n')
-        if ' ' in param:
-            if i != len(params) - 1:
-                raise ValueError('only the final parameter may contain spaces')
-            serialized += ' :%s' % param
-        else:
-            serialized += ' %s' % param
-    
-    serialized = serialized.encode('ascii')
+    return _serialize(msg, params, prefix, b'')
+
+
+def frame_message(msg, *params, prefix=None):
+    """Serializes a message in the same way as serialize_message, but
+    includes the \\r\\n terminator so that the frame can be queued
+    directly on any number of connections."""
+    return _serialize(msg, params, prefix, b'\r\n')
+
+
+@functools.lru_cache(maxsize=1024)
+def frame_cached(msg, params, prefix=None):
+    """Returns the frame of a message from an LRU cache of pre-encoded
+    frames. Intended for replies which are sent over and over with the
+    same parameters (i.e numeric replies).
+
+    Args:
+        params (tuple): The parameters, which must be hashable
+    """
+    return _serialize(msg, params, prefix, b'\r\n')
+
+
+class Message:
+    """A parsed IRC message.
+
+    Parameters are kept as the raw bytes from the wire, and only decoded
+    to strings the first time `params` is accessed, so a message which is
+    only inspected by command (or dropped) is never decoded.
+
+    For compatibility, a Message can be unpacked like the tuple
+    `command, prefix, params`.
+    """
+
+    __slots__ = ('command', 'prefix', 'raw_params', 'raw', '_params')
+
+    def __init__(self, command, prefix, raw_params, raw):
+        """
+        Args:
+            command (str): The command or numeric reply code
+            prefix (str): The prefix, or None if there was no prefix
+            raw_params (List[bytes]): The undecoded parameters
+            raw (bytes): The message the parameters were parsed from
+        """
+        self.command = command
+        self.prefix = prefix
+        self.raw_params = raw_params
+        self.raw = raw
+        self._params = None
+
+    @property
+    def params(self):
+        """The parameters decoded to strings."""
+        if self._params is None:
+            raw_params = self.raw_params
+            if len(raw_params) == 1:
+                self._params = [raw_params[0].decode('utf-8', 'replace')]
+                return self._params
+
+            # Decoded in one go, which is quicker than one at a time. Clients
+            # should never send a line feed, but one in a parameter would
+            # split it, so then they are decoded one at a time after all.
+            try:
+                params = b'\n'.join(raw_params).decode().split('\n')
+            except UnicodeDecodeError:
+                params = b'\n'.join(raw_params).decode('utf-8', 'replace').split('\n')
+            if len(params) != len(raw_params):
+                params = [p.decode('utf-8', 'replace') for p in raw_params]
+            self._params = params
+        return self._params
+
+    def __iter__(self):
+        return iter((self.command, self.prefix, self.params))
+
+    def __repr__(self):
+        return f'Message(command={self.command!r}, prefix={self.prefix!r}, raw_params={self.raw_params!r})'
+
+
+# Decoded command tokens, so that each distinct command is decoded once and
+# every message shares the same (interned) string. Bounded, since clients
+# may send arbitrary garbage as commands.
+_commands = {}
+_MAX_CACHED_COMMANDS = 1024
+
+
+def _command(token):
+    command = _commands.get(token)
+    if command is None:
+        command = sys.intern(token.decode('ascii', 'replace'))
+        if len(_commands) < _MAX_CACHED_COMMANDS:
+            _commands[token] = command
+    return command
 
-    return serialized
 
 def parse_message(message):
-    """Parse a bytes message to its string parts.
+    """Parse a bytes message to its parts.
+
+    Works directly on the bytes (or a bytearray / memoryview of them)
+    without decoding the whole message.
 
     Returns:
-        command_code, parameter_list, prefix
+        Message: which unpacks to command_code, prefix, parameter_list
     """
-    message = message.decode()
+    if message.__class__ is not bytes:
+        message = bytes(message)
+    if message[-2:] == b'\r\n':
+        message = message[:-2]
 
-    message = message.replace("\r\n", "")
+    # The prefix has no spaces, so the first ' :' always starts the trailing
+    # parameter. Bytes methods are quickest without start and end arguments.
+    trailing_start = message.find(b' :')
+    if trailing_start == -1:
+        params = message.split(b' ')
+    else:
+        params = message[:trailing_start].split(b' ')
+    if b'' in params:
+        params = [p for p in params if p]  # Repeated, leading or trailing spaces
 
     prefix = None
-    if message.startswith(':'):
-        first_space = message.index(' ')
-        prefix = message[1:first_space]
-        message = message[first_space+1:].lstrip(' ')
-
-    trailing_start = message.find(':')
-    trailing = []
-    if trailing_start != -1:   
-        trailing.append(message[trailing_start+1:])
-        message = message[:trailing_start]
+    if message[:1] == b':':
+        prefix = params.pop(0)[1:].decode('utf-8', 'replace')
 
-    cmd, *params = message.split(' ')
-    params = list(p for p in params if p)
+    if params:
+        token = params.pop(0)
+        cmd = _commands.get(token) or _command(token)
+    else:
+        cmd = ''
 
-    params += trailing
+    if trailing_start != -1:
+        params.append(message[trailing_start + 2:])
 
-    return cmd, prefix, params
\ No newline at end of file
+    return Message(cmd, prefix, params, message)
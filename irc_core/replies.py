@@ -1,8 +1,12 @@
 """Defines constants for reply codes"""
 
+RPL_STATSCOMMANDS = '212'
+RPL_ENDOFSTATS = '219'
+RPL_STATSDEBUG = '249'
 RPL_NAMEREPLY = '353'
 RPL_ENDOFNAMES = '366'
 
+ERR_NOSUCHNICK = '401'
 ERR_NOTEXTTOSEND = '412'
 ERR_NONICKNAMEGIVEN = '431'
 ERR_ERRONEUSNICKNAME = '432'
@@ -0,0 +1,94 @@
+import asyncio
+import socket
+import time
+from collections import OrderedDict
+
+from .logger import logger
+
+
+_MISSING = object()
+
+
+class HostnameResolver:
+    """Resolves IP addresses to hostnames without blocking the event loop.
+
+    Lookups are run in an executor, and given up on after a timeout.
+    Results (including failures) are kept in a cache which expires entries
+    after `ttl` seconds, and evicts the least recently used entry once
+    `max_size` addresses are cached. Concurrent lookups of the same address
+    share a single request.
+    """
+
+    def __init__(self, lookup=socket.gethostbyaddr, timeout=2.0, ttl=300.0, max_size=4096, executor=None):
+        """
+        Args:
+            lookup (Callable): A blocking function in the style of
+                socket.gethostbyaddr, returning a tuple whose first item
+                is the hostname
+            timeout (float): Seconds to wait for a lookup before giving up
+            ttl (float): Seconds for which a result is cached
+            max_size (int): The maximum number of cached addresses
+            executor (concurrent.futures.Executor): Where to run lookups. Uses
+                the event loop's default executor if None.
+        """
+        self._lookup = lookup
+        self.timeout = timeout
+        self.ttl = ttl
+        self.max_size = max_size
+        self._executor = executor
+
+        self._cache = OrderedDict()  # ip -> (hostname, expiry time)
+        self._pending = {}  # ip -> Future of an in-flight lookup
+
+    def _cached(self, ip):
+        """Returns the cached hostname for an IP, or _MISSING if there is no
+        valid cache entry. A failed lookup is cached as None."""
+        entry = self._cache.get(ip)
+        if entry is None:
+            return _MISSING
+
+        hostname, expires = entry
+        if expires < time.monotonic():
+            del self._cache[ip]
+            return _MISSING
+
+        self._cache.move_to_end(ip)
+        return hostname
+
+    def _store(self, ip, hostname):
+        self._cache[ip] = (hostname, time.monotonic() + self.ttl)
+        self._cache.move_to_end(ip)
+        while len(self._cache) > self.max_size:
+            self._cache.popitem(last=False)
+
+    async def resolve(self, ip):
+        """Resolves an IP address to a hostname.
+
+        Returns:
+            str: The hostname, or None if it could not be resolved in time
+        """
+        hostname = self._cached(ip)
+        if hostname is not _MISSING:
+            return hostname
+
+        pending = self._pending.get(ip)
+        if pending is None:
+            pending = self._pending[ip] = asyncio.ensure_future(self._resolve(ip))
+            pending.add_done_callback(lambda _: self._pending.pop(ip, None))
+
+        return await asyncio.shield(pending)
+
+    async def _resolve(self, ip):
+        loop = asyncio.get_running_loop()
+        try:
+            hostname, *_ = await asyncio.wait_for(
+                loop.run_in_executor(self._executor, self._lookup, ip),
+                self.timeout)
+        except asyncio.TimeoutError:
+            logger.warning('timed out resolving hostname for %s', ip)
+            hostname = None
+        except (OSError, UnicodeError):
+            hostname = None
+
+        self._store(ip, hostname)
+        return hostname
@@ -0,0 +1,90 @@
+_NO_MEMBERS = frozenset()
+
+
+class ChannelRegistry:
+    """Tracks which connections are members of which channels.
+
+    Keeps an index from each channel to its members, and from each
+    connection to the channels it is in, so that removing a connection
+    only touches the channels it was a member of. Channels are created
+    when their first member joins, and removed when their last member
+    leaves.
+    """
+
+    def __init__(self):
+        self._members = {}  # channel name -> set of connections
+        self._channels = {}  # connection -> set of channel names
+
+    def join(self, connection, channel):
+        """Adds a connection to a channel.
+
+        Returns:
+            bool: False if the connection was already a member
+        """
+        members = self._members.get(channel)
+        if members is None:
+            members = self._members[channel] = set()
+        elif connection in members:
+            return False
+
+        members.add(connection)
+        self._channels.setdefault(connection, set()).add(channel)
+        return True
+
+    def part(self, connection, channel):
+        """Removes a connection from a channel.
+
+        Returns:
+            bool: False if the connection was not a member
+        """
+        members = self._members.get(channel)
+        if members is None or connection not in members:
+            return False
+
+        self._discard(connection, channel, members)
+
+        channels = self._channels[connection]
+        channels.discard(channel)
+        if not channels:
+            del self._channels[connection]
+        return True
+
+    def remove(self, connection):
+        """Removes a connection from every channel it is a member of.
+
+        Returns:
+            set: The names of the channels the connection was removed from
+        """
+        channels = self._channels.pop(connection, set())
+        for channel in channels:
+            self._discard(connection, channel, self._members[channel])
+        return channels
+
+    def _discard(self, connection, channel, members):
+        members.discard(connection)
+        if not members:
+            del self._members[channel]
+
+    def members(self, channel):
+        """Returns the set of connections in a channel (empty if the channel
+        does not exist).
+
+        NOTE: The set is not a copy, and must not be modified.
+        """
+        return self._members.get(channel, _NO_MEMBERS)
+
+    def channels_of(self, connection):
+        """Returns the set of channel names a connection is a member of.
+
+        NOTE: The set is not a copy, and must not be modified.
+        """
+        return self._channels.get(connection, _NO_MEMBERS)
+
+    def __contains__(self, channel):
+        return channel in self._members
+
+    def __iter__(self):
+        return iter(self._members)
+
+    def __len__(self):
+        return len(self._members)
@@ -0,0 +1,108 @@
+import time
+
+
+# Tokens taken by each command. Commands which make the server send to
+# many connections cost more, and replies to keepalive pings cost little,
+# so they still get through while a client is being throttled.
+DEFAULT_COSTS = {
+    'PRIVMSG': 2.0,
+    'NOTICE': 2.0,
+    'JOIN': 2.0,
+    'NICK': 4.0,
+    'PING': 0.25,
+    'PONG': 0.25,
+    'QUIT': 0.0,
+}
+
+
+class FloodControl:
+    """Limits how fast each connection's commands are handled, using a token
+    bucket per connection.
+
+    Each bucket holds up to `burst` tokens, and refills at `rate` tokens per
+    second. A command is only handled once its connection's bucket holds
+    enough tokens to pay for it. Until then, the connection is held in a
+    penalty box: its messages stay queued, and it is not handled again
+    for the time the bucket takes to refill, plus `penalty` seconds.
+    A connection which keeps sending while it is held, so that more than
+    `max_backlog` messages are waiting, is flooding.
+
+    Buckets are refilled lazily when a command is checked, so the cost of
+    flood control is constant per message, and nothing is done for idle
+    connections.
+    """
+
+    def __init__(self, rate=4.0, burst=20.0, costs=None, default_cost=1.0, penalty=1.0, max_backlog=100):
+        """
+        Args:
+            rate (float): Tokens added to a bucket per second
+            burst (float): The maximum number of tokens in a bucket
+            costs (dict): Maps commands to the tokens they take. Defaults to
+                DEFAULT_COSTS.
+            default_cost (float): The tokens taken by any other command
+            penalty (float): Extra seconds to hold a connection for once it
+                goes over its limit
+            max_backlog (int): The number of held messages at which a
+                connection is flooding
+        """
+        self.rate = rate
+        self.burst = burst
+        self.default_cost = default_cost
+        self.penalty = penalty
+        self.max_backlog = max_backlog
+
+        if costs is None:
+            costs = DEFAULT_COSTS
+        # Keyed by the raw command, so messages do not have to be parsed
+        self._costs = {command.encode('ascii'): cost for command, cost in costs.items()}
+
+        self._buckets = {}  # connection -> [tokens, time they were counted]
+
+    def cost(self, message):
+        """Returns the tokens taken by a raw message."""
+        start = 0
+        if message[:1] == b':':
+            start = message.find(b' ') + 1
+            if not start:
+                return self.default_cost
+        end = message.find(b' ', start)
+        command = message[start:end] if end != -1 else message[start:]
+        return self._costs.get(bytes(command), self.default_cost)
+
+    def delay(self, connection, message):
+        """Takes the cost of a message from a connection's bucket.
+
+        Returns:
+            float: 0 if the message can be handled, otherwise the seconds to
+                hold the connection for before checking it again (in which
+                case no tokens are taken)
+        """
+        # A command costing more than a full bucket is let through once full
+        cost = min(self.cost(message), self.burst)
+        now = time.monotonic()
+
+        bucket = self._buckets.get(connection)
+        if bucket is None:
+            bucket = self._buckets[connection] = [self.burst, now]
+            tokens = self.burst
+        else:
+            tokens = min(self.burst, bucket[0] + (now - bucket[1]) * self.rate)
+            bucket[1] = now
+
+        if tokens >= cost:
+            bucket[0] = tokens - cost
+            return 0.0
+
+        bucket[0] = tokens
+        return (cost - tokens) / self.rate + self.penalty
+
+    def flooding(self, connection):
+        """Checks if a held connection has too many messages waiting."""
+        return connection.pending_messages > self.max_backlog
+
+    def forget(self, connection):
+        """Stops tracking a connection (i.e once it has disconnected)."""
+        self._buckets.pop(connection, None)
+
+    def __len__(self):
+        return len(self._buckets)
@@ -1,2 +1,4 @@
 from . import register
 from . import messaging
+from . import links
+from . import stats
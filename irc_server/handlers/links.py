@@ -0,0 +1,216 @@
+from irc_server import server
+from irc_server.links import RemoteUser
+from irc_core import logger
+from .register import channels, nicknames
+from .messaging import relay
+
+
+# Messages received over links to other servers are dispatched here, rather
+# than to the client handlers of the server
+links = server.links
+
+
+def _user_via(link, nickname):
+    """Returns the user with a nickname, if they are reachable through the
+    link. Messages about anyone else did not come from their direction, and
+    are ignored."""
+    if nickname is None:
+        return None
+
+    user = nicknames.get(nickname)
+    if user is None or user.link is not link:
+        return None
+    return user
+
+
+def _drop_remote_user(user, msg, via):
+    """Removes a user of another server, notifies the local clients who
+    could see them, and forwards the QUIT to the other links."""
+    nicknames.unregister(user.nickname, user)
+    channels.remove(user)
+    server.send('QUIT', msg, prefix=user.nickname)
+    links.propagate('QUIT', msg, prefix=user.nickname, via=via)
+
+
+@links.on('PASS')
+async def on_pass(link, password=None, *params, prefix=None):
+    """Handles the password a server sends before introducing itself."""
+    if password is not None:
+        links.set_password(link, password)
+
+
+@links.on('SERVER')
+async def on_server(link, name, hopcount='1', info='', prefix=None):
+    """Handles a server introducing itself over a new link, or introducing
+    the servers behind it.
+
+    A server which introduces itself without the shared password is
+    dropped. So is a server which is already known, since it is reachable
+    another way and the link would make a loop in the spanning tree.
+    """
+    handshake = links.peer_name(link) is None
+    if handshake and not links.authenticated(link):
+        logger.error('server %s sent a bad password, dropping link %s', name, link)
+        server.send_to(link, 'ERROR', 'Bad password')
+        await server.remove_connection(link)
+        return
+
+    if name == links.name or name in links.servers:
+        logger.error('server %s already exists, dropping link %s', name, link)
+        await server.remove_connection(link)
+        return
+
+    hopcount = int(hopcount)
+    uplink = links.name if handshake else prefix
+    logger.info('server %s linked to %s (%s hops)', name, uplink, hopcount)
+
+    links.add_server(name, link, hopcount, uplink, info)
+    links.propagate('SERVER', name, str(hopcount + 1), info, prefix=uplink, via=link)
+
+    if handshake:
+        _burst(link)
+        links.set_peer_name(link, name)
+
+
+def _burst(link):
+    """Sends a newly linked server the servers, users and channel
+    memberships known to this server."""
+    for name, (via, hopcount, uplink, info) in links.servers.items():
+        if via is not link:
+            server.send_to(link, 'SERVER', name, str(hopcount + 1), info, prefix=uplink)
+
+    users = [user for user in nicknames.connections()
+             if user.registered and user.link is not link]
+    for user in users:
+        links.introduce(user, to=link)
+    for user in users:
+        for channel in channels.channels_of(user):
+            server.send_to(link, 'JOIN', channel, prefix=user.nickname)
+
+
+@links.on('SQUIT')
+async def on_squit(link, name, comment=None, prefix=None):
+    """Handles a server behind a link being split from the network. Its
+    users are removed by the QUITs sent before the SQUIT."""
+    if name not in links.servers or links.servers[name][0] is not link:
+        return
+
+    logger.info('server %s split from the network (%s)', name, comment)
+    links.remove_server(name)
+    links.propagate('SQUIT', name, comment or name, prefix=prefix, via=link)
+
+
+@links.on('NICK')
+async def on_nick(link, *params, prefix=None):
+    """Handles a user being introduced by another server, or a user of
+    another server changing their nickname."""
+    if prefix is None and len(params) >= 2:
+        nickname, hopcount, username, host, real_name = (params + ('*',) * 3)[:5]
+        user = RemoteUser(link, nickname, int(hopcount), username, host, real_name)
+
+        existing = nicknames.get(nickname)
+        if existing is not None and existing.link is link:
+            return  # Introduced twice, i.e in a burst and as they registered
+
+        if not nicknames.register(nickname, user):
+            logger.error('nickname collision for %s from %s', nickname, link)
+            server.send_to(link, 'KILL', nickname, 'Nickname collision')
+            return
+
+        links.introduce(user, via=link)
+        return
+
+    user = _user_via(link, prefix)
+    if user is None or not params:
+        return
+
+    nickname = params[0]
+    if not nicknames.register(nickname, user):
+        logger.error('nickname collision for %s from %s', nickname, link)
+        server.send_to(link, 'KILL', nickname, 'Nickname collision')
+        _drop_remote_user(user, 'Nickname collision', via=link)
+        return
+
+    nicknames.unregister(prefix, user)
+    user.nickname = nickname
+    server.send('NICK', nickname, prefix=prefix)
+    links.propagate('NICK', nickname, prefix=prefix, via=link)
+
+
+@links.on('KILL')
+async def on_kill(link, nickname, msg='Killed', prefix=None):
+    """Handles another server removing a user, i.e after a nickname
+    collision."""
+    user = nicknames.get(nickname)
+    if user is None:
+        return
+
+    if user.link is None:
+        await server.remove_connection(user, msg=msg)
+    elif user.link is not link:
+        # Forward the KILL towards the user's server, which ignores the
+        # QUIT from this direction
+        links.propagate('KILL', nickname, msg, via=link)
+        _drop_remote_user(user, msg, via=link)
+
+
+@links.on('JOIN')
+async def on_join(link, channel, prefix=None):
+    user = _user_via(link, prefix)
+    if user is None or not channels.join(user, channel):
+        return
+
+    server.send_to_many(channels.members(channel), 'JOIN', channel, prefix=user.nickname)
+    links.propagate('JOIN', channel, prefix=user.nickname, via=link)
+
+
+@links.on('QUIT')
+async def on_quit(link, msg=None, prefix=None):
+    user = _user_via(link, prefix)
+    if user is not None:
+        _drop_remote_user(user, msg or user.nickname, via=link)
+
+
+@links.on('PRIVMSG', raw=True)
+async def relay_private_messages(link, receivers, msg=None, prefix=None):
+    user = _user_via(link, prefix)
+    if user is not None and msg:
+        relay(user, 'PRIVMSG', receivers.decode('utf-8', 'replace'), msg,
+              reply_errors=False, via=link)
+
+
+@links.on('NOTICE', raw=True)
+async def relay_notices(link, receivers, msg=None, prefix=None):
+    user = _user_via(link, prefix)
+    if user is not None and msg:
+        relay(user, 'NOTICE', receivers.decode('utf-8', 'replace'), msg,
+              reply_errors=False, via=link)
+
+
+@links.on('PING')
+async def on_ping(link, *params, prefix=None):
+    server.send_to(link, 'PONG', *params)
+
+
+@links.on('PONG')
+async def on_pong(link, *params, prefix=None):
+    """Any message counts as a reply to a PING, so PONG needs no handling"""
+
+
+@server.on_disconnect
+async def split(connection):
+    """Removes the users who were reachable through a link to another server
+    when the link is lost."""
+    if connection not in links:
+        return
+
+    peer = links.peer_name(connection)
+    logger.info('lost link to %s', peer)
+
+    msg = f'{links.name} {peer}'
+    for user in [user for user in nicknames.connections() if user.link is connection]:
+        _drop_remote_user(user, msg, via=connection)
+
+    if peer is not None:
+        links.remove_server(peer)
+        links.propagate('SQUIT', peer, msg, prefix=links.name, via=connection)
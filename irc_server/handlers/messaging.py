@@ -1,15 +1,17 @@
 from irc_server import server
-from irc_core.replies import ERR_NOTEXTTOSEND
+from irc_core.replies import ERR_NOTEXTTOSEND, ERR_NOSUCHNICK
 from irc_core import logger
-from .register import channel_membership
+from .register import channels, nicknames
 
 
-@server.on('PRIVMSG')
+@server.on('PRIVMSG', raw=True)
 async def relay_private_messages(connection, receivers, msg=None, prefix=None):
     """Handles forwarding messages to the appropriate clients when a PRIVMSG is
     received.
-    
-    NOTE: Currently only supports sending to channels.
+
+    Receivers may be a comma-separated list of channels and nicknames. The
+    parameters are raw bytes, so that the text is forwarded without ever
+    being decoded.
     """
     if not connection.registered:
         return # Ignore PRIVMSG from clients who are not yet fully registered
@@ -17,10 +19,49 @@ async def relay_private_messages(connection, receivers, msg=None, prefix=None):
     if not msg:
         return server.send_to(connection, ERR_NOTEXTTOSEND, "No text to send")
 
-    receivers = receivers.split(',')
+    relay(connection, 'PRIVMSG', receivers.decode('utf-8', 'replace'), msg, reply_errors=True)
+
+
+@server.on('NOTICE', raw=True)
+async def relay_notices(connection, receivers, msg=None, prefix=None):
+    """Handles forwarding messages to the appropriate clients when a NOTICE is
+    received.
+
+    NOTE: As required for NOTICE, errors are never replied to the sender.
+    """
+    if not connection.registered or not msg:
+        return
+
+    relay(connection, 'NOTICE', receivers.decode('utf-8', 'replace'), msg, reply_errors=False)
+
+
+def relay(connection, command, receivers, msg, reply_errors, via=None):
+    """Delivers a PRIVMSG or NOTICE to each of a comma-separated list of
+    channels and nicknames.
+
+    Receivers connected to other servers are delivered to through their
+    links, but never back over the link `via` the message arrived on.
+
+    The text `msg` may be str, or the bytes it was received as.
+    """
+    for receiver in receivers.split(','):
+        if not receiver:
+            continue
 
-    for receiver in receivers:
         if receiver[0] in {'#', '&'}:
-            for conn in channel_membership[receiver] - {connection}:
-                server.send_to(conn, 'PRIVMSG', receiver, msg,
-                    prefix=connection.nickname)
+            server.send_to_many(channels.members(receiver),
+                command, receiver, msg,
+                prefix=connection.nickname, exclude=connection,
+                route=True, via=via)
+            continue
+
+        target = nicknames.get(receiver)
+        if target is not None:
+            if via is not None and target.link is via:
+                continue
+            server.send_to(target, command, receiver, msg,
+                           prefix=connection.nickname)
+        elif reply_errors:
+            logger.error('ERR_NOSUCHNICK %s receiver=%s connection=%s',
+                         command, receiver, connection)
+            server.send_to(connection, ERR_NOSUCHNICK, receiver, 'No such nick/channel')
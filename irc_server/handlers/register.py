@@ -1,50 +1,48 @@
-from typing import DefaultDict
 from irc_server import server
+from irc_server.channels import ChannelRegistry
+from irc_server.nicknames import NicknameRegistry, nickname_to_lowercase
 
 from irc_core.replies import *
 from irc_core.connections import Connection
 
 from irc_core import logger
+from irc_core.metrics import registry
 
 
 ALLOWED_IN_NICKNAME = set(R"abcdefghijklmnopqrstuvwxyz0123456789-[]\|`^{}")
 
-# Tracks all registered nicknames
-registered_nicknames = set()
+# Tracks all registered nicknames, and the connections they belong to
+nicknames = NicknameRegistry()
 
 # Tracks channel membership (just #global for now)
-channel_membership = DefaultDict(set)
+channels = ChannelRegistry()
 
-# Used to assign anonymous nicknames
+registry.gauge('irc_registered_users', 'Registered nicknames, including users of linked servers',
+               collect=lambda: len(nicknames))
+registry.gauge('irc_channel_members', 'Members of each channel', label='channel',
+               collect=lambda: {channel: len(channels.members(channel)) for channel in channels})
+
+# Used to assign anonymous nicknames. Worker processes which share their
+# users count in steps of the number of workers, so their anonymous
+# nicknames never collide.
 number_of_anons = -1
+anon_step = 1
 
 
 def _random_nickname():
     """generates an anonymous nickname in case of nick collision for
     a user who is not yet registered."""
     global number_of_anons
-    number_of_anons += 1
+    number_of_anons += anon_step
     return f"anon{number_of_anons}"
 
 
 def assign_random_nickname(connection):
     """assigns a random nickname to a connection"""
-    connection.nickname = _random_nickname()
-    registered_nicknames.add(connection.nickname)
-
-
-def nickname_to_lowercase(nickname):
-    """converts a nickname to lowercase, respecting
-    the rules of IRC"""
-
-    nickname = nickname.lower()
-    nickname = nickname.translate({
-        '[': '{',
-        ']': '}',
-        '\\': '|',
-    })
-
-    return nickname
+    nickname = _random_nickname()
+    while not nicknames.register(nickname, connection):
+        nickname = _random_nickname()
+    connection.nickname = nickname
 
 
 def validate_nickname(nickname):
@@ -82,6 +80,7 @@ async def set_user_info(connection: Connection, *params, prefix=None):
         assign_random_nickname(connection)
 
     connection.registered = True
+    server.links.introduce(connection)
     add_to_channel(connection, "#global")
 
 
@@ -108,7 +107,7 @@ async def set_nickname(connection, *params, prefix=None):
                      'NICK', params, connection)
         return server.send_to(connection, ERR_ERRONEUSNICKNAME, nickname, 'Erroneus nickname')
 
-    if lowercase_nickname in registered_nicknames:
+    if not nicknames.register(nickname, connection):
         if previous_nickname is None:
             logger.error('ERR_NICKCOLLISION %s params=%s connection=%s',
                          'NICK', params, connection)
@@ -118,13 +117,14 @@ async def set_nickname(connection, *params, prefix=None):
                          'NICK', params, connection)
             return server.send_to(connection, ERR_NICKNAMEINUSE, nickname, 'Nickname is already in use')
 
-    registered_nicknames.add(lowercase_nickname)
     connection.nickname = nickname
 
     if previous_nickname is not None:
-        registered_nicknames.discard(
-            nickname_to_lowercase(previous_nickname))
+        if nickname_to_lowercase(previous_nickname) != lowercase_nickname:
+            nicknames.unregister(previous_nickname, connection)
         server.send('NICK', nickname, prefix=previous_nickname)
+        if connection.registered:
+            server.links.propagate('NICK', nickname, prefix=previous_nickname)
 
     logger.info('successfully set nickname for %s (previously %s)',
                 connection, previous_nickname)
@@ -148,20 +148,20 @@ async def deregister_connection(connection):
     disconnects with a QUIT or the socket is closed."""
 
     logger.info("deregistering %s", connection)
-    registered_nicknames.discard(nickname_to_lowercase(connection.nickname))
-    for members in channel_membership.values():
-        members.discard(connection)
+    nicknames.unregister(connection.nickname, connection)
+    channels.remove(connection)
 
 
 def add_to_channel(connection, channel_name):
     """Adds a connection to a channel's member set"""
 
     logger.info("adding %s to channel %s", connection, channel_name)
-    channel_membership[channel_name].add(connection)
+    channels.join(connection, channel_name)
 
     # Notify other users in the channel that a new user has joined
-    for conn in channel_membership[channel_name]:
-        server.send_to(conn, 'JOIN', channel_name, prefix=connection.nickname)
+    server.send_to_many(channels.members(channel_name),
+                        'JOIN', channel_name, prefix=connection.nickname)
+    server.links.propagate('JOIN', channel_name, prefix=connection.nickname)
 
     # Send the user who joined the list of all users in the channel
     send_names_to_connection(connection, channel_name)
@@ -175,7 +175,7 @@ def send_names_to_connection(connection, channel_name):
                 channel_name, connection)
 
     members = list(
-        conn.nickname for conn in channel_membership[channel_name] if conn.nickname is not None)
+        conn.nickname for conn in channels.members(channel_name) if conn.nickname is not None)
 
     # If many clients are part of a channel, then the list of names could
     # exceed the max message length, therefore we must be cabable of sending
@@ -183,7 +183,8 @@ def send_names_to_connection(connection, channel_name):
     batches = []
     batch = []
     batch_length = 0
-    batch_size = 506 - len(channel_name) - 1
+    # Room left in a 512 byte ":<server> 353 <channel> :<names>\r\n" frame
+    batch_size = 512 - len(server.name) - len(channel_name) - 10
 
     for member in members:
         if batch_length + len(member) + 1 >= batch_size:
@@ -0,0 +1,28 @@
+from irc_server import server
+from irc_core.metrics import registry
+from irc_core.replies import RPL_STATSCOMMANDS, RPL_STATSDEBUG, RPL_ENDOFSTATS
+from irc_core import logger
+
+
+@server.on('STATS')
+async def send_stats(connection, query=None, *params, prefix=None):
+    """Handles a STATS query by replying with the server's metrics.
+
+    `STATS m` lists the number of messages received for each command.
+    Any other query lists every metric, in the same form as the metrics
+    endpoint.
+    """
+    if not connection.registered:
+        return
+
+    logger.info('sending stats %s to %s', query, connection)
+
+    if query == 'm':
+        received = registry.get('irc_received_messages_total')
+        for _, command, count in received.samples():
+            server.send_to(connection, RPL_STATSCOMMANDS, command, str(count))
+    else:
+        for line in registry.samples():
+            server.send_to(connection, RPL_STATSDEBUG, line)
+
+    server.send_to(connection, RPL_ENDOFSTATS, query or '*', 'End of STATS report')
@@ -0,0 +1,151 @@
+import asyncio
+import heapq
+import itertools
+import random
+import time
+
+
+# Kinds of deadline tracked for a connection
+_IDLE = 0  # Ping the connection if it has been idle since it was scheduled
+_PONG = 1  # The connection must have replied to a ping by now
+
+
+class KeepaliveScheduler:
+    """Pings idle connections, and times out connections which do not reply.
+
+    The deadlines of every connection are kept in a single heap, served by
+    one event loop timer which is armed for the earliest deadline. Messages
+    received from a connection only update its last message time, so
+    there is no work per message or per idle tick: a connection is only
+    looked at when its deadline comes up, and then rescheduled relative to
+    the last message it sent.
+
+    Pings are spread out by adding a random jitter of up to `jitter` times
+    the interval, so that connections accepted together are not all pinged
+    at once.
+
+    A ping still queued behind the server's own output can't have been
+    answered, so the connection is given another `pong_timeout` seconds
+    rather than timed out for the server being slow to send it. Once it has
+    waited longer than `interval`, the connection is timed out anyway, as it
+    can't be reading what it is sent.
+    """
+
+    def __init__(self, ping, timeout, interval=5.0, pong_timeout=2.0, jitter=0.1,
+                 ping_pending=None):
+        """
+        Args:
+            ping (Callable[[Connection], None]): Called to ping an idle connection
+            timeout (Callable[[Connection], None]): Called when a connection
+                did not reply within `pong_timeout` seconds of being pinged
+            interval (float): Seconds a connection may be idle before it is pinged
+            pong_timeout (float): Seconds to wait for any reply to a ping
+            jitter (float): Fraction of the interval to randomly delay pings by
+            ping_pending (Callable[[Connection], bool]): Whether the ping sent
+                to a connection is still waiting to be written to it
+        """
+        self._ping = ping
+        self._timeout = timeout
+        self._ping_pending = ping_pending
+        self.interval = interval
+        self.pong_timeout = pong_timeout
+        self.jitter = jitter
+
+        self._heap = []  # (deadline, sequence number, connection, kind)
+        self._current = {}  # connection -> sequence number of its live heap entry
+        self._ping_times = {}  # connection -> time it was last pinged
+        self._sequence = itertools.count()
+        self._timer = None
+        self._timer_deadline = None
+
+    def __len__(self):
+        return len(self._current)
+
+    def track(self, connection):
+        """Starts keeping a connection alive."""
+        self._schedule(connection, self._next_ping(connection), _IDLE)
+
+    def forget(self, connection):
+        """Stops tracking a connection (i.e once it has disconnected)."""
+        self._current.pop(connection, None)
+        self._ping_times.pop(connection, None)
+
+    def stop(self):
+        """Cancels the timer, and stops tracking all connections."""
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        self._timer_deadline = None
+        self._heap.clear()
+        self._current.clear()
+        self._ping_times.clear()
+
+    def _next_ping(self, connection):
+        return (connection.last_message_time + self.interval
+                + random.uniform(0, self.jitter * self.interval))
+
+    def _schedule(self, connection, deadline, kind):
+        sequence = next(self._sequence)
+        self._current[connection] = sequence
+        heapq.heappush(self._heap, (deadline, sequence, connection, kind))
+
+        if self._timer_deadline is None or deadline < self._timer_deadline:
+            self._arm(deadline)
+
+    def _arm(self, deadline):
+        if self._timer is not None:
+            self._timer.cancel()
+        loop = asyncio.get_running_loop()
+        self._timer = loop.call_later(max(deadline - time.time(), 0), self._run)
+        self._timer_deadline = deadline
+
+    def _run(self):
+        """Timer callback which handles every deadline that has passed."""
+        self._timer = None
+        # Rescheduling while deadlines are handled should not re-arm the timer
+        self._timer_deadline = float('-inf')
+
+        now = time.time()
+        heap = self._heap
+        while heap and heap[0][0] <= now:
+            _, sequence, connection, kind = heapq.heappop(heap)
+            if self._current.get(connection) != sequence:
+                continue  # Rescheduled or forgotten since this entry was pushed
+
+            if kind == _IDLE:
+                self._check_idle(connection, now)
+            else:
+                self._check_pong(connection, now)
+
+        # Drop entries which are no longer live from the top of the heap, so
+        # the timer is not woken up for nothing
+        while heap and self._current.get(heap[0][2]) != heap[0][1]:
+            heapq.heappop(heap)
+
+        self._timer_deadline = None
+        if heap:
+            self._arm(heap[0][0])
+
+    def _check_idle(self, connection, now):
+        if now - connection.last_message_time < self.interval:
+            # Active since being scheduled, so check again an interval
+            # after its last message
+            self._schedule(connection, self._next_ping(connection), _IDLE)
+            return
+
+        self._ping_times[connection] = now
+        self._schedule(connection, now + self.pong_timeout, _PONG)
+        self._ping(connection)
+
+    def _check_pong(self, connection, now):
+        pinged_at = self._ping_times[connection]
+        if connection.last_message_time >= pinged_at:
+            del self._ping_times[connection]
+            self._schedule(connection, self._next_ping(connection), _IDLE)
+        elif (self._ping_pending is not None and now - pinged_at < self.interval
+                and self._ping_pending(connection)):
+            # Not sent yet, so the timeout hasn't really started
+            self._schedule(connection, now + self.pong_timeout, _PONG)
+        else:
+            self.forget(connection)
+            self._timeout(connection)
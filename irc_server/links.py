@@ -0,0 +1,269 @@
+import asyncio
+import hmac
+import socket
+
+from irc_core import MessageListener, logger
+from irc_core.parser import frame_message, parse_message
+
+
+class RemoteUser:
+    """A user who is connected to another server, and is reachable through
+    one of this server's links.
+
+    Stands in for a Connection in the nickname and channel registries, so
+    messages sent to a RemoteUser are forwarded over its link.
+    """
+
+    __slots__ = ('nickname', 'username', 'host', 'real_name', 'hopcount', 'link')
+
+    registered = True
+
+    def __init__(self, link, nickname, hopcount=1, username=None, host=None, real_name=None):
+        """
+        Args:
+            link (Connection): The link the user is reachable through
+            nickname (str): The user's nickname
+            hopcount (int): The number of links between this server and the user's
+        """
+        self.link = link
+        self.nickname = nickname
+        self.hopcount = hopcount
+        self.username = username
+        self.host = host
+        self.real_name = real_name
+
+    def __str__(self) -> str:
+        return f'RemoteUser(nickname={self.nickname}, host={self.host}, hopcount={self.hopcount})'
+
+    def send_message(self, msg, immediate=False, priority=False):
+        self.link.send_message(msg, immediate, priority)
+
+
+class Links(MessageListener):
+    """Manages the links between this server and other servers (or other
+    worker processes of the same server).
+
+    Servers are linked in a spanning tree: every server is reachable
+    through exactly one link, so messages are propagated by forwarding
+    them to every link other than the one they arrived on. Messages
+    received over a link are dispatched to the handlers bound on this
+    listener, rather than those of the Server.
+
+    A new link must introduce itself with SERVER (preceded by PASS with the
+    shared `password`, when one is set) before anything else it sends is
+    handled, so nothing can be injected through the link port by a client
+    which has not authenticated.
+    """
+
+    # The only messages handled from a link which has not introduced itself
+    HANDSHAKE_COMMANDS = frozenset({'PASS', 'SERVER'})
+
+    # Seconds to wait before retrying a link which could not be connected
+    RECONNECT_DELAY = 1.0
+
+    def __init__(self, server):
+        super().__init__()
+        self.server = server
+        self._name = None
+        self._peers = {}  # link connection -> name of the server at the other end
+        self._servers = {}  # server name -> (link, hopcount, uplink server name, info)
+        self._listening = []  # sockets to accept links on
+        self._uplinks = []  # addresses of servers to link to
+        # Shared with the other servers, and required from them with PASS.
+        # Only None for links which can't be reached from the network (the
+        # unix socket between worker processes).
+        self.password = None
+        self._passwords = {}  # link -> password it sent, until it introduces itself
+
+    @property
+    def name(self):
+        """The name this server introduces itself with (defaults to the
+        name of the server)."""
+        return self._name or self.server.name
+
+    @name.setter
+    def name(self, name):
+        self._name = name
+
+    def __contains__(self, connection):
+        return connection in self._peers
+
+    def __iter__(self):
+        return iter(self._peers)
+
+    def __len__(self):
+        return len(self._peers)
+
+    def peer_name(self, link):
+        return self._peers.get(link)
+
+    def add(self, link, name=None):
+        """Starts treating a connection as a link to another server."""
+        logger.info('adding link %s', link)
+        self._peers[link] = name
+
+    def set_peer_name(self, link, name):
+        self._peers[link] = name
+        self._passwords.pop(link, None)
+
+    def set_password(self, link, password):
+        """Records the password a link sent with PASS, before introducing
+        itself."""
+        if self._peers.get(link) is None:
+            self._passwords[link] = password
+
+    def authenticated(self, link):
+        """Checks the password a link sent against `password`."""
+        if self.password is None:
+            return True
+        received = self._passwords.get(link)
+        return received is not None and hmac.compare_digest(received.encode(),
+                                                            self.password.encode())
+
+    async def handle_message(self, connection, message):
+        """Dispatches a message from a link, dropping everything but the
+        handshake until the link has introduced itself."""
+        if self._peers.get(connection) is None:
+            command = parse_message(message).command
+            if command not in self.HANDSHAKE_COMMANDS:
+                logger.warning('dropping %s from link %s, which has not introduced itself',
+                               command, connection)
+                return
+        await super().handle_message(connection, message)
+
+    def remove(self, link):
+        """Stops treating a connection as a link.
+
+        Returns:
+            bool: False if the connection was not a link
+        """
+        if link not in self._peers:
+            return False
+
+        logger.info('removing link %s (%s)', link, self._peers[link])
+        del self._peers[link]
+        self._passwords.pop(link, None)
+        return True
+
+    @property
+    def servers(self):
+        """Maps the names of every server in the network to the link they
+        are reachable through, their hopcount, the name of the server they
+        are linked to, and their description, in the order they were
+        introduced."""
+        return self._servers
+
+    def add_server(self, name, link, hopcount, uplink, info=''):
+        self._servers[name] = (link, hopcount, uplink, info)
+
+    def remove_server(self, name):
+        """Removes a server, and the servers which were only reachable
+        through it.
+
+        Returns:
+            list: The names of the removed servers
+        """
+        if name not in self._servers:
+            return []
+
+        removed = [name]
+        del self._servers[name]
+        for behind in [other for other, (_, _, uplink, _) in self._servers.items() if uplink == name]:
+            removed += self.remove_server(behind)
+        return removed
+
+    def propagate(self, msg, *params, prefix=None, via=None):
+        """Forwards a message to every link, except the one it arrived on.
+
+        Links whose server has not introduced itself yet are skipped, as they
+        are sent a burst of the current state once it has.
+
+        Args:
+            via (Connection): The link the message was received from, if any
+        """
+        if not self._peers:
+            return
+
+        message = frame_message(msg, *params, prefix=prefix)
+        for link, name in self._peers.items():
+            if link is not via and name is not None:
+                link.send_message(message)
+
+    def introduce(self, user, via=None, to=None):
+        """Propagates a registered user to other servers, or only over the
+        link `to`."""
+        params = (user.nickname, str(user.hopcount + 1),
+                  user.username or '*', user.host or '*', user.real_name or '*')
+        if to is None:
+            self.propagate('NICK', *params, via=via)
+        else:
+            to.send_message(frame_message('NICK', *params))
+
+    def handshake(self, link):
+        """Introduces this server over a new link."""
+        if self.password is not None:
+            self.server.send_to(link, 'PASS', self.password)
+        self.server.send_to(link, 'SERVER', self.name, '1', 'IRC server', prefix=self.name)
+
+    def listen(self, sock):
+        """Accepts links from other servers on a listening socket, once the
+        server has started."""
+        self._listening.append(sock)
+
+    def connect(self, address):
+        """Links to another server once this server has started.
+
+        Args:
+            address (str | tuple): The path of a unix socket, or the
+                (host, port) of a server's link port
+        """
+        self._uplinks.append(address)
+
+    def start(self):
+        """Called by the server once its event loop is running."""
+        for sock in self._listening:
+            sock.setblocking(False)
+            self.server._spawn(self._accept_links(sock))
+
+        for address in self._uplinks:
+            self.server._spawn(self._connect(address))
+
+    def close(self):
+        """Stops accepting links."""
+        for sock in self._listening:
+            sock.close()
+        self._listening.clear()
+
+    async def _accept_links(self, sock):
+        loop = asyncio.get_running_loop()
+        while True:
+            conn, addr = await loop.sock_accept(sock)
+            self._add_link(conn, addr or ('unix', 0))
+
+    async def _connect(self, address):
+        """Connects a link, retrying until the other server is up."""
+        loop = asyncio.get_running_loop()
+        if isinstance(address, str):
+            family, addr = socket.AF_UNIX, ('unix', 0)
+        else:
+            family, addr = socket.AF_INET, address
+
+        while True:
+            conn = socket.socket(family, socket.SOCK_STREAM)
+            conn.setblocking(False)
+            try:
+                await loop.sock_connect(conn, address)
+            except OSError as e:
+                conn.close()
+                logger.warning('could not link to %s (%s), retrying', address, e)
+                await asyncio.sleep(self.RECONNECT_DELAY)
+                continue
+
+            self._add_link(conn, addr)
+            return
+
+    def _add_link(self, conn, addr):
+        link = self.server._add_connection(conn, addr)
+        self.add(link)
+        self.handshake(link)
+        return link
@@ -0,0 +1,56 @@
+_IRC_CASEMAP = str.maketrans({
+    '[': '{',
+    ']': '}',
+    '\\': '|',
+})
+
+
+def nickname_to_lowercase(nickname):
+    """converts a nickname to lowercase, respecting
+    the rules of IRC"""
+
+    return nickname.lower().translate(_IRC_CASEMAP)
+
+
+class NicknameRegistry:
+    """Maps registered nicknames to the connections which own them.
+
+    Nicknames are compared using IRC case mapping, so `Wiz`, `wiz` and
+    `WIZ` all refer to the same connection.
+    """
+
+    def __init__(self):
+        self._connections = {}  # lowercase nickname -> connection
+
+    def register(self, nickname, connection):
+        """Registers a nickname to a connection.
+
+        Returns:
+            bool: False if the nickname is owned by another connection
+        """
+        key = nickname_to_lowercase(nickname)
+        owner = self._connections.setdefault(key, connection)
+        return owner is connection
+
+    def unregister(self, nickname, connection):
+        """Releases a nickname, if it is owned by the connection."""
+        if nickname is None:
+            return
+
+        key = nickname_to_lowercase(nickname)
+        if self._connections.get(key) is connection:
+            del self._connections[key]
+
+    def get(self, nickname):
+        """Returns the connection which owns a nickname, or None."""
+        return self._connections.get(nickname_to_lowercase(nickname))
+
+    def connections(self):
+        """Returns a view of the connections which own a nickname."""
+        return self._connections.values()
+
+    def __contains__(self, nickname):
+        return nickname_to_lowercase(nickname) in self._connections
+
+    def __len__(self):
+        return len(self._connections)
@@ -0,0 +1,294 @@
+import cProfile
+import collections
+import os
+import pstats
+import signal
+import sys
+import threading
+import time
+
+from irc_core import logger
+from irc_core.connections import Connection
+from irc_core.message_listener import MessageListener
+from irc_core.parser import parse_message
+
+
+# The phases every message goes through, and the function each one runs in
+PHASES = (
+    ('read', Connection.read_messages.__code__),
+    ('parse', parse_message.__code__),
+    ('dispatch', MessageListener.handle_message.__code__),
+    ('flush', Connection.flush_messages.__code__),
+)
+
+MODES = ('cprofile', 'sample')
+
+
+def _key(code):
+    """The key of a function in pstats.Stats.stats"""
+    return code.co_filename, code.co_firstlineno, code.co_name
+
+
+def _label(code):
+    return f'{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})'
+
+
+def _is_idle(code):
+    """Checks whether the event loop is waiting in its selector."""
+    return code.co_name == 'select' and code.co_filename.endswith('selectors.py')
+
+
+class Profiler:
+    """Captures a profile of the running event loop on demand, so a slow
+    server can be looked at without restarting it.
+
+    A capture either traces every call with cProfile (exact, but slows the
+    server down while it runs), or samples the stack of the event loop's
+    thread every `interval` seconds from a background thread (cheap enough
+    to leave on under load). It stops after `seconds`, or when stopped
+    early, and is written to `directory` as:
+
+        irc-<pid>-<time>-cprofile.pstats  (load with pstats or snakeviz), or
+        irc-<pid>-<time>-sample.collapsed  (for flamegraph.pl or speedscope)
+
+    along with a .txt summary of the time spent in each phase of handling
+    messages (read, parse, dispatch and flush) and in each handler.
+    Handlers run in an executor are only seen waiting on it.
+
+    Once installed, SIGUSR1 starts (or stops) a cProfile capture, and
+    SIGUSR2 a sampling one.
+    """
+
+    SIGNALS = (('SIGUSR1', 'cprofile'), ('SIGUSR2', 'sample'))
+
+    def __init__(self, listeners, directory='.', seconds=30.0, interval=0.005):
+        """
+        Args:
+            listeners (Iterable[MessageListener]): Whose handlers are reported
+            directory (str): Where captures are written
+            seconds (float): How long a capture runs, unless stopped early
+            interval (float): Seconds between samples of the stack
+        """
+        self.listeners = tuple(listeners)
+        self.directory = directory
+        self.seconds = seconds
+        self.interval = interval
+
+        self.mode = None  # The mode of the capture running, if any
+        self._started = None
+        self._profile = None
+        self._samples = None
+        self._sampler = None
+        self._stop_sampling = None
+        self._switch_interval = None
+        self._timer = None
+        self._loop = None
+        self._signals = []
+
+    @property
+    def running(self):
+        return self.mode is not None
+
+    def install(self, loop):
+        """Starts handling the profiling signals on an event loop."""
+        self._loop = loop
+        try:
+            os.makedirs(self.directory, exist_ok=True)
+        except OSError as e:
+            logger.error('profiles can not be written to %s: %s', self.directory, e)
+        for name, mode in self.SIGNALS:
+            signum = getattr(signal, name, None)
+            if signum is None:
+                continue  # Not available on this platform
+            loop.add_signal_handler(signum, self.toggle, mode)
+            self._signals.append(signum)
+
+    def uninstall(self):
+        """Stops handling the profiling signals, and any capture."""
+        for signum in self._signals:
+            self._loop.remove_signal_handler(signum)
+        self._signals.clear()
+        if self.running:
+            self.stop()
+
+    def toggle(self, mode):
+        """Starts a capture, or stops the one which is running."""
+        if self.running:
+            self.stop()
+        else:
+            self.start(mode)
+
+    def start(self, mode='cprofile', seconds=None):
+        """Starts capturing a profile of the current thread.
+
+        Args:
+            mode (str): One of MODES
+            seconds (float): Stop after this long (defaults to `seconds`).
+                Only used when called from a running event loop.
+        """
+        if mode not in MODES:
+            raise ValueError(f'unknown profiling mode {mode}')
+        if self.running:
+            raise RuntimeError(f'already capturing a {self.mode} profile')
+
+        if mode == 'cprofile':
+            self._profile = cProfile.Profile()
+            self._profile.enable()
+        else:
+            # The sampler can only look at the stack once the event loop's
+            # thread lets go of the GIL, which it otherwise mostly does in
+            # system calls, so the samples would all land on reads and writes
+            self._switch_interval = sys.getswitchinterval()
+            sys.setswitchinterval(min(self._switch_interval, self.interval / 10))
+            self._samples = collections.Counter()
+            self._stop_sampling = threading.Event()
+            self._sampler = threading.Thread(
+                target=self._sample, name='irc-profiler', daemon=True,
+                args=(threading.get_ident(), self._samples, self._stop_sampling))
+            self._sampler.start()
+
+        self.mode = mode
+        self._started = time.perf_counter()
+
+        loop = self._loop
+        if loop is not None and loop.is_running():
+            self._timer = loop.call_later(
+                seconds if seconds is not None else self.seconds, self.stop)
+        logger.info('started %s profile', mode)
+
+    def stop(self):
+        """Stops the capture, and writes it.
+
+        A capture which can't be written is logged and discarded, so the
+        profiler can always be started again.
+
+        Returns:
+            List[str]: The paths of the files written
+        """
+        if not self.running:
+            return []
+
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        elapsed = time.perf_counter() - self._started
+
+        paths = []
+        try:
+            if self.mode == 'cprofile':
+                self._profile.disable()
+                paths = self._write_cprofile(self._profile, elapsed)
+            else:
+                self._stop_sampling.set()
+                self._sampler.join()
+                sys.setswitchinterval(self._switch_interval)
+                paths = self._write_samples(self._samples, elapsed)
+        except OSError as e:
+            logger.error('failed to write %s profile to %s: %s', self.mode, self.directory, e)
+        else:
+            logger.info('wrote %s profile of %.1f seconds to %s', self.mode, elapsed, paths[0])
+        finally:
+            self.mode = None
+            self._profile = None
+            self._samples = self._sampler = self._stop_sampling = None
+        return paths
+
+    def _sample(self, thread_id, samples, stop):
+        """Background thread which counts the stacks of a thread."""
+        while not stop.wait(self.interval):
+            frame = sys._current_frames().get(thread_id)
+            if frame is None:
+                return  # The thread has exited
+            stack = []
+            while frame is not None:
+                stack.append(frame.f_code)
+                frame = frame.f_back
+            samples[tuple(stack)] += 1
+
+    def _handlers(self):
+        """Maps the code of every bound handler to the commands it handles."""
+        handlers = collections.defaultdict(list)
+        for listener in self.listeners:
+            for bound in (listener.general_message_handlers, listener.specific_message_handlers):
+                for key, funcs in bound.items():
+                    command = key if isinstance(key, str) else key[0]
+                    for func in funcs:
+                        code = getattr(func, '__code__', None)
+                        if code is not None and command not in handlers[code]:
+                            handlers[code].append(command)
+        return handlers
+
+    def _path(self, suffix):
+        stamp = time.strftime('%Y%m%d-%H%M%S')
+        return os.path.join(self.directory, f'irc-{os.getpid()}-{stamp}-{self.mode}{suffix}')
+
+    def _write_cprofile(self, profile, elapsed):
+        stats = pstats.Stats(profile)
+        path = self._path('.pstats')
+        stats.dump_stats(path)
+
+        entries = stats.stats  # key -> (primitive calls, calls, own time, cumulative time, callers)
+        phases = {}
+        for phase, code in PHASES:
+            entry = entries.get(_key(code))
+            phases[phase] = entry[3] if entry is not None else 0.0
+        # Dispatching includes parsing the message
+        dispatch = entries.get(_key(MessageListener.handle_message.__code__))
+        if dispatch is not None:
+            phases['dispatch'] -= dispatch[4].get(_key(parse_message.__code__), (0, 0, 0, 0))[3]
+
+        handlers = []
+        for code, commands in self._handlers().items():
+            entry = entries.get(_key(code))
+            if entry is not None:
+                handlers.append((' '.join(commands), _label(code), entry[1], entry[3]))
+        handlers.sort(key=lambda handler: handler[3], reverse=True)
+
+        summary = self._path('.txt')
+        with open(summary, 'w') as f:
+            f.write(f'cprofile capture of {elapsed:.1f} seconds (pid {os.getpid()})\n\n')
+            f.write(f'{"phase":<12} {"seconds":>10} {"share":>8}\n')
+            for phase, seconds in phases.items():
+                f.write(f'{phase:<12} {seconds:10.3f} {seconds / elapsed:8.1%}\n')
+            f.write(f'\n{"command":<16} {"handler":<48} {"calls":>8} {"seconds":>10}\n')
+            for command, label, calls, seconds in handlers:
+                f.write(f'{command:<16} {label:<48} {calls:>8} {seconds:10.3f}\n')
+        return [path, summary]
+
+    def _write_samples(self, samples, elapsed):
+        phase_of = {code: phase for phase, code in PHASES}
+        handlers = self._handlers()
+
+        phases = collections.Counter()
+        per_handler = collections.Counter()
+        path = self._path('.collapsed')
+        with open(path, 'w') as f:
+            for stack, count in samples.items():
+                # The innermost phase a sample is in, so that parsing (and
+                # flushes made while handling a message) aren't counted as
+                # dispatching too
+                phase = 'idle' if stack and _is_idle(stack[0]) else 'other'
+                for code in stack:
+                    if code in phase_of:
+                        phase = phase_of[code]
+                        break
+                phases[phase] += count
+                for code in stack:
+                    if code in handlers:
+                        per_handler[code] += count
+                        break
+                f.write(';'.join(_label(code) for code in reversed(stack)) + f' {count}\n')
+
+        total = sum(samples.values()) or 1
+        summary = self._path('.txt')
+        with open(summary, 'w') as f:
+            f.write(f'sample capture of {elapsed:.1f} seconds (pid {os.getpid()}), '
+                    f'{sum(samples.values())} samples every {self.interval * 1000:g} ms\n\n')
+            f.write(f'{"phase":<12} {"samples":>10} {"share":>8}\n')
+            for phase in (*(phase for phase, _ in PHASES), 'other', 'idle'):
+                f.write(f'{phase:<12} {phases[phase]:>10} {phases[phase] / total:8.1%}\n')
+            f.write(f'\n{"command":<16} {"handler":<48} {"samples":>8} {"share":>8}\n')
+            for code, count in per_handler.most_common():
+                f.write(f'{" ".join(handlers[code]):<16} {_label(code):<48} {count:>8} '
+                        f'{count / total:8.1%}\n')
+        return [path, summary]
@@ -1,11 +1,22 @@
 import asyncio
 import socket
-from asyncio.exceptions import CancelledError
 
 from irc_core import MessageListener, Connection, logger
-from irc_core.parser import serialize_message
+from irc_core.metrics import registry
+from irc_core.parser import frame_message, frame_cached
+from irc_core.replies import RPL_STATSCOMMANDS, RPL_STATSDEBUG
+from irc_core.resolver import HostnameResolver
+from .flood import FloodControl
+from .keepalive import KeepaliveScheduler
+from .links import Links
+from .profiling import Profiler
 
 
+_messages_sent = registry.counter(
+    'irc_sent_messages_total', 'Messages queued for clients, by command', label='command')
+_loop_lag = registry.histogram(
+    'irc_event_loop_lag_seconds', 'How late the event loop ran a timer')
+
 class Server(MessageListener):
     """A MessageListener class with additional functionality
     for accepting socket connections, and reading and writing
@@ -13,22 +24,81 @@ class Server(MessageListener):
 
     PING_INTERVAL = 5  # seconds
     PONG_TIMEOUT = 2  # seconds
-
-    def __init__(self, host='', port=6667):
+    # The maximum number of messages handled per connection in each cycle,
+    # so that a single chatty connection can not starve the others
+    MESSAGES_PER_CYCLE = 32
+    LAG_INTERVAL = 1  # seconds between measurements of event loop lag
+    # Queued ahead of a connection's chat traffic (see Connection), and
+    # written as soon as they are sent when nothing else is queued for it,
+    # so that a keepalive isn't answered late because the server is busy
+    PRIORITY_COMMANDS = frozenset({'PING', 'PONG'})
+    # Numeric replies which are (almost) never sent twice with the same
+    # parameters (i.e metric values), and so would only push the constant
+    # replies out of the cache of frames
+    UNCACHED_REPLIES = frozenset({RPL_STATSCOMMANDS, RPL_STATSDEBUG})
+
+    def __init__(self, host='', port=6667, resolver=None, reuse_port=False, flood_control=None,
+                 metrics_exporter=None, connection_tasks=False):
         """
 
         Args:
             host (str): The host IP to bind the server to
             port (int): The port to listen for connections on
+            resolver (HostnameResolver): Used to look up the hostnames of
+                new connections
+            reuse_port (bool): Bind with SO_REUSEPORT, so that several
+                processes can accept connections on the same port
+            flood_control (FloodControl): Limits how fast each client's
+                commands are handled. Set the flood_control attribute to
+                None to disable it.
+            metrics_exporter (MetricsExporter): Optionally serves the
+                metrics of the server over HTTP while it runs
+            connection_tasks (bool): Handle each connection's messages in a
+                task of its own, which flushes the connection as soon as
+                they are handled, instead of waiting for every connection
+                handled in the same cycle
         """
         super().__init__()
         self.host = host
         self.port = port
+        self.reuse_port = reuse_port
+        self._name = None
+        self._name_of = None
+        self.resolver = resolver if resolver is not None else HostnameResolver()
+        self.flood_control = flood_control if flood_control is not None else FloodControl()
+        self.metrics_exporter = metrics_exporter
+        self.connection_tasks = connection_tasks
         self._socket = None
         self._connections = []
         self._connect_listeners = []
         self._disconnect_listeners = []
 
+        self._loop = None
+        self._wakeup = None
+        self._watched = set()  # Connections registered with the event loop
+        self._paused = set()  # Connections not being read from due to backpressure
+        self._writers = set()  # Connections waiting for their socket to be writable
+        # Dicts are used as insertion-ordered sets of connections
+        self._readable = {}  # Connections with messages ready to handle
+        self._writable = {}  # Connections with output ready to flush
+        self._closing = {}  # Connections to remove, mapped to a QUIT message
+        self._held = {}  # Connections held back by flood control -> release timer
+        self._connection_tasks = {}  # Connections -> the task handling their messages
+        self._background_tasks = set()
+        # Bound once, so every connection shares the same listener object
+        self._output_listener = self._on_output
+
+        self.keepalive = KeepaliveScheduler(
+            self.ping, self._on_ping_timeout,
+            interval=self.PING_INTERVAL, pong_timeout=self.PONG_TIMEOUT,
+            ping_pending=lambda connection: connection.priority_pending)
+        # Any message counts as a reply to a PING, so PONG needs no handling
+        self.on('PONG')(self._on_pong)
+
+        self.links = Links(self)
+        # Captures profiles of the running server on SIGUSR1 / SIGUSR2
+        self.profiler = Profiler((self, self.links))
+
     def on_connect(self, func):
         self._connect_listeners.append(func)
         return func
@@ -38,66 +108,285 @@ class Server(MessageListener):
         return func
 
     async def _accept_connections(self):
-        """Co-routine to listen for new connections to the server."""
+        """Co-routine to listen for new connections to the server.
+
+        Waits on the event loop for the listening socket to become readable,
+        rather than polling accept().
+        """
+        loop = asyncio.get_running_loop()
         while True:
-            try:
-                conn, addr = self._socket.accept()
-                self._accept_connection(conn, addr)
-                logger.info(f'accepted connection from {addr}')
-            except BlockingIOError:
-                # Wait 10 miliseconds before checking for connections
-                await asyncio.sleep(0.01)
+            conn, addr = await loop.sock_accept(self._socket)
+            self._accept_connection(conn, addr)
+            logger.info('accepted connection from %s', addr)
 
     def _accept_connection(self, conn, addr):
         """Accept and process a raw socket connection."""
-        connection = Connection(conn, addr)
+        connection = self._add_connection(conn, addr)
         self._connections.append(connection)
         for connect_listener in self._connect_listeners:
             connect_listener(connection)
 
+    def _add_connection(self, conn, addr):
+        """Wraps a raw socket in a Connection, and starts reading from it
+        and keeping it alive."""
+        conn.setblocking(False)
+        connection = Connection(conn, addr)
+        self._watch(connection)
+        self.keepalive.track(connection)
+        if conn.family != socket.AF_UNIX:
+            # Frames are already batched per flush, so Nagle would only delay them
+            conn.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            self._spawn(self._resolve_host(connection))
+        return connection
+
+    def _spawn(self, coro):
+        """Runs a co-routine in the background, keeping a reference to
+        the task until it is done."""
+        task = self._loop.create_task(coro)
+        self._background_tasks.add(task)
+        task.add_done_callback(self._background_tasks.discard)
+        return task
+
+    async def _resolve_host(self, connection):
+        """Replaces the IP placeholder of a connection's host with its
+        hostname, once it has been resolved."""
+        ip = connection.addr[0]
+        hostname = await self.resolver.resolve(ip)
+        if hostname and connection.host == ip and self._is_open(connection):
+            connection.host = hostname
+
+    def _watch(self, connection):
+        """Registers a connection with the event loop, so that it is only
+        read from once the socket is readable, and flushed once output
+        has been queued for it."""
+        connection.output_listener = self._output_listener
+        self._loop.add_reader(connection, self._on_readable, connection)
+        self._watched.add(connection)
+
+    def _unwatch(self, connection):
+        """Removes a connection from the event loop."""
+        if connection in self._watched:
+            self._watched.discard(connection)
+            if connection in self._paused:
+                self._paused.discard(connection)
+            else:
+                self._loop.remove_reader(connection)
+            if connection in self._writers:
+                self._writers.discard(connection)
+                self._loop.remove_writer(connection)
+            connection.output_listener = None
+
+    def _close(self, connection, msg=None):
+        """Stops all I/O on a connection, and schedules it for removal once
+        its remaining messages have been handled."""
+        self._unwatch(connection)
+        self._closing.setdefault(connection, msg)
+        self._wakeup.set()
+
+    def _on_readable(self, connection):
+        """Event loop callback for when a connection's socket is readable."""
+        try:
+            connection.read_messages()
+        except BlockingIOError:
+            return
+        except (EOFError, OSError):
+            return self._close(connection)
+
+        if connection.pending_messages:
+            self._readable[connection] = None
+            self._wakeup.set()
+
+    def _on_output(self, connection):
+        """Called when output is queued for a connection."""
+        if connection.sendq_exceeded:
+            self._close(connection, 'SendQ exceeded')
+        elif connection not in self._writers:
+            self._writable[connection] = None
+            self._wakeup.set()
+
+    def _on_writable(self, connection):
+        """Event loop callback for when a connection's socket, which
+        previously could not accept all of its output, is writable."""
+        self._flush(connection)
+
+    def _flush(self, connection):
+        """Writes as much pending output to a connection as its socket
+        accepts without blocking.
+
+        If output is left over, the connection is flushed again once its
+        socket is writable. While more than SENDQ_HIGH_WATER bytes are
+        queued, no more messages are read from the connection, and if
+        SENDQ_LIMIT was exceeded the connection is closed.
+        """
+        if connection.sendq_exceeded:
+            return self._close(connection, 'SendQ exceeded')
+
+        try:
+            done = connection.flush_messages()
+        except OSError:
+            return self._close(connection)
+
+        if connection not in self._watched:
+            return
+
+        if done:
+            if connection in self._writers:
+                self._writers.discard(connection)
+                self._loop.remove_writer(connection)
+        elif connection not in self._writers:
+            self._writers.add(connection)
+            self._loop.add_writer(connection, self._on_writable, connection)
+
+        # Stop reading from a client which is not reading its replies
+        if connection.outgoing_bytes > connection.SENDQ_HIGH_WATER:
+            if connection not in self._paused:
+                self._paused.add(connection)
+                self._loop.remove_reader(connection)
+        elif connection in self._paused:
+            self._paused.discard(connection)
+            self._loop.add_reader(connection, self._on_readable, connection)
+
+    async def _process_connection(self, connection):
+        """Handles, in order, the messages received from a connection, up to
+        MESSAGES_PER_CYCLE of them.
+
+        Messages from links to other servers are handled by the Links
+        listener rather than the Server. Messages from clients are subject to
+        flood control: once a client goes over its limit, the rest of its
+        messages are held until it is released.
+        """
+        if connection in self.links:
+            for _ in range(self.MESSAGES_PER_CYCLE):
+                if not connection.pending_messages or not self._is_open(connection):
+                    break
+                await self.links.handle_message(connection, connection.next_message())
+            return
+
+        flood_control = self.flood_control
+        if connection in self._held:
+            if flood_control is not None and flood_control.flooding(connection):
+                self._flooded(connection)
+            return
+
+        for _ in range(self.MESSAGES_PER_CYCLE):
+            if not connection.pending_messages or not self._is_open(connection):
+                break
+            if flood_control is not None:
+                delay = flood_control.delay(connection, connection.peek_message())
+                if delay:
+                    self._hold(connection, delay)
+                    break
+            await self.handle_message(connection, connection.next_message())
+
+    def _hold(self, connection, delay):
+        """Stops handling a connection's messages for `delay` seconds."""
+        if self.flood_control.flooding(connection):
+            return self._flooded(connection)
+        self._held[connection] = self._loop.call_later(delay, self._release, connection)
+
+    def _release(self, connection):
+        del self._held[connection]
+        if connection.pending_messages and self._is_open(connection):
+            self._readable[connection] = None
+            self._wakeup.set()
+
+    def _flooded(self, connection):
+        logger.warning('excess flood from %s', connection)
+        connection.clear_messages()
+        self._close(connection, 'Excess Flood')
+
+    def _is_open(self, connection):
+        """Checks that a connection has not been removed from the server."""
+        return connection in self._watched or connection in self._closing
+
     async def _process_messages(self):
-        """Co-routine to read incoming messages, handle them, and then
-        write back any responses.
+        """Co-routine to handle incoming messages, and then write back
+        any responses.
+
+        Sleeps until the event loop reports that a connection has
+        received messages or has output to flush.
 
         Messages from distinct connections are processed 'in parallel' as
-        asyncio co-routines.
+        asyncio co-routines. Unless connection_tasks is set, every
+        connection handled in a cycle is flushed once they are all done.
 
         If multiple messages are received from a single connection, they
-        will be processed in series.
+        will be processed in series, up to MESSAGES_PER_CYCLE per cycle.
         """
         while True:
-            processing = []
-
-            # Read connections
-            for connection in self._connections:
-                try:
-                    ready = connection.has_messages()
-                except EOFError:
-                    await self.remove_connection(connection)
-                else:
-                    if ready:
-                        msg = connection.next_message()
-                        processing.append(
-                            self.handle_message(connection, msg))
-
-                if connection.time_since_last_message > self.PING_INTERVAL and not connection.ping_timeout:
-                    self.ping(connection)
-
-            # Wait for all messages to finish processing
-            # TODO Wrap in try-except so that errors handling messages don't crash the server
-            await asyncio.gather(*processing)
+            await self._wakeup.wait()
+            self._wakeup.clear()
+
+            ready, self._readable = self._readable, {}
+            if self.connection_tasks:
+                for connection in ready:
+                    if connection.pending_messages and connection not in self._connection_tasks:
+                        self._connection_tasks[connection] = self._spawn(
+                            self._run_connection(connection))
+                ready = ()
+            else:
+                processing = [
+                    self._process_connection(connection)
+                    for connection in ready
+                    if connection.pending_messages
+                ]
+
+                # Wait for all messages to finish processing
+                results = await asyncio.gather(*processing, return_exceptions=True)
+                for result in results:
+                    if isinstance(result, Exception):
+                        logger.error('error handling messages', exc_info=result)
+
+            # Connections with messages left over are handled on the next cycle
+            for connection in ready:
+                if (connection.pending_messages and self._is_open(connection)
+                        and connection not in self._held):
+                    self._readable[connection] = None
+                    self._wakeup.set()
 
             # Write to connections
-            for connection in self._connections:
-                connection.flush_messages()
-
-            # Wait 10 milliseconds before checking messages
-            await asyncio.sleep(0.01)
+            writable, self._writable = self._writable, {}
+            for connection in writable:
+                self._flush(connection)
+
+            # Remove connections which were closed, once their messages are handled
+            for connection, msg in list(self._closing.items()):
+                if not connection.pending_messages and connection not in self._connection_tasks:
+                    del self._closing[connection]
+                    await self.remove_connection(connection, msg=msg)
+
+    async def _run_connection(self, connection):
+        """Handles a connection's messages until none are left, flushing its
+        replies after every MESSAGES_PER_CYCLE of them, and yielding to
+        other connections in between.
+
+        An error in a handler is logged, and the next message is handled.
+        """
+        try:
+            while True:
+                try:
+                    await self._process_connection(connection)
+                except Exception:
+                    logger.exception('error handling messages from %s', connection)
+
+                if connection in self._writable:
+                    del self._writable[connection]
+                    self._flush(connection)
+
+                if not (connection.pending_messages and self._is_open(connection)
+                        and connection not in self._held):
+                    break
+                await asyncio.sleep(0)
+        finally:
+            del self._connection_tasks[connection]
+            if connection in self._closing:
+                self._wakeup.set()
 
     def __enter__(self):
         """Context-manager which creates the server socket."""
         logger.info("Creating server at %s:%s ..." % (self.host, self.port))
-        self._socket = socket.create_server((self.host, self.port))
+        self._socket = socket.create_server((self.host, self.port),
+                                            reuse_port=self.reuse_port)
         self._socket.setblocking(False)
 
         return self
@@ -109,10 +398,23 @@ class Server(MessageListener):
 
         self._accept_connections_task.cancel()
         self._process_message_task.cancel()
+        self.keepalive.stop()
+        self.profiler.uninstall()
+        for timer in self._held.values():
+            timer.cancel()
+        self._held.clear()
+        for task in self._background_tasks:
+            task.cancel()
+        if self.metrics_exporter is not None:
+            self.metrics_exporter.close()
+        if self.executor is not None:
+            self.executor.shutdown(wait=False)
 
         self._socket.shutdown(socket.SHUT_RD)
+        self.links.close()
 
-        for connection in self._connections:
+        for connection in [*self._connections, *self.links]:
+            self._unwatch(connection)
             connection.shutdown()
         self._connections.clear()
 
@@ -126,17 +428,54 @@ class Server(MessageListener):
         if not self._socket:
             raise Exception('socket must be opened first (use with statement)')
 
+        self._loop = asyncio.get_running_loop()
+        self._wakeup = asyncio.Event()
+
         self._accept_connections_task = asyncio.create_task(
             self._accept_connections())
         self._process_message_task = asyncio.create_task(
             self._process_messages())
+        self.links.start()
+        self.profiler.install(self._loop)
+        self._register_metrics()
+        self._spawn(self._measure_loop_lag())
+        if self.metrics_exporter is not None:
+            await self.metrics_exporter.start()
 
         logger.info('...server is ready!')
 
         await asyncio.gather(self._accept_connections_task, self._process_message_task)
 
+    def _register_metrics(self):
+        """Adds gauges which read the state of this server when scraped."""
+        registry.gauge('irc_connections', 'Connected clients',
+                       collect=lambda: len(self._connections))
+        registry.gauge('irc_links', 'Links to other servers',
+                       collect=lambda: len(self.links))
+        registry.gauge('irc_held_connections', 'Clients held back by flood control',
+                       collect=lambda: len(self._held))
+        registry.gauge('irc_sendq_bytes', 'Bytes queued to be sent to clients',
+                       collect=lambda: sum(conn.outgoing_bytes for conn in self._connections))
+        registry.gauge('irc_sendq_max_bytes', 'The most bytes queued for any one client',
+                       collect=lambda: max((conn.outgoing_bytes for conn in self._connections), default=0))
+
+    async def _measure_loop_lag(self):
+        """Measures how late the event loop wakes up from a sleep, which is
+        how long callbacks and handlers have been delayed by other work."""
+        loop = asyncio.get_running_loop()
+        while True:
+            start = loop.time()
+            await asyncio.sleep(self.LAG_INTERVAL)
+            _loop_lag.observe(max(loop.time() - start - self.LAG_INTERVAL, 0))
+
     async def remove_connection(self, connection, msg=None):
         """Handles shutdown and cleanup of dead connections."""
+        if connection in self.links:
+            await self._remove_link(connection)
+            return
+        if connection not in self._connections:
+            return  # Already removed (i.e QUIT followed by the socket closing)
+
         logger.info('removing connection %s', connection)
 
         for disconnect_listener in self._disconnect_listeners:
@@ -147,36 +486,72 @@ class Server(MessageListener):
 
         self.send('QUIT', msg, prefix=connection.nickname,
                   exclude=connection)
+        if connection.registered:
+            self.links.propagate('QUIT', msg, prefix=connection.nickname)
 
         self._connections.remove(connection)
+        self._discard(connection)
+
+    async def _remove_link(self, link):
+        """Handles shutdown of a link to another server.
+
+        Disconnect listeners are run while the connection is still a link,
+        so they can remove the users who were reachable through it.
+        """
+        for disconnect_listener in self._disconnect_listeners:
+            await disconnect_listener(link)
+        self.links.remove(link)
+        self._discard(link)
+
+    def _discard(self, connection):
+        self.keepalive.forget(connection)
+        if self.flood_control is not None:
+            self.flood_control.forget(connection)
+        timer = self._held.pop(connection, None)
+        if timer is not None:
+            timer.cancel()
+        self._unwatch(connection)
+        self._readable.pop(connection, None)
+        self._writable.pop(connection, None)
         connection.shutdown()
 
     def ping(self, connection):
         logger.info('pinging %s', connection)
         self.send_to(connection, 'PING')
-        connection.flush_messages()
-
-        async def on_timeout(future):
-            try:
-                future.exception()
-            except CancelledError:
-                pass
-            else:
-                connection.ping_timeout = None
-                await self.remove_connection(connection)
 
-        connection.ping_timeout = timeout = asyncio.create_task(
-            asyncio.sleep(self.PONG_TIMEOUT))
-        timeout.add_done_callback(on_timeout)
+    def _on_ping_timeout(self, connection):
+        logger.info('ping timeout for %s', connection)
+        self._close(connection, 'Ping timeout')
 
-        @self.once('PONG', from_=connection)
-        async def on_pong(*args, **kwargs):
-            connection.ping_timeout = None
-            timeout.cancel()
+    async def _on_pong(self, connection, *params, prefix=None):
+        pass
 
     def send_to(self, connection: Connection, msg: str, *params: str, prefix: str = None):
         return self.send(msg, *params, prefix=prefix, to=connection)
 
+    @property
+    def name(self):
+        """The name of the server, used as the prefix of its own messages."""
+        if self._name_of != (self.host, self.port):
+            self._name_of = (self.host, self.port)
+            self._name = f'{self.host}:{self.port}'
+        return self._name
+
+    def _frame(self, msg, params, prefix):
+        """Serializes a message into a \\r\\n terminated frame, which can be
+        queued as-is on any number of connections.
+
+        Numeric replies are mostly sent with the same parameters over and
+        over, so their frames come from a cache of pre-encoded frames
+        (except for UNCACHED_REPLIES).
+        """
+        if prefix is None:
+            prefix = self.name
+
+        if msg[0].isdigit() and msg not in self.UNCACHED_REPLIES:
+            return frame_cached(msg, params, prefix)
+        return frame_message(msg, *params, prefix=prefix)
+
     def send(self, msg: str, *params: str, prefix: str = None, exclude: Connection = None, to: Connection = None):
         """Serializes a message, and sends it to the appropriate connections.
 
@@ -192,16 +567,58 @@ class Server(MessageListener):
                 Useful when the message should not be echoed back to the client which sent it.
             to (Connection): Optionally send only to a specific connection
         """
-        if prefix is None:
-            prefix = f'{self.host}:{self.port}'
-
-        message = serialize_message(msg, *params, prefix=prefix)
-
         if to is not None:
-            to.send_message(message)
+            if msg in self.PRIORITY_COMMANDS:
+                to.send_message(self._frame(msg, params, prefix), immediate=True, priority=True)
+            else:
+                to.send_message(self._frame(msg, params, prefix))
+            _messages_sent.inc(msg)
         else:
-            for connection in self._connections:
-                if connection == exclude:
-                    continue
+            self.send_to_many(self._connections, msg, *params,
+                              prefix=prefix, exclude=exclude)
+
+    def send_to_many(self, connections, msg: str, *params: str, prefix: str = None,
+                     exclude: Connection = None, route: bool = False, via: Connection = None):
+        """Serializes a message once, and queues the same frame on each of
+        the given connections.
+
+        Users connected to other servers (see links.RemoteUser) are skipped,
+        unless `route` is set. Then the frame is forwarded once over each
+        link which leads to at least one of them, so that their servers
+        can deliver it.
+
+        Args:
+            connections (Iterable[Connection]): The connections to send to
+                (i.e the members of a channel)
+            msg (str): The type of message to send (i.e NICK, PRIVMSG, etc...)
+            *params (str): Any number of parameters to the message.
+            prefix (str): Optional prefix, defaults to the name of the server.
+            exclude (Connection): Optionally exclude a connection from being sent to.
+            route (bool): Forward the message to the servers of remote users
+            via (Connection): The link the message was received from, which
+                it is never forwarded back over
+        """
+        message = self._frame(msg, params, prefix)
+
+        links = None
+        sent = 0
+        for connection in connections:
+            if connection is exclude:
+                continue
 
+            link = connection.link
+            if link is None:
                 connection.send_message(message)
+                sent += 1
+            elif route and link is not via:
+                if links is None:
+                    links = {link}
+                else:
+                    links.add(link)
+
+        if sent:
+            _messages_sent.inc(msg, sent)
+
+        if links:
+            for link in links:
+                link.send_message(message)
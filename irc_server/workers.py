@@ -0,0 +1,140 @@
+import asyncio
+import functools
+import multiprocessing
+import os
+import signal
+import socket
+import tempfile
+
+from irc_core import logger
+from .profiling import Profiler
+
+
+# The signals which start and stop profiling captures (see Profiler)
+PROFILING_SIGNALS = tuple(getattr(signal, name) for name, _ in Profiler.SIGNALS
+                          if hasattr(signal, name))
+
+
+def run_workers(workers, host='', port=6667, messages_per_cycle=32, configure=None):
+    """Runs the server in several processes, which all accept connections on
+    the same port (using SO_REUSEPORT), so the kernel spreads clients across
+    them.
+
+    The workers share their users and channels by linking to each other
+    over a unix socket. Worker 0 accepts a link from every other worker,
+    which keeps the links a spanning tree (see irc_server.links), so each
+    event crosses at most two links.
+
+    Stopping this process (with SIGINT or SIGTERM) stops the workers too, and
+    workers shut down by themselves if this process dies without stopping
+    them, so they never keep the port once it has gone. The profiling
+    signals are forwarded to every worker, so that each captures a profile.
+
+    Args:
+        workers (int): The number of worker processes
+        host (str): The host IP to bind the server to
+        port (int): The port to listen for connections on
+        messages_per_cycle (int): See Server.MESSAGES_PER_CYCLE
+        configure (Callable[[Server, int], None]): Called with the server
+            and index of each worker before it starts, i.e to link worker 0
+            to other servers
+    """
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, 'links.sock')
+
+        # Bound before forking, so the other workers can connect as soon as
+        # they start, even if worker 0 is not accepting yet
+        link_socket = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        link_socket.bind(path)
+        link_socket.listen(workers)
+
+        context = multiprocessing.get_context('fork')
+        processes = [
+            context.Process(target=_run_worker, name=f'worker{index}',
+                            args=(index, workers, host, port, messages_per_cycle,
+                                  link_socket, path, configure))
+            for index in range(workers)
+        ]
+        # Installed before forking so there's no moment at which SIGTERM
+        # would kill this process alone, or a profiling signal would kill it
+        # at all. The workers reset them.
+        previous = {signal.SIGTERM: signal.signal(signal.SIGTERM, _stop)}
+        for signum in PROFILING_SIGNALS:
+            previous[signum] = signal.signal(
+                signum, functools.partial(_forward, processes))
+        try:
+            for process in processes:
+                process.start()
+            link_socket.close()
+
+            for process in processes:
+                process.join()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            for signum, handler in previous.items():
+                signal.signal(signum, handler)
+            for process in processes:
+                if process.pid is not None:
+                    process.terminate()
+                    process.join()
+
+
+def _stop(signum, frame):
+    raise SystemExit(128 + signum)
+
+
+def _forward(processes, signum, frame):
+    for process in processes:
+        if process.pid is not None:
+            try:
+                os.kill(process.pid, signum)
+            except ProcessLookupError:
+                pass  # Already exited
+
+
+def _run_worker(index, workers, host, port, messages_per_cycle, link_socket, path, configure):
+    signal.signal(signal.SIGTERM, signal.SIG_DFL)
+    # Until the worker's profiler handles them
+    for signum in PROFILING_SIGNALS:
+        signal.signal(signum, signal.SIG_IGN)
+    try:
+        asyncio.run(_serve(index, workers, host, port, messages_per_cycle,
+                           link_socket, path, configure))
+    except KeyboardInterrupt:
+        pass
+
+
+async def _serve(index, workers, host, port, messages_per_cycle, link_socket, path, configure):
+    from irc_server import server
+    from irc_server import handlers
+
+    server.host = host
+    server.port = port
+    server.reuse_port = True
+    server.MESSAGES_PER_CYCLE = messages_per_cycle
+    server.links.name = f'worker{index}.{server.name}'
+    if configure is not None:
+        configure(server, index)
+
+    handlers.register.number_of_anons = index - workers
+    handlers.register.anon_step = workers
+
+    if index == 0:
+        server.links.listen(link_socket)
+    else:
+        link_socket.close()
+        server.links.connect(path)
+
+    logger.info('starting worker %s of %s', index, workers)
+    with server:
+        serving = asyncio.ensure_future(server.start())
+        # The sentinel becomes readable once the master process has exited
+        master = multiprocessing.parent_process()
+        asyncio.get_running_loop().add_reader(master.sentinel, serving.cancel)
+        try:
+            await serving
+        except asyncio.CancelledError:
+            if master.is_alive():
+                raise
+            logger.warning('stopping worker %s, since the master process has exited', index)
@@ -1,5 +1,52 @@
 import asyncio
 import argparse
+import socket
+
+from irc_core.logger import configure as configure_logging, logger, trace
+
+
+def link_address(value):
+    """Parses a HOST:PORT link address."""
+    host, _, port = value.rpartition(':')
+    return host or '127.0.0.1', int(port)
+
+
+def configure(server, args, index=0):
+    """Applies the command line arguments to a server (or to the server of
+    worker `index`)."""
+    # Every worker process starts its own logging thread
+    configure_logging(args.log_level, asynchronous=not args.sync_logging)
+    trace.rate = args.trace_rate
+
+    server.MESSAGES_PER_CYCLE = args.messages_per_cycle
+    server.connection_tasks = args.connection_tasks
+    server.EXECUTOR_WORKERS = args.handler_threads
+    server.profiler.directory = args.profile_dir
+    server.profiler.seconds = args.profile_seconds
+
+    if args.flood_rate > 0:
+        server.flood_control.rate = args.flood_rate
+        server.flood_control.burst = args.flood_burst
+    else:
+        server.flood_control = None
+
+    if args.metrics_port is not None:
+        from irc_core.metrics import MetricsExporter
+        server.metrics_exporter = MetricsExporter('127.0.0.1', args.metrics_port + index)
+
+    # Every worker links to the others, so they all need the password
+    server.links.password = args.link_password
+
+    if index != 0:
+        return
+
+    if args.name is not None:
+        server.links.name = args.name
+    if args.link_port is not None:
+        server.links.listen(socket.create_server((args.link_ip, args.link_port)))
+    for address in args.link:
+        server.links.connect(address)
+
 
 async def main(args):
     from irc_server import server
@@ -7,6 +54,7 @@ async def main(args):
     
     server.host = args.ip
     server.port = args.port
+    configure(server, args)
 
     with server:
         await server.start()
@@ -18,8 +66,54 @@ if __name__ == "__main__":
                         help='The IP to bind the server to.')
     parser.add_argument('--port', type=int, default=6667,
                         help='The port to bind the server to.')
+    parser.add_argument('--messages-per-cycle', type=int, default=32,
+                        help='The maximum number of messages handled per connection per cycle.')
+    parser.add_argument('--connection-tasks', action='store_true',
+                        help="Handle each connection's messages in its own task, so slow handlers don't delay other connections.")
+    parser.add_argument('--handler-threads', type=int, default=4,
+                        help='The threads which run handlers bound with executor=True.')
+    parser.add_argument('--flood-rate', type=float, default=4.0,
+                        help='Tokens per second each client may spend on commands (0 disables flood control).')
+    parser.add_argument('--flood-burst', type=float, default=20.0,
+                        help='The most tokens a client may save up for a burst of commands.')
+    parser.add_argument('--metrics-port', type=int, default=None,
+                        help='Serve Prometheus metrics on this local port (worker N uses the port + N).')
+    parser.add_argument('--log-level', type=str.upper, default='DEBUG',
+                        choices=('DEBUG', 'INFO', 'WARNING', 'ERROR', 'CRITICAL'),
+                        help='The lowest level of log messages to write.')
+    parser.add_argument('--sync-logging', action='store_true',
+                        help='Write log messages from the event loop, instead of a background thread.')
+    parser.add_argument('--trace-rate', type=int, default=100,
+                        help='The most received messages traced per second at DEBUG level.')
+    parser.add_argument('--profile-dir', type=str, default='.',
+                        help='Where profiles captured on SIGUSR1 (cProfile) or SIGUSR2 (sampling) are written.')
+    parser.add_argument('--profile-seconds', type=float, default=30.0,
+                        help='How long a profile is captured for, unless the signal is sent again.')
+    parser.add_argument('--workers', type=int, default=1,
+                        help='The number of processes to accept connections with.')
+    parser.add_argument('--name', type=str, default=None,
+                        help='The name of the server on the network (defaults to IP:PORT).')
+    parser.add_argument('--link-port', type=int, default=None,
+                        help='A port to accept links from other servers on.')
+    parser.add_argument('--link-ip', type=str, default='127.0.0.1',
+                        help='The IP to bind the link port to (only local servers can link by default).')
+    parser.add_argument('--link-password', type=str, default=None,
+                        help='The password shared with linked servers (required with --link-port or --link).')
+    parser.add_argument('--link', type=link_address, action='append', default=[],
+                        metavar='HOST:PORT',
+                        help='The link port of a server to link to (may be repeated).')
 
     args = parser.parse_args()
+    if (args.link_port is not None or args.link) and not args.link_password:
+        parser.error('--link-password is required to link servers over TCP')
 
-    asyncio.run(main(args))
-    
+    # Before the handlers are imported, since they log as they are bound. The
+    # rest of logging is configured in each worker, by configure().
+    logger.setLevel(args.log_level)
+
+    if args.workers > 1:
+        from irc_server.workers import run_workers
+        run_workers(args.workers, args.ip, args.port, args.messages_per_cycle,
+                    configure=lambda server, index: configure(server, args, index))
+    else:
+        asyncio.run(main(args))
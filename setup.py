@@ -7,4 +7,9 @@ setuptools.setup(
     url="https://github.com/anthony2v/InternetRelayChat",
     packages=setuptools.find_packages(),
     python_requires=">=3.9",
+    entry_points={
+        "console_scripts": [
+            "irc-loadgen = irc_bench.loadgen:main",
+        ],
+    },
 )
\ No newline at end of file
@@ -0,0 +1,50 @@
+import socket
+from unittest import mock
+
+import pytest
+
+
+def _free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+@pytest.fixture
+def free_port():
+    """Returns a function which finds a local port nothing is listening on."""
+    return _free_port
+
+
+@pytest.fixture
+def clean_registries():
+    """Unregisters every user, channel membership and link once the test
+    is done."""
+    from irc_server import server
+    from irc_server.handlers import register
+
+    yield
+    for conn in list(register.nicknames.connections()):
+        register.nicknames.unregister(conn.nickname, conn)
+        register.channels.remove(conn)
+    for link in list(server.links):
+        server.links.remove(link)
+
+
+@pytest.fixture
+def make_user(clean_registries):
+    """Returns a function which registers a mock user of this server, and
+    optionally joins it to a channel."""
+    from irc_server.handlers import register
+
+    def make_user(nickname, channel=None):
+        conn = mock.MagicMock(link=None, hopcount=0)
+        conn.nickname = nickname
+        conn.username = conn.host = conn.real_name = None
+        conn.registered = True
+        register.nicknames.register(nickname, conn)
+        if channel is not None:
+            register.channels.join(conn, channel)
+        return conn
+
+    return make_user
@@ -0,0 +1,72 @@
+from irc_server.channels import ChannelRegistry
+
+from unittest import mock
+
+
+def test_join_adds_connection_to_channel_members():
+    channels = ChannelRegistry()
+    conn = mock.MagicMock()
+
+    assert channels.join(conn, '#global')
+
+    assert conn in channels.members('#global')
+    assert channels.channels_of(conn) == {'#global'}
+
+
+def test_join_returns_false_when_already_a_member():
+    channels = ChannelRegistry()
+    conn = mock.MagicMock()
+
+    channels.join(conn, '#global')
+    assert not channels.join(conn, '#global')
+
+
+def test_members_of_unknown_channel_is_empty():
+    channels = ChannelRegistry()
+
+    assert not channels.members('#nowhere')
+    assert '#nowhere' not in channels
+
+
+def test_part_removes_connection_from_both_indexes():
+    channels = ChannelRegistry()
+    conn, other = mock.MagicMock(), mock.MagicMock()
+
+    channels.join(conn, '#global')
+    channels.join(other, '#global')
+    channels.join(conn, '#other')
+
+    assert channels.part(conn, '#global')
+
+    assert channels.members('#global') == {other}
+    assert channels.channels_of(conn) == {'#other'}
+    assert not channels.part(conn, '#global')
+
+
+def test_empty_channels_are_removed():
+    channels = ChannelRegistry()
+    conn = mock.MagicMock()
+
+    channels.join(conn, '#global')
+    channels.part(conn, '#global')
+
+    assert '#global' not in channels
+    assert len(channels) == 0
+    assert not channels.channels_of(conn)
+
+
+def test_remove_only_touches_the_connections_channels():
+    channels = ChannelRegistry()
+    conn, other = mock.MagicMock(), mock.MagicMock()
+
+    channels.join(conn, '#a')
+    channels.join(conn, '#b')
+    channels.join(other, '#b')
+    channels.join(other, '#c')
+
+    assert channels.remove(conn) == {'#a', '#b'}
+
+    assert set(channels) == {'#b', '#c'}
+    assert channels.members('#b') == {other}
+    assert not channels.channels_of(conn)
+    assert channels.remove(conn) == set()
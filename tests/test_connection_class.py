@@ -1,4 +1,5 @@
 from irc_core.connections import Connection
+from collections import deque
 import socket
 
 from unittest import mock
@@ -6,18 +7,18 @@ from unittest import mock
 import pytest
 
 
-@mock.patch('irc_core.connections.socket.gethostbyaddr', return_value=('laptop1',))
-def test_connection_gets_host_name(mock_gethostbyaddr):
+@mock.patch('socket.gethostbyaddr', return_value=('laptop1',))
+def test_connection_uses_ip_as_host_without_resolving_it(mock_gethostbyaddr):
     conn = Connection(mock.MagicMock(), ('127.0.0.1', 50000))
     
-    mock_gethostbyaddr.assert_called_with('127.0.0.1')
-    assert conn.host == 'laptop1'
+    mock_gethostbyaddr.assert_not_called()
+    assert conn.host == '127.0.0.1'
 
 
 def test_next_message_returns_first_message_in__incoming_buffer_and_removes_it():
     conn = Connection(mock.MagicMock(), ('127.0.0.1', 50000))
 
-    conn._incoming_messages = [b'first message', b'second message']
+    conn._incoming_messages = deque([b'first message', b'second message'])
     assert conn.next_message() == b'first message'
     assert conn.next_message() == b'second message'
 
@@ -25,18 +26,18 @@ def test_next_message_returns_first_message_in__incoming_buffer_and_removes_it()
         conn.next_message()
 
 
-def test_has_message_calls__get_messages():
+@mock.patch.object(Connection, '_get_messages')
+def test_has_message_calls__get_messages(mock_get_messages):
     conn = Connection(mock.MagicMock(), ('127.0.0.1', 50000))
-    conn._get_messages = mock.MagicMock()
 
     conn.has_messages()
 
-    conn._get_messages.assert_called()
+    mock_get_messages.assert_called()
 
 
-def test_has_messages_returns_true_in_there_are_messages_in_the__incoming_buffer():
+@mock.patch.object(Connection, '_get_messages')
+def test_has_messages_returns_true_in_there_are_messages_in_the__incoming_buffer(mock_get_messages):
     conn = Connection(mock.MagicMock(), ('127.0.0.1', 50000))
-    conn._get_messages = mock.MagicMock()
 
     conn._incoming_messages = [b'message 1']
     assert conn.has_messages()
@@ -49,18 +50,35 @@ def test_read_bytes_appends_new_bytes_to__incoming_buffer():
     mock_socket = mock.MagicMock()
     conn = Connection(mock_socket, ('127.0.0.1', 50000))
     
-    conn._incoming_buffer = b'abcd'
-    mock_socket.recv.return_value = b'efgh'
+    def recv_into(buffer):
+        buffer[:4] = b'efgh'
+        return 4
+
+    conn._incoming_buffer = bytearray(b'abcd')
+    mock_socket.recv_into.side_effect = recv_into
 
     conn._read_bytes()
     assert conn._incoming_buffer == b'abcdefgh'
 
 
+def test_read_bytes_reads_up_to_read_size_bytes():
+    s1, s2 = socket.socketpair()
+    s1.setblocking(False)
+    s2.setblocking(False)
+
+    conn = Connection(s2, ('127.0.0.1', 50000), read_size=4)
+
+    s1.sendall(b'abcdefgh')
+
+    conn._read_bytes()
+    assert conn._incoming_buffer == b'abcd'
+
+
 def test_read_bytes_raises_EOFError_when_no_new_bytes_are_returned():
     mock_socket = mock.MagicMock()
     conn = Connection(mock_socket, ('127.0.0.1', 50000))
     
-    mock_socket.recv.return_value=''
+    mock_socket.recv_into.return_value = 0
 
     with pytest.raises(EOFError):
         conn._read_bytes()
@@ -109,7 +127,7 @@ def test_get_messages_can_be_called_even_when_no_bytes_are_ready_to_be_read():
 
     conn = Connection(s2, ('127.0.0.1', 50000))
     conn._get_messages()
-    assert conn._incoming_messages == []
+    assert list(conn._incoming_messages) == []
     assert conn._incoming_buffer == b''
 
 
@@ -124,7 +142,7 @@ def test_get_messages_splits_messages_at_crlf_and_adds_then_to_messages():
 
     conn._get_messages()
 
-    assert conn._incoming_messages == [b'abcd', b'efgh']
+    assert list(conn._incoming_messages) == [b'abcd', b'efgh']
 
 
 def test_get_messages_puts_any_bytes_after_last_crlf_into__incoming_buffer():
@@ -138,22 +156,39 @@ def test_get_messages_puts_any_bytes_after_last_crlf_into__incoming_buffer():
 
     conn._get_messages()
 
-    assert conn._incoming_messages == [b'abcd']
+    assert list(conn._incoming_messages) == [b'abcd']
     assert conn._incoming_buffer == b'efgh'
 
 
+def test_get_messages_joins_terminator_split_across_reads():
+    s1, s2 = socket.socketpair()
+    s1.setblocking(False)
+    s2.setblocking(False)
+
+    conn = Connection(s2, ('127.0.0.1', 50000))
+
+    s1.sendall(b'abcd\r')
+    conn._get_messages()
+    assert list(conn._incoming_messages) == []
+
+    s1.sendall(b'\nefgh\r\n')
+    conn._get_messages()
+    assert list(conn._incoming_messages) == [b'abcd', b'efgh']
+    assert conn._incoming_buffer == b''
+
+
 def test_get_messages_bytes_already_in__incoming_buffer_are_prefixed_to_first_message():
     s1, s2 = socket.socketpair()
     s1.setblocking(False)
     s2.setblocking(False)
 
     conn = Connection(s2, ('127.0.0.1', 50000))
-    conn._incoming_buffer = b'abcd'
+    conn._incoming_buffer = bytearray(b'abcd')
 
     s1.sendall(b'efgh\r\n')
 
     conn._get_messages()
-    assert conn._incoming_messages == [b'abcdefgh']
+    assert list(conn._incoming_messages) == [b'abcdefgh']
     assert conn._incoming_buffer == b''
 
 
@@ -175,12 +210,30 @@ def test_send_message_raises_value_error_when_len_msg_gt_512():
 def test_flush_messages_sends_all_buffered_messages():
     conn = Connection(mock.MagicMock(), ('127.0.0.1', 50000))
 
+    conn._socket.send.return_value = 12
+
     conn.send_message(b'abcd')
     conn.send_message(b'efgh')
 
-    conn.flush_messages()
+    assert conn.flush_messages()
 
-    conn._socket.sendall.assert_called_with(b'abcd\r\nefgh\r\n')
+    conn._socket.send.assert_called_once()
+    assert bytes(conn._socket.send.call_args.args[0]) == b'abcd\r\nefgh\r\n'
+    assert conn.outgoing_bytes == 0
+
+
+def test_flush_messages_keeps_bytes_the_socket_did_not_accept():
+    conn = Connection(mock.MagicMock(), ('127.0.0.1', 50000))
+    conn._socket.send.return_value = 6
+
+    conn.send_message(b'abcd')
+    conn.send_message(b'efgh')
+
+    assert not conn.flush_messages()
+    assert conn.outgoing_bytes == 6
+
+    assert conn.flush_messages()
+    assert bytes(conn._socket.send.call_args.args[0]) == b'efgh\r\n'
 
 def test_flush_messages_with_socket_pair():
     s1, s2 = socket.socketpair()
@@ -196,3 +249,116 @@ def test_flush_messages_with_socket_pair():
 
     data = s1.recv(512)
     assert data == b'abcd\r\nefgh\r\n'
+
+
+def test_flush_messages_does_not_block_when_peer_is_not_reading():
+    s1, s2 = socket.socketpair()
+    s1.setblocking(False)
+    s2.setblocking(False)
+
+    conn = Connection(s2, ('127.0.0.1', 50000))
+
+    # Queue more than the socket buffers can hold
+    for _ in range(100000):
+        conn.send_message(b'x' * 510)
+        if not conn.flush_messages():
+            break
+
+    assert not conn.flush_messages()
+    assert 0 < conn.outgoing_bytes <= Connection.SENDQ_LIMIT
+
+
+@mock.patch.object(Connection, 'SENDQ_LIMIT', 1024)
+def test_send_message_drops_queue_once_sendq_limit_is_exceeded():
+    conn = Connection(mock.MagicMock(), ('127.0.0.1', 50000))
+    conn.output_listener = mock.MagicMock()
+
+    conn.send_message(b'x' * 510)
+    conn.send_message(b'x' * 510)
+    assert not conn.sendq_exceeded
+
+    conn.send_message(b'x' * 510)
+    assert conn.sendq_exceeded
+    assert conn.outgoing_bytes == 0
+
+    conn.send_message(b'x' * 510)
+    assert conn.outgoing_bytes == 0
+    assert conn.output_listener.call_count == 2
+
+
+def test_idle_connection_holds_no_buffers():
+    s1, s2 = socket.socketpair()
+    s1.setblocking(False)
+    s2.setblocking(False)
+
+    conn = Connection(s2, ('127.0.0.1', 50000))
+    other = Connection(mock.MagicMock(), ('127.0.0.1', 50001))
+    assert conn._incoming_messages is other._incoming_messages
+    assert conn._outgoing_messages is other._outgoing_messages
+
+    s1.sendall(b'NICK Wiz\r\nUSER a b c d\r\n')
+    conn.read_messages()
+    while conn.pending_messages:
+        conn.next_message()
+    conn.send_message(b'PING :irc.example.net')
+    assert conn.flush_messages()
+
+    assert conn._incoming_buffer == b''
+    assert conn._incoming_messages is other._incoming_messages
+    assert conn._outgoing_messages is other._outgoing_messages
+    assert not hasattr(conn, '__dict__')
+
+
+def test_immediate_message_is_written_only_when_nothing_else_is_queued():
+    conn = Connection(mock.MagicMock(), ('127.0.0.1', 50000))
+    conn.output_listener = mock.MagicMock()
+    conn._socket.send.side_effect = len
+
+    conn.send_message(b'PING', immediate=True)
+    conn._socket.send.assert_called_once_with(b'PING\r\n')
+    conn.output_listener.assert_not_called()
+
+    conn.send_message(b'PRIVMSG #global hi')
+    conn.send_message(b'PING', immediate=True)
+    assert conn._socket.send.call_count == 1
+    assert conn.outgoing_bytes == len(b'PRIVMSG #global hi\r\nPING\r\n')
+
+
+def test_priority_messages_are_written_after_the_partly_written_message():
+    conn = Connection(mock.MagicMock(), ('127.0.0.1', 50000))
+    written = []
+    conn._socket.send.side_effect = lambda data: written.append(bytes(data[:5])) or 5
+
+    conn.send_message(b'PRIVMSG a :one')
+    conn.send_message(b'PRIVMSG a :two')
+    assert not conn.flush_messages()
+
+    conn.send_message(b'PING 1', priority=True)
+    conn.send_message(b'PRIVMSG a :three')
+    conn.send_message(b'PING 2', priority=True)
+
+    conn._socket.send.side_effect = lambda data: written.append(bytes(data)) or len(data)
+    assert conn.flush_messages()
+    assert b''.join(written) == (b'PRIVMSG a :one\r\nPING 1\r\nPING 2\r\n'
+                                 b'PRIVMSG a :two\r\nPRIVMSG a :three\r\n')
+    assert conn.outgoing_bytes == 0
+
+
+def test_priority_pending_until_the_priority_message_is_written():
+    conn = Connection(mock.MagicMock(), ('127.0.0.1', 50000))
+    conn._socket.send.side_effect = lambda data: 5
+
+    conn.send_message(b'PRIVMSG a :one')
+    assert not conn.priority_pending
+    assert not conn.flush_messages()
+
+    conn.send_message(b'PING 1', priority=True)
+    assert conn.priority_pending
+    conn.flush_messages()  # The rest of the partly written message
+    conn.flush_messages()
+    assert conn.priority_pending
+
+    conn._socket.send.side_effect = len
+    conn.send_message(b'PRIVMSG a :two')
+    assert conn.flush_messages()
+    assert not conn.priority_pending
@@ -0,0 +1,133 @@
+from collections import deque
+
+from irc_core.connections import Connection
+from irc_server.flood import FloodControl
+from irc_server.server import Server
+
+import asyncio
+import pytest
+from unittest import mock
+
+
+class Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+@pytest.fixture
+def clock():
+    clock = Clock()
+    with mock.patch('irc_server.flood.time.monotonic', clock):
+        yield clock
+
+
+def make_connection(*messages):
+    connection = Connection(mock.MagicMock(), ('127.0.0.1', 50000))
+    connection._incoming_messages = deque(messages)
+    return connection
+
+
+def test_cost_is_looked_up_from_the_raw_command():
+    flood_control = FloodControl(costs={'PRIVMSG': 2, 'PONG': 0.5}, default_cost=1)
+
+    assert flood_control.cost(b'PRIVMSG #global :hi there') == 2
+    assert flood_control.cost(b':Drew PRIVMSG #global hi') == 2
+    assert flood_control.cost(b'PONG') == 0.5
+    assert flood_control.cost(b'WHO') == 1
+    assert flood_control.cost(b':prefix-only') == 1
+
+
+def test_burst_is_allowed_then_limited_to_the_rate(clock):
+    flood_control = FloodControl(rate=2, burst=4, costs={}, penalty=0)
+    connection = object()
+
+    assert [flood_control.delay(connection, b'PRIVMSG a b') for _ in range(4)] == [0] * 4
+    assert flood_control.delay(connection, b'PRIVMSG a b') == 0.5
+
+    clock.now += 0.5
+    assert flood_control.delay(connection, b'PRIVMSG a b') == 0
+
+
+def test_bucket_does_not_refill_past_the_burst(clock):
+    flood_control = FloodControl(rate=10, burst=2, costs={}, penalty=0)
+    connection = object()
+    flood_control.delay(connection, b'JOIN #a')
+
+    clock.now += 60
+    delays = [flood_control.delay(connection, b'JOIN #a') for _ in range(3)]
+
+    assert delays[:2] == [0, 0] and delays[2] > 0
+
+
+def test_penalty_is_added_when_over_the_limit(clock):
+    flood_control = FloodControl(rate=1, burst=1, costs={}, penalty=3)
+    connection = object()
+    flood_control.delay(connection, b'NICK a')
+
+    assert flood_control.delay(connection, b'NICK a') == 4
+
+
+def test_command_costing_more_than_the_burst_is_allowed_with_a_full_bucket(clock):
+    flood_control = FloodControl(rate=1, burst=2, costs={'NICK': 5})
+
+    assert flood_control.delay(object(), b'NICK a') == 0
+
+
+@pytest.mark.asyncio
+async def test_server_holds_messages_over_the_limit(clock):
+    server = Server(flood_control=FloodControl(rate=1, burst=2, costs={}, penalty=0))
+    server._loop = asyncio.get_running_loop()
+    server.handle_message = mock.AsyncMock()
+
+    connection = make_connection(b'one', b'two', b'three')
+    server._watched.add(connection)
+
+    await server._process_connection(connection)
+
+    assert server.handle_message.call_count == 2
+    assert connection.pending_messages == 1
+    assert connection in server._held
+
+    # More messages are not handled while the connection is held
+    await server._process_connection(connection)
+    assert server.handle_message.call_count == 2
+
+    server._held.pop(connection).cancel()
+
+
+@pytest.mark.asyncio
+async def test_server_disconnects_connection_which_keeps_flooding(clock):
+    server = Server(flood_control=FloodControl(rate=1, burst=1, costs={}, max_backlog=3))
+    server._loop = asyncio.get_running_loop()
+    server._wakeup = asyncio.Event()
+    server.handle_message = mock.AsyncMock()
+
+    connection = make_connection(b'one', b'two')
+    server._watched.add(connection)
+    await server._process_connection(connection)
+    assert connection in server._held
+
+    connection._incoming_messages.extend([b'three', b'four', b'five'])
+    await server._process_connection(connection)
+
+    assert server._closing == {connection: 'Excess Flood'}
+    assert connection.pending_messages == 0
+
+    server._held.pop(connection).cancel()
+
+
+@pytest.mark.asyncio
+async def test_links_are_not_flood_controlled(clock):
+    server = Server(flood_control=FloodControl(rate=1, burst=1, costs={}))
+    server.links.handle_message = mock.AsyncMock()
+
+    link = make_connection(b'one', b'two', b'three')
+    server._watched.add(link)
+    server.links.add(link, 'peer')
+
+    await server._process_connection(link)
+
+    assert server.links.handle_message.call_count == 3
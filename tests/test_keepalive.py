@@ -0,0 +1,135 @@
+import asyncio
+import time
+from irc_server.keepalive import KeepaliveScheduler
+
+import pytest
+from unittest import mock
+
+
+def make_connection():
+    connection = mock.MagicMock()
+    connection.last_message_time = time.time()
+    return connection
+
+
+def make_scheduler(**kwargs):
+    ping, timeout = mock.MagicMock(), mock.MagicMock()
+    scheduler = KeepaliveScheduler(ping, timeout, interval=0.05,
+                                   pong_timeout=0.05, jitter=0, **kwargs)
+    return scheduler, ping, timeout
+
+
+@pytest.mark.asyncio
+async def test_idle_connection_is_pinged_after_interval():
+    scheduler, ping, timeout = make_scheduler()
+    connection = make_connection()
+
+    scheduler.track(connection)
+    await asyncio.sleep(0.02)
+    ping.assert_not_called()
+
+    await asyncio.sleep(0.05)
+    ping.assert_called_once_with(connection)
+
+    scheduler.stop()
+
+
+@pytest.mark.asyncio
+async def test_active_connection_is_not_pinged():
+    scheduler, ping, timeout = make_scheduler()
+    connection = make_connection()
+
+    scheduler.track(connection)
+    for _ in range(6):
+        await asyncio.sleep(0.02)
+        connection.last_message_time = time.time()
+
+    ping.assert_not_called()
+    scheduler.stop()
+
+
+@pytest.mark.asyncio
+async def test_connection_which_does_not_reply_times_out():
+    scheduler, ping, timeout = make_scheduler()
+    connection = make_connection()
+
+    scheduler.track(connection)
+    await asyncio.sleep(0.15)
+
+    ping.assert_called_once_with(connection)
+    timeout.assert_called_once_with(connection)
+    assert len(scheduler) == 0
+
+
+@pytest.mark.asyncio
+async def test_connection_which_replies_to_ping_is_kept_alive():
+    scheduler, ping, timeout = make_scheduler()
+    connection = make_connection()
+    ping.side_effect = lambda c: setattr(c, 'last_message_time', time.time() + 0.01)
+
+    scheduler.track(connection)
+    await asyncio.sleep(0.2)
+
+    assert ping.call_count >= 2
+    timeout.assert_not_called()
+    scheduler.stop()
+
+
+@pytest.mark.asyncio
+async def test_ping_still_queued_on_the_connection_does_not_time_out():
+    pending = {'ping': True}
+    scheduler, ping, timeout = make_scheduler(ping_pending=lambda c: pending['ping'])
+    scheduler.pong_timeout = 0.02
+    scheduler.interval = 0.1
+    connection = make_connection()
+
+    scheduler.track(connection)
+    await asyncio.sleep(0.16)
+    ping.assert_called_once_with(connection)
+    timeout.assert_not_called()
+
+    # Written at last, and answered
+    pending['ping'] = False
+    connection.last_message_time = time.time()
+    await asyncio.sleep(0.03)
+    timeout.assert_not_called()
+    scheduler.stop()
+
+
+@pytest.mark.asyncio
+async def test_ping_which_is_never_written_times_out_after_an_interval():
+    scheduler, ping, timeout = make_scheduler(ping_pending=lambda c: True)
+    scheduler.pong_timeout = 0.02
+    connection = make_connection()
+
+    scheduler.track(connection)
+    await asyncio.sleep(0.2)
+
+    ping.assert_called_once_with(connection)
+    timeout.assert_called_once_with(connection)
+
+
+@pytest.mark.asyncio
+async def test_forgotten_connection_is_not_pinged():
+    scheduler, ping, timeout = make_scheduler()
+    connection = make_connection()
+
+    scheduler.track(connection)
+    scheduler.forget(connection)
+    await asyncio.sleep(0.1)
+
+    ping.assert_not_called()
+    assert len(scheduler) == 0
+
+
+@pytest.mark.asyncio
+async def test_one_timer_serves_all_connections():
+    scheduler, ping, timeout = make_scheduler()
+
+    with mock.patch.object(asyncio.get_running_loop(), 'call_later',
+                           wraps=asyncio.get_running_loop().call_later) as call_later:
+        for _ in range(100):
+            scheduler.track(make_connection())
+
+    assert call_later.call_count == 1
+    scheduler.stop()
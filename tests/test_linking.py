@@ -0,0 +1,114 @@
+"""Links several server processes on loopback ports, A <- B <- C, and checks
+that users on the servers at either end can see each other."""
+import os
+import re
+import socket
+import subprocess
+import sys
+import time
+
+import pytest
+
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def start_server(name, port, link_port, link=None):
+    command = [sys.executable, 'server.py', '--port', str(port),
+               '--name', name, '--link-port', str(link_port), '--link-password', 'secret']
+    if link is not None:
+        command += ['--link', f'127.0.0.1:{link}']
+    return subprocess.Popen(command, cwd=ROOT,
+                            stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+
+
+class Client:
+    def __init__(self, port, nickname):
+        for _ in range(50):
+            try:
+                self.sock = socket.create_connection(('127.0.0.1', port))
+                break
+            except ConnectionRefusedError:
+                time.sleep(0.1)
+        self.sock.settimeout(0.1)
+        self.received = b''
+        self.send(f'NICK {nickname}', f'USER {nickname} host server :{nickname}')
+
+    def send(self, *lines):
+        self.sock.sendall(''.join(f'{line}\r\n' for line in lines).encode())
+
+    def wait_for(self, expected, timeout=5):
+        return self.wait_until(lambda: expected in self.received, timeout)
+
+    def sees(self, nickname, timeout=5):
+        """Waits for a user to be seen in #global, either joining it or
+        in the list of its members."""
+        pattern = re.compile(
+            rb':%s JOIN #global|353 #global :[^\r]*\b%s\b' % (nickname, nickname))
+        return self.wait_until(lambda: pattern.search(self.received), timeout)
+
+    def wait_until(self, condition, timeout):
+        deadline = time.time() + timeout
+        while not condition() and time.time() < deadline:
+            try:
+                self.received += self.sock.recv(65536)
+            except socket.timeout:
+                pass
+        return bool(condition())
+
+    def close(self):
+        self.sock.close()
+
+
+@pytest.fixture
+def network(free_port):
+    ports = {name: (free_port(), free_port()) for name in 'abc'}
+    servers = {
+        'a': start_server('a.test', *ports['a']),
+        'b': start_server('b.test', *ports['b'], link=ports['a'][1]),
+        'c': start_server('c.test', *ports['c'], link=ports['b'][1]),
+    }
+    yield servers, {name: port for name, (port, _) in ports.items()}
+    for process in servers.values():
+        process.terminate()
+        process.wait()
+
+
+def test_users_on_linked_servers_can_message_each_other(network):
+    servers, ports = network
+    alice, carol = Client(ports['a'], 'alice'), Client(ports['c'], 'carol')
+    try:
+        # Each is introduced to the other, and seen in #global
+        assert alice.sees(b'carol')
+        assert carol.sees(b'alice')
+
+        alice.send('PRIVMSG carol :hello from a')
+        assert carol.wait_for(b':alice PRIVMSG carol :hello from a\r\n')
+
+        carol.send('PRIVMSG #global :hello from c')
+        assert alice.wait_for(b':carol PRIVMSG #global :hello from c\r\n')
+
+        alice.send('NICK alicia')
+        assert carol.wait_for(b':alice NICK alicia\r\n')
+        carol.send('PRIVMSG alicia :renamed')
+        assert alice.wait_for(b':carol PRIVMSG alicia renamed\r\n')
+    finally:
+        alice.close()
+        carol.close()
+
+
+def test_netsplit_removes_users_behind_the_split(network):
+    servers, ports = network
+    alice, carol = Client(ports['a'], 'alice'), Client(ports['c'], 'carol')
+    try:
+        assert alice.sees(b'carol')
+        assert carol.sees(b'alice')
+
+        servers['b'].terminate()
+        servers['b'].wait()
+
+        assert alice.wait_for(b':carol QUIT :a.test b.test\r\n')
+        assert carol.wait_for(b':alice QUIT :c.test b.test\r\n')
+    finally:
+        alice.close()
+        carol.close()
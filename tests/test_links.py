@@ -0,0 +1,199 @@
+from irc_server import server
+from irc_server.links import RemoteUser
+from irc_server.handlers import links, messaging, register
+
+import pytest
+from unittest import mock
+
+
+pytestmark = pytest.mark.usefixtures('clean_registries')
+
+
+def make_link(name='peer'):
+    link = mock.MagicMock(link=None)
+    server.links.add(link, name)
+    return link
+
+
+def sent(conn):
+    return [call.args[0] for call in conn.send_message.call_args_list]
+
+
+@pytest.mark.asyncio
+async def test_introduced_user_is_registered_and_propagated():
+    link, other = make_link(), make_link('other')
+
+    await links.on_nick(link, 'Wiz', '1', 'wiz', 'tolsun.oulu.fi', 'Jarkko')
+
+    user = register.nicknames.get('wiz')
+    assert isinstance(user, RemoteUser)
+    assert user.link is link and user.hopcount == 1
+    assert sent(other) == [b'NICK Wiz 2 wiz tolsun.oulu.fi Jarkko\r\n']
+    assert sent(link) == []
+
+
+@pytest.mark.asyncio
+async def test_colliding_introduction_is_killed(make_user):
+    make_user('Wiz')
+    link = make_link()
+
+    await links.on_nick(link, 'wiz', '1', 'wiz', 'host', 'Other')
+
+    assert sent(link)[0].endswith(b' KILL wiz :Nickname collision\r\n')
+    assert register.nicknames.get('wiz').link is None
+
+
+@pytest.mark.asyncio
+async def test_direct_message_to_remote_user_is_forwarded_over_its_link(make_user):
+    sender = make_user('Angel')
+    link = make_link()
+    await links.on_nick(link, 'Wiz', '1')
+
+    await messaging.relay_private_messages(sender, b'Wiz', b'Hello!')
+
+    assert sent(link) == [b':Angel PRIVMSG Wiz Hello!\r\n']
+
+
+@pytest.mark.asyncio
+async def test_channel_message_is_forwarded_once_per_link(make_user):
+    sender = make_user('Angel', channel='#global')
+    link = make_link()
+    for nickname in ('Wiz', 'Kilroy'):
+        await links.on_nick(link, nickname, '1')
+        await links.on_join(link, '#global', prefix=nickname)
+    link.send_message.reset_mock()
+
+    await messaging.relay_private_messages(sender, b'#global', b'Hi all')
+
+    assert sent(link) == [b':Angel PRIVMSG #global :Hi all\r\n']
+
+
+@pytest.mark.asyncio
+async def test_messages_from_a_link_are_not_sent_back_over_it(make_user):
+    local = make_user('Angel', channel='#global')
+    link, other = make_link(), make_link('other')
+    await links.on_nick(link, 'Wiz', '1')
+    await links.on_join(link, '#global', prefix='Wiz')
+    await links.on_nick(other, 'Kilroy', '1')
+    await links.on_join(other, '#global', prefix='Kilroy')
+    link.send_message.reset_mock()
+    other.send_message.reset_mock()
+
+    await links.relay_private_messages(link, b'#global', b'Hi all', prefix='Wiz')
+
+    frame = b':Wiz PRIVMSG #global :Hi all\r\n'
+    assert local.send_message.call_args.args[0] == frame
+    assert sent(other) == [frame]
+    assert sent(link) == []
+
+
+@pytest.mark.asyncio
+async def test_messages_about_users_from_another_direction_are_ignored(make_user):
+    make_user('Angel', channel='#global')
+    link = make_link()
+
+    await links.on_quit(link, 'Bye', prefix='Angel')
+
+    assert register.nicknames.get('Angel') is not None
+
+
+@pytest.mark.asyncio
+async def test_losing_a_link_removes_the_users_behind_it(make_user):
+    local = make_user('Angel', channel='#global')
+    link, other = make_link(), make_link('other')
+    await links.on_nick(link, 'Wiz', '1')
+    await links.on_join(link, '#global', prefix='Wiz')
+    server._connections = [local]
+
+    await links.split(link)
+
+    assert register.nicknames.get('Wiz') is None
+    assert register.channels.members('#global') == {local}
+    assert local.send_message.call_args.args[0].startswith(b':Wiz QUIT ')
+    assert any(frame.startswith(b':Wiz QUIT ') for frame in sent(other))
+    assert b' SQUIT peer ' in sent(other)[-1]
+    server._connections = []
+
+
+@pytest.mark.asyncio
+async def test_server_burst_introduces_users_and_channels(make_user):
+    make_user('Angel', channel='#global')
+    link = mock.MagicMock(link=None)
+    server.links.add(link)
+
+    server.links.propagate('JOIN', '#other', prefix='Angel')
+    assert sent(link) == []  # Not introduced yet
+
+    await links.on_server(link, 'peer', '1', 'IRC server')
+
+    assert sent(link)[0].startswith(b'NICK Angel 1 ')
+    assert sent(link)[1].endswith(b'JOIN #global\r\n')
+    assert server.links.peer_name(link) == 'peer'
+
+
+@pytest.mark.asyncio
+async def test_servers_behind_a_link_are_introduced_and_split():
+    link, other = make_link(), make_link('other')
+    links.links.add_server('peer', link, 1, links.links.name)
+    await links.on_server(link, 'far', '2', 'Far away', prefix='peer')
+    await links.on_server(link, 'farther', '3', 'Farther', prefix='far')
+
+    assert links.links.servers['farther'] == (link, 3, 'far', 'Farther')
+    assert sent(other) == [b':peer SERVER far 3 :Far away\r\n',
+                           b':far SERVER farther 4 Farther\r\n']
+
+    await links.on_squit(link, 'far', 'Ping timeout', prefix='peer')
+
+    assert list(links.links.servers) == ['peer']
+    assert sent(other)[-1] == b':peer SQUIT far :Ping timeout\r\n'
+    links.links.remove_server('peer')
+
+
+@pytest.mark.asyncio
+async def test_server_which_is_already_known_drops_the_link():
+    link = make_link()
+    links.links.add_server('peer', link, 1, links.links.name)
+    loop = mock.MagicMock(link=None)
+    server.links.add(loop)
+
+    with mock.patch.object(server, 'remove_connection', new=mock.AsyncMock()) as remove:
+        await links.on_server(loop, 'peer', '1', 'IRC server')
+
+    remove.assert_called_once_with(loop)
+    assert links.links.servers['peer'][0] is link
+    links.links.remove_server('peer')
+
+
+@pytest.mark.asyncio
+async def test_link_which_has_not_introduced_itself_can_only_handshake(make_user):
+    make_user('Wiz')
+    link = mock.MagicMock(link=None)
+    server.links.add(link)
+
+    await server.links.handle_message(link, b'KILL Wiz :pwned')
+    await server.links.handle_message(link, b'NICK Angel 1 angel host Angel')
+
+    assert register.nicknames.get('wiz').link is None
+    assert register.nicknames.get('angel') is None
+
+
+@pytest.mark.asyncio
+async def test_server_must_send_the_shared_password():
+    server.links.password = 'secret'
+    try:
+        link, impostor = mock.MagicMock(link=None), mock.MagicMock(link=None)
+        server.links.add(link)
+        server.links.add(impostor)
+
+        with mock.patch.object(server, 'remove_connection', new=mock.AsyncMock()) as remove:
+            await server.links.handle_message(impostor, b'PASS wrong')
+            await server.links.handle_message(impostor, b'SERVER impostor 1 :IRC server')
+            await server.links.handle_message(link, b'PASS secret')
+            await server.links.handle_message(link, b'SERVER peer 1 :IRC server')
+
+        remove.assert_called_once_with(impostor)
+        assert server.links.peer_name(impostor) is None
+        assert server.links.peer_name(link) == 'peer'
+    finally:
+        server.links.password = None
+        links.links.remove_server('peer')
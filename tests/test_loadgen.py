@@ -0,0 +1,64 @@
+import json
+import os
+import time
+
+from irc_bench import loadgen
+
+import pytest
+
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def test_percentiles_use_nearest_rank():
+    samples = list(range(1, 1001))
+
+    assert loadgen.percentile(samples, 0.5) == 500
+    assert loadgen.percentile(samples, 0.99) == 990
+    assert loadgen.percentile(samples, 0.999) == 999
+    assert loadgen.percentile([], 0.5) is None
+
+
+def test_summary_is_in_milliseconds():
+    summary = loadgen.summarize([0.002, 0.001, 0.003])
+
+    assert summary['count'] == 3
+    assert summary['p50_ms'] == pytest.approx(2)
+    assert summary['max_ms'] == pytest.approx(3)
+
+
+@pytest.mark.asyncio
+async def test_client_measures_delivery_latency_and_answers_pings():
+    stats = loadgen.Stats()
+    client = loadgen.LoadClient('127.0.0.1', 6667, 'lg0', stats)
+    client.send = lambda *lines: sent.extend(lines)
+    sent = []
+
+    stamp = time.monotonic_ns() - 5_000_000
+    client._handle(b':lg1 PRIVMSG #global :%d xxxx\r\n' % stamp)
+    client._handle(b':server PING\r\n')
+    client._handle(b':server 366 #global\r\n')
+    client._handle(b':lg2 QUIT :Ping timeout\r\n')
+
+    assert stats.received == 1
+    assert stats.latencies[0] >= 0.005
+    assert sent == ['PONG']
+    assert client.registered.is_set()
+    assert stats.ping_timeouts == {b'lg2'}
+
+
+def test_loadgen_runs_against_a_spawned_server(tmp_path, monkeypatch, free_port):
+    monkeypatch.chdir(ROOT)
+    output = tmp_path / 'results.json'
+
+    loadgen.main(['--spawn', '--port', str(free_port()), '--clients', '5',
+                  '--workload', 'chatter', '--duration', '1', '--rate', '2',
+                  '--output', str(output)])
+
+    results = json.loads(output.read_text())
+    assert results['registered'] == 5
+    assert results['errors'] == 0
+    assert results['ping_timeouts'] == 0
+    assert results['received'] == results['sent'] * 4
+    assert results['delivery_latency']['p99_ms'] >= results['delivery_latency']['p50_ms']
+    assert results['server']['rss_max_bytes'] > 0
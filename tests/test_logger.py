@@ -0,0 +1,58 @@
+from irc_core.logger import DroppingQueueHandler, RateLimitedTrace
+
+import logging
+import queue
+
+
+class Unformattable:
+    def __str__(self):
+        raise AssertionError('formatted when it should have been skipped')
+
+
+def test_queue_handler_formats_records_before_queueing_them():
+    handler = DroppingQueueHandler(queue.Queue())
+    params = ['#global']
+    record = logging.LogRecord('irc_core', logging.INFO, __file__, 1,
+                               'received %s', (params,), None)
+
+    handler.handle(record)
+    params.append('changed later')
+
+    queued = handler.queue.get_nowait()
+    assert queued.getMessage() == "received ['#global']"
+    assert queued.args is None
+
+
+def test_queue_handler_drops_records_when_full():
+    handler = DroppingQueueHandler(queue.Queue(1))
+    for i in range(3):
+        handler.handle(logging.LogRecord('irc_core', logging.INFO, __file__, 1,
+                                         'message %s', (i,), None))
+
+    assert handler.queue.qsize() == 1
+    assert handler.dropped == 2
+
+
+def test_trace_is_rate_limited():
+    records = []
+    logger = logging.getLogger('test_trace_is_rate_limited')
+    logger.setLevel(logging.DEBUG)
+    logger.propagate = False
+    logger.debug = lambda msg, *args: records.append(msg % args)
+    trace = RateLimitedTrace(logger, rate=3)
+
+    for i in range(10):
+        trace('received %s', i)
+
+    assert records == ['received 0', 'received 1', 'received 2']
+    assert trace.suppressed == 7
+
+
+def test_trace_is_skipped_below_debug():
+    logger = logging.getLogger('test_trace_is_skipped_below_debug')
+    logger.setLevel(logging.INFO)
+    trace = RateLimitedTrace(logger, rate=3)
+
+    trace('received %s', Unformattable())
+
+    assert trace._count == 0
@@ -1,7 +1,10 @@
 from irc_core.connections import Connection
-from irc_core.parser import parse_message
+from irc_core.parser import parse_message, Message
 from unittest import mock
-from irc_core.message_listener import MessageListener
+from irc_core.message_listener import MessageListener, ConnectionInfo
+from irc_core import message_listener
+from concurrent.futures import ThreadPoolExecutor
+import threading
 import pytest
 import asyncio
 
@@ -12,7 +15,7 @@ def test_message_listeners_can_be_bound():
 
     listener.on('NICK')(mock_fn)
 
-    listener.general_message_handlers['NICK'](mock.MagicMock())
+    listener.general_message_handlers['NICK'][0](mock.MagicMock())
     mock_fn.assert_called()
 
 def test_handle_message_calls_parser():
@@ -21,7 +24,7 @@ def test_handle_message_calls_parser():
     mock_connection = mock.MagicMock(spec = Connection)
     msg = b"NICK\r\n"
 
-    with mock.patch("irc_core.message_listener.parse_message", return_value = (None, None, None)) as parse_message:
+    with mock.patch("irc_core.message_listener.parse_message", return_value = Message('NICK', None, [], msg)) as parse_message:
         asyncio.run(listener.handle_message(
             connection = mock_connection,
             message = msg
@@ -79,3 +82,158 @@ def test_parse_message_returns_command_name():
     assert command == "PRIVMSG"
     assert prefix == "Angel"
     assert params == ["Wiz", "Hello are you receiving this message ?"]
+
+
+@pytest.mark.asyncio
+async def test_multiple_listeners_are_called_in_order_they_were_bound():
+    listener = MessageListener()
+    calls = []
+
+    @listener.on('NICK')
+    async def first(connection, *params, prefix=None):
+        calls.append('first')
+
+    @listener.on('NICK')
+    async def second(connection, *params, prefix=None):
+        calls.append('second')
+
+    await listener.handle_message(mock.MagicMock(), b'NICK Wiz')
+
+    assert calls == ['first', 'second']
+
+
+@pytest.mark.asyncio
+async def test_specific_listeners_are_called_after_general_listeners():
+    listener = MessageListener()
+    connection = mock.MagicMock()
+    calls = []
+
+    @listener.on('PONG', from_=connection)
+    async def specific(connection, *params, prefix=None):
+        calls.append('specific')
+
+    @listener.on('PONG')
+    async def general(connection, *params, prefix=None):
+        calls.append('general')
+
+    await listener.handle_message(connection, b'PONG')
+    await listener.handle_message(mock.MagicMock(), b'PONG')
+
+    assert calls == ['general', 'specific', 'general']
+
+
+@pytest.mark.asyncio
+async def test_off_only_unbinds_the_given_listener():
+    listener = MessageListener()
+    first, second = mock.AsyncMock(), mock.AsyncMock()
+
+    listener.on('NICK')(first)
+    listener.on('NICK')(second)
+    listener.off('NICK', first)
+
+    await listener.handle_message(mock.MagicMock(), b'NICK Wiz')
+
+    first.assert_not_called()
+    second.assert_called()
+
+
+@pytest.mark.asyncio
+async def test_raw_listener_is_given_undecoded_params():
+    listener = MessageListener()
+    raw, decoded = mock.AsyncMock(), mock.AsyncMock()
+
+    listener.on('PRIVMSG', raw=True)(raw)
+    await listener.handle_message(mock.MagicMock(), b'PRIVMSG Wiz :caf\xc3\xa9')
+    raw.assert_called_with(mock.ANY, b'Wiz', b'caf\xc3\xa9', prefix=None)
+
+    listener.on('PRIVMSG')(decoded)
+    await listener.handle_message(mock.MagicMock(), b'PRIVMSG Wiz :caf\xc3\xa9')
+    raw.assert_called_with(mock.ANY, b'Wiz', b'caf\xc3\xa9', prefix=None)
+    decoded.assert_called_with(mock.ANY, 'Wiz', 'caf\xe9', prefix=None)
+
+    listener.off('PRIVMSG', raw)
+    assert raw not in listener.raw_handlers
+
+
+@pytest.mark.asyncio
+async def test_once_listener_is_only_called_once():
+    listener = MessageListener()
+    mock_fn = mock.AsyncMock()
+
+    listener.once('PONG')(mock_fn)
+
+    await listener.handle_message(mock.MagicMock(), b'PONG')
+    await listener.handle_message(mock.MagicMock(), b'PONG')
+
+    mock_fn.assert_called_once()
+    assert 'PONG' not in listener.general_message_handlers
+
+
+@pytest.mark.asyncio
+async def test_executor_listener_runs_in_pool_and_replies_from_the_loop():
+    listener = MessageListener()
+    connection = Connection(mock.MagicMock(), ('127.0.0.1', 50000))
+    connection.nickname = 'Wiz'
+    calls = []
+
+    @listener.on('CHECK', executor=ThreadPoolExecutor(1))
+    def check(info, word, prefix=None):
+        calls.append((threading.current_thread() is threading.main_thread(), info, word))
+        return [('NOTICE', info.nickname, 'checked ' + word)]
+
+    await listener.handle_message(connection, b'CHECK hello')
+
+    [(on_main_thread, info, word)] = calls
+    assert not on_main_thread
+    assert isinstance(info, ConnectionInfo) and info.nickname == 'Wiz'
+    assert word == 'hello'
+    assert list(connection._outgoing_messages) == [b'NOTICE Wiz :checked hello\r\n']
+
+
+@pytest.mark.asyncio
+async def test_executor_listeners_keep_the_order_of_messages():
+    listener = MessageListener()
+    connection = Connection(mock.MagicMock(), ('127.0.0.1', 50000))
+
+    @listener.on('ECHO', executor=True)
+    def echo(info, word, prefix=None):
+        return [('ECHO', word)]
+
+    for word in ('one', 'two', 'three'):
+        await listener.handle_message(connection, b'ECHO ' + word.encode())
+
+    assert list(connection._outgoing_messages) == [
+        b'ECHO one\r\n', b'ECHO two\r\n', b'ECHO three\r\n']
+    listener.off('ECHO', echo)
+    assert 'ECHO' not in listener.general_message_handlers
+
+
+@pytest.mark.asyncio
+async def test_executor_saturation_is_counted_from_the_given_pool_size():
+    listener = MessageListener()
+    executor = ThreadPoolExecutor(1)
+    release = threading.Event()
+
+    @listener.on('SLOW', executor=executor, workers=1)
+    def slow(info, prefix=None):
+        release.wait()
+
+    before = message_listener._executor_saturated.value('SLOW')
+    first = asyncio.ensure_future(listener.handle_message(mock.MagicMock(), b'SLOW'))
+    await asyncio.sleep(0.01)
+    second = asyncio.ensure_future(listener.handle_message(mock.MagicMock(), b'SLOW'))
+    await asyncio.sleep(0.01)
+    release.set()
+    await asyncio.gather(first, second)
+
+    assert message_listener._executor_saturated.value('SLOW') == before + 1
+    assert executor not in message_listener._executor_jobs
+
+
+@pytest.mark.asyncio
+async def test_executor_listener_must_not_be_a_coroutine():
+    listener = MessageListener()
+
+    listener.on('CHECK', executor=True)(mock.AsyncMock())
+
+    assert 'CHECK' not in listener.general_message_handlers
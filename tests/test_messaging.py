@@ -0,0 +1,59 @@
+from irc_server import server
+from irc_server.handlers import messaging, register
+
+import pytest
+
+
+pytestmark = pytest.mark.usefixtures('clean_registries')
+
+
+@pytest.mark.asyncio
+async def test_privmsg_is_delivered_directly_to_nickname(make_user):
+    sender, receiver = make_user('Angel'), make_user('Wiz')
+
+    await messaging.relay_private_messages(sender, b'wiz', b'Hello!')
+
+    receiver.send_message.assert_called_with(b':Angel PRIVMSG wiz Hello!\r\n')
+
+
+@pytest.mark.asyncio
+async def test_privmsg_is_delivered_to_each_target_in_list(make_user):
+    sender = make_user('Angel')
+    wiz = make_user('Wiz')
+    kilroy = make_user('Kilroy', channel='#global')
+
+    await messaging.relay_private_messages(sender, b'Wiz,#global', b'Hi all')
+
+    wiz.send_message.assert_called_with(b':Angel PRIVMSG Wiz :Hi all\r\n')
+    kilroy.send_message.assert_called_with(b':Angel PRIVMSG #global :Hi all\r\n')
+
+
+@pytest.mark.asyncio
+async def test_privmsg_to_unknown_nickname_replies_no_such_nick(make_user):
+    sender = make_user('Angel')
+
+    await messaging.relay_private_messages(sender, b'nobody', b'Hello?')
+
+    frame = sender.send_message.call_args.args[0]
+    assert b' 401 nobody :No such nick/channel' in frame
+
+
+@pytest.mark.asyncio
+async def test_notice_to_unknown_nickname_is_dropped_silently(make_user):
+    sender = make_user('Angel')
+
+    await messaging.relay_notices(sender, b'nobody', b'Hello?')
+
+    sender.send_message.assert_not_called()
+
+
+def test_names_replies_fit_in_a_frame(make_user):
+    joined = make_user('Angel', channel='#global')
+    for i in range(200):
+        make_user(f'user{i}', channel='#global')
+
+    register.send_names_to_connection(joined, '#global')
+
+    frames = [call.args[0] for call in joined.send_message.call_args_list]
+    assert len(frames) > 2
+    assert all(len(frame) <= 512 for frame in frames)
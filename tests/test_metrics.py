@@ -0,0 +1,132 @@
+from irc_core.metrics import Counter, Gauge, Histogram, MetricsRegistry, MetricsExporter
+
+import asyncio
+import pytest
+
+
+def test_counter_counts_by_label():
+    counter = Counter('messages_total', 'Messages', label='command')
+    counter.inc('PRIVMSG')
+    counter.inc('PRIVMSG', 2)
+    counter.inc('NICK')
+
+    assert counter.value('PRIVMSG') == 3
+    assert list(counter.samples()) == [
+        ('messages_total', 'PRIVMSG', 3), ('messages_total', 'NICK', 1)]
+
+
+def test_gauge_is_collected_when_read():
+    connections = []
+    gauge = Gauge('connections', 'Connections', collect=lambda: len(connections))
+    connections.append(object())
+
+    assert gauge.value() == 1
+    assert list(gauge.samples()) == [('connections', None, 1)]
+
+
+def test_histogram_buckets_are_cumulative():
+    histogram = Histogram('latency_seconds', 'Latency', buckets=(0.1, 1))
+    for value in (0.05, 0.1, 0.5, 5):
+        histogram.observe(value)
+
+    assert histogram.count() == 4
+    assert histogram.sum() == pytest.approx(5.65)
+    assert [value for _, _, value in histogram.samples()][:3] == [2, 3, 4]
+
+
+def test_registry_renders_prometheus_text():
+    registry = MetricsRegistry()
+    registry.counter('messages_total', 'Messages received', label='command').inc('PRIVMSG', 5)
+    registry.histogram('latency_seconds', 'Latency', buckets=(0.5,)).observe(0.25)
+    registry.gauge('members', 'Channel members', label='channel',
+                   collect=lambda: {'#global': 3})
+
+    assert registry.render() == '\n'.join([
+        '# HELP messages_total Messages received',
+        '# TYPE messages_total counter',
+        'messages_total{command="PRIVMSG"} 5',
+        '# HELP latency_seconds Latency',
+        '# TYPE latency_seconds histogram',
+        'latency_seconds_bucket{le="0.5"} 1',
+        'latency_seconds_bucket{le="+Inf"} 1',
+        'latency_seconds_sum 0.25',
+        'latency_seconds_count 1',
+        '# HELP members Channel members',
+        '# TYPE members gauge',
+        'members{channel="#global"} 3',
+        '',
+    ])
+
+
+def test_label_values_are_escaped():
+    registry = MetricsRegistry()
+    registry.counter('total', 'Total', label='name').inc('a"b\\c')
+
+    assert list(registry.samples()) == ['total{name="a\\"b\\\\c"} 1']
+
+
+@pytest.mark.asyncio
+async def test_exporter_serves_metrics_over_http():
+    registry = MetricsRegistry()
+    registry.counter('messages_total', 'Messages').inc()
+    exporter = MetricsExporter('127.0.0.1', 0, registry)
+    await exporter.start()
+    port = exporter._server.sockets[0].getsockname()[1]
+
+    reader, writer = await asyncio.open_connection('127.0.0.1', port)
+    writer.write(b'GET /metrics HTTP/1.1\r\nHost: localhost\r\n\r\n')
+    response = await reader.read()
+    writer.close()
+    exporter.close()
+
+    assert response.startswith(b'HTTP/1.1 200 OK\r\n')
+    assert b'text/plain; version=0.0.4' in response
+    assert response.endswith(b'messages_total 1\n')
+
+
+@pytest.mark.asyncio
+async def test_exporter_drops_oversized_requests():
+    errors = []
+    asyncio.get_running_loop().set_exception_handler(lambda loop, context: errors.append(context))
+    exporter = MetricsExporter('127.0.0.1', 0, MetricsRegistry())
+    await exporter.start()
+    port = exporter._server.sockets[0].getsockname()[1]
+
+    reader, writer = await asyncio.open_connection('127.0.0.1', port)
+    writer.write(b'GET /' + b'a' * 100000)
+    response = await reader.read()
+    writer.close()
+    exporter.close()
+
+    assert response == b''
+    assert errors == []
+
+
+@pytest.mark.asyncio
+async def test_stats_replies_with_messages_received_by_command():
+    from unittest import mock
+    from irc_server import server
+    from irc_server.handlers import stats
+
+    connection = mock.MagicMock(link=None, registered=True)
+    await server.handle_message(connection, b'STATS m')
+
+    frames = [call.args[0] for call in connection.send_message.call_args_list]
+    assert any(b' 212 STATS ' in frame for frame in frames)
+    assert frames[-1].endswith(b' 219 m :End of STATS report\r\n')
+
+
+@pytest.mark.asyncio
+async def test_stats_replies_are_not_kept_in_the_frame_cache():
+    import sys
+    from unittest import mock
+    from irc_server import server
+    from irc_server.handlers import stats
+
+    connection = mock.MagicMock(link=None, registered=True)
+    module = sys.modules['irc_server.server']
+    with mock.patch.object(module, 'frame_cached', wraps=module.frame_cached) as frame_cached:
+        await server.handle_message(connection, b'STATS')
+
+    assert connection.send_message.call_count > 1
+    assert [call.args[0] for call in frame_cached.call_args_list] == ['219']
@@ -0,0 +1,46 @@
+from irc_server.nicknames import NicknameRegistry, nickname_to_lowercase
+
+from unittest import mock
+
+
+def test_nickname_to_lowercase_uses_irc_case_mapping():
+    assert nickname_to_lowercase('Wiz[]\\') == 'wiz{}|'
+
+
+def test_register_maps_nickname_to_connection():
+    nicknames = NicknameRegistry()
+    conn = mock.MagicMock()
+
+    assert nicknames.register('Wiz', conn)
+
+    assert nicknames.get('wiz') is conn
+    assert 'WIZ' in nicknames
+
+
+def test_register_fails_when_nickname_is_owned_by_another_connection():
+    nicknames = NicknameRegistry()
+    conn, other = mock.MagicMock(), mock.MagicMock()
+
+    nicknames.register('Wiz[', conn)
+
+    assert not nicknames.register('wiz{', other)
+    assert nicknames.get('Wiz[') is conn
+
+
+def test_unregister_only_releases_nicknames_owned_by_the_connection():
+    nicknames = NicknameRegistry()
+    conn, other = mock.MagicMock(), mock.MagicMock()
+
+    nicknames.register('Wiz', conn)
+    nicknames.unregister('Wiz', other)
+    assert nicknames.get('Wiz') is conn
+
+    nicknames.unregister('WIZ', conn)
+    assert nicknames.get('Wiz') is None
+    assert len(nicknames) == 0
+
+
+def test_unregister_ignores_connections_without_a_nickname():
+    nicknames = NicknameRegistry()
+
+    nicknames.unregister(None, mock.MagicMock())
@@ -1,6 +1,6 @@
 import pytest
 
-from irc_core.parser import serialize_message
+from irc_core.parser import serialize_message, parse_message, frame_message, frame_cached
 
 def test_no_params_no_prefix():
     assert serialize_message('NICK') == b'NICK'
@@ -29,3 +29,66 @@ def test_spaces_in_param_that_is_not_the_last_one():
     with pytest.raises(ValueError):
         serialize_message(
             'NICK', 'one two', 'three')
+
+def test_parse_message_returns_message_with_undecoded_params():
+    message = parse_message(b':Angel PRIVMSG Wiz :Hello are you receiving this message ?\r\n')
+
+    assert message.command == 'PRIVMSG'
+    assert message.prefix == 'Angel'
+    assert message.raw_params == [b'Wiz', b'Hello are you receiving this message ?']
+    assert message.params == ['Wiz', 'Hello are you receiving this message ?']
+
+def test_parse_message_accepts_memoryview():
+    with memoryview(b'NICK Wiz') as view:
+        assert parse_message(view).params == ['Wiz']
+
+def test_parse_message_only_treats_space_colon_as_start_of_trailing():
+    assert parse_message(b'USER guest 0 a:b :Real Name').params == [
+        'guest', '0', 'a:b', 'Real Name']
+
+def test_parse_message_keeps_empty_trailing_param():
+    assert parse_message(b'PRIVMSG #global :').params == ['#global', '']
+
+def test_parse_message_ignores_repeated_spaces():
+    assert parse_message(b':WiZ  NICK   Kilroy').params == ['Kilroy']
+
+def test_parse_message_of_empty_line_has_empty_command():
+    assert parse_message(b'').command == ''
+
+def test_parse_message_interns_command_tokens():
+    assert parse_message(b'PRIVMSG #a :x').command is parse_message(b'PRIVMSG #b :y').command
+
+def test_parse_message_replaces_invalid_utf8():
+    assert parse_message(b'PRIVMSG #a :\xff').params[1] == '�'
+
+def test_parse_message_replaces_invalid_utf8_in_one_param_only():
+    assert parse_message(b'USER \xc3 0 * :Real Name').params == ['�', '0', '*', 'Real Name']
+
+def test_parse_message_decodes_params_containing_line_feeds():
+    assert parse_message(b'PRIVMSG #a :one\ntwo').params == ['#a', 'one\ntwo']
+
+def test_bytes_params_serialize_like_str_params():
+    assert serialize_message(
+        'PRIVMSG', b'#global', b'hello there', prefix='Angel') == b':Angel PRIVMSG #global :hello there'
+
+def test_relayed_bytes_text_may_follow_str_params():
+    assert serialize_message(
+        'PRIVMSG', '#global', b'hello there', prefix='Angel') == b':Angel PRIVMSG #global :hello there'
+
+def test_bytes_params_containing_cr_or_lf_are_rejected():
+    with pytest.raises(ValueError):
+        serialize_message('PRIVMSG', b'#global', b'one\r\ntwo')
+
+def test_frame_message_adds_terminator():
+    assert frame_message('NICK', 'one', prefix='WiZ') == b':WiZ NICK one\r\n'
+    assert frame_message('NICK') == b'NICK\r\n'
+
+def test_frame_cached_reuses_pre_encoded_frame():
+    frame = frame_cached('366', ('#global',), 'irc.example.net')
+
+    assert frame == serialize_message('366', '#global', prefix='irc.example.net') + b'\r\n'
+    assert frame_cached('366', ('#global',), 'irc.example.net') is frame
+
+
+def test_parse_message_with_only_a_prefix_has_no_command():
+    assert tuple(parse_message(b':irc.example.net')) == ('', 'irc.example.net', [])
@@ -0,0 +1,98 @@
+import asyncio
+import pstats
+import time
+
+from irc_core.message_listener import MessageListener
+from irc_server.profiling import Profiler
+
+import pytest
+
+
+def make_listener():
+    listener = MessageListener()
+
+    @listener.on('PRIVMSG')
+    async def relay(connection, receivers=None, msg=None, prefix=None):
+        time.sleep(0.01)
+
+    return listener
+
+
+async def handle(listener, count):
+    for _ in range(count):
+        await listener.handle_message(object(), b':Angel PRIVMSG #global :hi')
+
+
+@pytest.mark.asyncio
+async def test_cprofile_capture_is_written_with_phases_and_handlers(tmp_path):
+    listener = make_listener()
+    profiler = Profiler([listener], directory=str(tmp_path))
+
+    profiler.start('cprofile')
+    await handle(listener, 5)
+    path, summary = profiler.stop()
+
+    assert not profiler.running
+    assert path.endswith('.pstats')
+    stats = pstats.Stats(path)
+    assert any(name == 'relay' for _, _, name in stats.stats)
+
+    text = open(summary).read()
+    for phase in ('read', 'parse', 'dispatch', 'flush'):
+        assert phase in text
+    assert 'PRIVMSG' in text and 'relay' in text
+
+
+@pytest.mark.asyncio
+async def test_sample_capture_is_written_as_collapsed_stacks(tmp_path):
+    listener = make_listener()
+    profiler = Profiler([listener], directory=str(tmp_path), interval=0.001)
+
+    profiler.start('sample')
+    await handle(listener, 10)
+    path, summary = profiler.stop()
+
+    lines = open(path).read().splitlines()
+    assert lines
+    for line in lines:
+        stack, count = line.rsplit(' ', 1)
+        assert int(count) > 0
+    assert any('handle_message' in line and 'relay' in line for line in lines)
+
+    text = open(summary).read()
+    assert 'dispatch' in text and 'relay' in text
+
+
+@pytest.mark.asyncio
+async def test_capture_stops_on_its_own(tmp_path):
+    profiler = Profiler([], directory=str(tmp_path))
+    profiler._loop = asyncio.get_running_loop()
+
+    profiler.start('sample', seconds=0.05)
+    assert profiler.running
+    await asyncio.sleep(0.2)
+
+    assert not profiler.running
+    assert len(list(tmp_path.iterdir())) == 2
+
+
+@pytest.mark.parametrize('mode', ['cprofile', 'sample'])
+def test_capture_which_can_not_be_written_is_discarded(tmp_path, mode):
+    profiler = Profiler([], directory=str(tmp_path / 'missing'))
+
+    profiler.start(mode)
+    assert profiler.stop() == []
+
+    assert not profiler.running
+    profiler.start(mode)
+    profiler.stop()
+
+
+@pytest.mark.asyncio
+async def test_install_creates_the_profile_directory(tmp_path):
+    profiler = Profiler([], directory=str(tmp_path / 'profiles'))
+
+    profiler.install(asyncio.get_running_loop())
+    profiler.uninstall()
+
+    assert (tmp_path / 'profiles').is_dir()
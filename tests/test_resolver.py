@@ -0,0 +1,97 @@
+import asyncio
+import time
+from irc_core.resolver import HostnameResolver
+
+import pytest
+from unittest import mock
+
+
+@pytest.mark.asyncio
+async def test_resolve_returns_hostname_from_lookup():
+    lookup = mock.MagicMock(return_value=('laptop1', [], ['127.0.0.1']))
+    resolver = HostnameResolver(lookup=lookup)
+
+    assert await resolver.resolve('127.0.0.1') == 'laptop1'
+    lookup.assert_called_with('127.0.0.1')
+
+
+@pytest.mark.asyncio
+async def test_resolve_caches_results():
+    lookup = mock.MagicMock(return_value=('laptop1', [], []))
+    resolver = HostnameResolver(lookup=lookup)
+
+    await resolver.resolve('127.0.0.1')
+    assert await resolver.resolve('127.0.0.1') == 'laptop1'
+
+    assert lookup.call_count == 1
+
+
+@pytest.mark.asyncio
+async def test_resolve_caches_failed_lookups():
+    lookup = mock.MagicMock(side_effect=OSError('unknown host'))
+    resolver = HostnameResolver(lookup=lookup)
+
+    assert await resolver.resolve('10.0.0.1') is None
+    assert await resolver.resolve('10.0.0.1') is None
+
+    assert lookup.call_count == 1
+
+
+@pytest.mark.asyncio
+async def test_resolve_looks_up_again_once_ttl_expires():
+    lookup = mock.MagicMock(return_value=('laptop1', [], []))
+    resolver = HostnameResolver(lookup=lookup, ttl=10)
+
+    with mock.patch('irc_core.resolver.time.monotonic', return_value=100.0):
+        await resolver.resolve('127.0.0.1')
+    with mock.patch('irc_core.resolver.time.monotonic', return_value=111.0):
+        await resolver.resolve('127.0.0.1')
+
+    assert lookup.call_count == 2
+
+
+@pytest.mark.asyncio
+async def test_least_recently_used_address_is_evicted():
+    lookup = mock.MagicMock(side_effect=lambda ip: ('host-' + ip, [], []))
+    resolver = HostnameResolver(lookup=lookup, max_size=2)
+
+    await resolver.resolve('10.0.0.1')
+    await resolver.resolve('10.0.0.2')
+    await resolver.resolve('10.0.0.1')
+    await resolver.resolve('10.0.0.3')
+
+    lookup.reset_mock()
+    await resolver.resolve('10.0.0.1')
+    lookup.assert_not_called()
+
+    await resolver.resolve('10.0.0.2')
+    lookup.assert_called_with('10.0.0.2')
+
+
+@pytest.mark.asyncio
+async def test_resolve_gives_up_after_timeout():
+    def slow_lookup(ip):
+        time.sleep(0.5)
+        return ('laptop1', [], [])
+
+    resolver = HostnameResolver(lookup=slow_lookup, timeout=0.05)
+
+    start = time.monotonic()
+    assert await resolver.resolve('127.0.0.1') is None
+    assert time.monotonic() - start < 0.4
+
+
+@pytest.mark.asyncio
+async def test_concurrent_lookups_of_same_address_are_shared():
+    def slow_lookup(ip):
+        time.sleep(0.05)
+        return ('laptop1', [], [])
+
+    lookup = mock.MagicMock(side_effect=slow_lookup)
+    resolver = HostnameResolver(lookup=lookup)
+
+    results = await asyncio.gather(
+        *(resolver.resolve('127.0.0.1') for _ in range(10)))
+
+    assert results == ['laptop1'] * 10
+    assert lookup.call_count == 1
@@ -1,6 +1,9 @@
 import asyncio
 import socket
+from collections import deque
 from irc_server.server import Server
+from irc_core.connections import Connection
+from irc_core.resolver import HostnameResolver
 
 import pytest
 from unittest import mock
@@ -9,31 +12,46 @@ def test_server_send_sends_message_to_all_connections_when_no_exclude():
     server = Server()
 
     server._connections = [
-        mock.MagicMock() for _ in range(5)
+        mock.MagicMock(link=None) for _ in range(5)
     ]
 
     server.send('PING')
 
     for conn in server._connections:
-        conn.send_message.asset_called_with(b'::6667 PING')
+        conn.send_message.assert_called_with(b'::6667 PING\r\n')
 
 def test_server_send_sends_message_to_all_connections_except_the_one_specified_by_exclude():
     server = Server()
 
     exclude = mock.MagicMock()
     server._connections = [
-        mock.MagicMock() for _ in range(5)
+        mock.MagicMock(link=None) for _ in range(5)
     ] + [exclude]
 
     server.send('PING', exclude=exclude)
 
     for conn in server._connections:
         if conn != exclude:
-            conn.send_message.assert_called_with(b'::6667 PING')
+            conn.send_message.assert_called_with(b'::6667 PING\r\n')
         else:
             conn.send_message.assert_not_called()
 
 
+def test_send_to_many_queues_the_same_frame_on_each_connection():
+    server = Server()
+
+    sender = mock.MagicMock()
+    members = [mock.MagicMock(link=None) for _ in range(5)] + [sender]
+
+    server.send_to_many(members, 'PRIVMSG', '#global', 'hello there',
+                        prefix='Drew', exclude=sender)
+
+    frames = [conn.send_message.call_args.args[0] for conn in members[:-1]]
+    assert frames[0] == b':Drew PRIVMSG #global :hello there\r\n'
+    assert all(frame is frames[0] for frame in frames)
+    sender.send_message.assert_not_called()
+
+
 @pytest.mark.asyncio
 async def test_remove_connection():
     server = Server()
@@ -129,4 +147,148 @@ async def test_server_writes_back_messages():
             pass
 
 
+@pytest.mark.asyncio
+async def test_process_connection_handles_pipelined_messages_in_order():
+    server = Server()
+    server.handle_message = mock.AsyncMock()
+
+    connection = Connection(mock.MagicMock(), ('127.0.0.1', 50000))
+    connection._incoming_messages = deque([b'NICK Drew', b'USER a b c d', b'PRIVMSG #global hi'])
+    server._watched.add(connection)
+
+    await server._process_connection(connection)
+
+    assert [c.args[1] for c in server.handle_message.call_args_list] == [
+        b'NICK Drew', b'USER a b c d', b'PRIVMSG #global hi']
+
+
+@pytest.mark.asyncio
+async def test_process_connection_stops_at_messages_per_cycle():
+    server = Server()
+    server.MESSAGES_PER_CYCLE = 2
+    server.handle_message = mock.AsyncMock()
+
+    connection = Connection(mock.MagicMock(), ('127.0.0.1', 50000))
+    connection._incoming_messages = deque([b'one', b'two', b'three'])
+    server._watched.add(connection)
+
+    await server._process_connection(connection)
+
+    assert server.handle_message.call_count == 2
+    assert connection.pending_messages == 1
+
+
+@pytest.mark.asyncio
+async def test_server_disconnects_client_which_does_not_read():
+    with Server('0.0.0.0', port=6667) as server:
+        server_task = asyncio.create_task(server.start())
+
+        s = socket.create_connection(('0.0.0.0', 6667))
+        await asyncio.sleep(0.1)
+
+        connection = server._connections[0]
+        with mock.patch.object(Connection, 'SENDQ_LIMIT', 256 * 1024):
+            for _ in range(100000):
+                server.send_to(connection, 'PRIVMSG', '#global', 'x' * 400)
+                assert connection.outgoing_bytes <= Connection.SENDQ_LIMIT
+                await asyncio.sleep(0)
+                if connection not in server._connections:
+                    break
+
+        assert server._connections == []
+
+        s.close()
+
+        server_task.cancel()
+        try:
+            await server_task
+        except:
+            pass
+
+
+@pytest.mark.asyncio
+async def test_server_resolves_hostname_of_new_connections_in_background():
+    resolver = HostnameResolver(lookup=lambda ip: ('laptop1', [], [ip]))
+    with Server('0.0.0.0', port=6667, resolver=resolver) as server:
+        server_task = asyncio.create_task(server.start())
+
+        s = socket.create_connection(('0.0.0.0', 6667))
+        await asyncio.sleep(0.1)
+
+        assert server._connections[0].host == 'laptop1'
+
+        s.close()
+
+        server_task.cancel()
+        try:
+            await server_task
+        except:
+            pass
+
+
+def make_ready(server, *messages):
+    sock = mock.MagicMock()
+    sock.send.side_effect = len
+    connection = Connection(sock, ('127.0.0.1', 50000))
+    connection._incoming_messages = deque(messages)
+    connection.output_listener = server._output_listener
+    server._watched.add(connection)
+    server._readable[connection] = None
+    return connection
+
+
+@pytest.mark.asyncio
+async def test_connection_tasks_flush_without_waiting_for_slow_handlers():
+    server = Server(connection_tasks=True)
+    server._loop = asyncio.get_running_loop()
+    server._wakeup = asyncio.Event()
+    release = asyncio.Event()
+
+    async def handle_message(connection, message):
+        if message == b'SLOW':
+            await release.wait()
+        else:
+            server.send_to(connection, 'PONG')
+
+    server.handle_message = handle_message
+    slow = make_ready(server, b'SLOW')
+    fast = make_ready(server, b'PING')
+    server._wakeup.set()
+
+    task = asyncio.create_task(server._process_messages())
+    await asyncio.sleep(0.01)
 
+    fast._socket.send.assert_called_once()
+    assert slow in server._connection_tasks
+    assert fast not in server._connection_tasks
+
+    release.set()
+    await asyncio.sleep(0.01)
+    assert server._connection_tasks == {}
+    task.cancel()
+
+
+@pytest.mark.parametrize('connection_tasks', [False, True])
+@pytest.mark.asyncio
+async def test_server_keeps_processing_after_a_handler_raises(connection_tasks):
+    server = Server(connection_tasks=connection_tasks)
+    server._loop = asyncio.get_running_loop()
+    server._wakeup = asyncio.Event()
+    handled = []
+
+    async def handle_message(connection, message):
+        if message == b'BAD':
+            raise RuntimeError('handler failed')
+        handled.append(message)
+
+    server.handle_message = handle_message
+    make_ready(server, b'BAD', b'AFTER')
+    make_ready(server, b'OTHER')
+    server._wakeup.set()
+
+    task = asyncio.create_task(server._process_messages())
+    await asyncio.sleep(0.01)
+
+    assert sorted(handled) == [b'AFTER', b'OTHER']
+    assert not task.done()
+    task.cancel()
@@ -0,0 +1,76 @@
+"""Runs the server with several worker processes, and checks that they don't
+outlive the master process."""
+import os
+import signal
+import socket
+import subprocess
+import sys
+import time
+
+import pytest
+
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def accepts(port):
+    try:
+        socket.create_connection(('127.0.0.1', port), timeout=1).close()
+        return True
+    except OSError:
+        return False
+
+
+def wait_until(condition, timeout=10):
+    deadline = time.time() + timeout
+    while not condition() and time.time() < deadline:
+        time.sleep(0.1)
+    return condition()
+
+
+@pytest.fixture
+def master(tmp_path, free_port):
+    port = free_port()
+    log = tmp_path / 'server.log'
+    with open(log, 'w') as output:
+        process = subprocess.Popen(
+            [sys.executable, 'server.py', '--ip', '127.0.0.1', '--port', str(port),
+             '--workers', '2', '--log-level', 'INFO',
+             '--profile-dir', str(tmp_path), '--profile-seconds', '0.2'],
+            cwd=ROOT, stdout=output, stderr=subprocess.STDOUT)
+        # Until then, the workers ignore the profiling signals
+        assert wait_until(lambda: log.read_text().count('server is ready') == 2)
+        yield process, port
+        process.kill()
+        process.wait()
+
+
+@pytest.mark.parametrize('signum', [signal.SIGTERM, signal.SIGINT])
+def test_stopping_the_master_stops_the_workers(master, signum):
+    process, port = master
+
+    process.send_signal(signum)
+
+    process.wait(timeout=10)
+    assert wait_until(lambda: not accepts(port))
+
+
+def test_workers_stop_when_the_master_is_killed(master):
+    process, port = master
+
+    process.kill()
+
+    process.wait(timeout=10)
+    assert wait_until(lambda: not accepts(port))
+
+
+@pytest.mark.parametrize('signum', [signal.SIGUSR1, signal.SIGUSR2])
+def test_profiling_signal_is_forwarded_to_every_worker(master, tmp_path, signum):
+    process, port = master
+
+    process.send_signal(signum)
+
+    # A summary is written by each worker, named after its pid
+    assert wait_until(lambda: len({path.name.split('-')[1] for path in tmp_path.glob('*.txt')}) == 2)
+    assert process.poll() is None
+    assert accepts(port)